@@ -13,6 +13,12 @@ source scripts/install.sh
 
 . ./$PYENV/bin/activate
 
+if [ "$DB_BACKEND" == "sqlite" ]; then
+  echo "Embedded database: $DB_FILE"
+  mkdir -p $(dirname $DB_FILE)
+  exit 0
+fi
+
 docker volume create pgdata-$1
 docker run -d -it \
     --name argus-$1 \
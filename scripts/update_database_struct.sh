@@ -12,5 +12,7 @@ source etc/secrets.env
 . ./$PYENV/bin/activate
 
 src/manage.py db init
+# the options are unique by name and section
+src/manage.py dedupe_options
 src/manage.py db migrate
 src/manage.py db upgrade
\ No newline at end of file
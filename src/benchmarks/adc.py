@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+'''
+Benchmark reading the sensor channels of the ADC topologies.
+
+The chips are mock MCP3008 devices waiting for the duration of a transfer
+(like the SPI driver, without holding the interpreter lock). The same number
+of chips are distributed on 1..n buses, the sampling rate should grow with
+the number of the buses.
+
+    PYTHONPATH=src python -m benchmarks.adc --chips 4 --buses 4 --transfer 100
+'''
+import argparse
+import json
+import os
+from time import perf_counter, sleep
+
+import benchmarks.fixtures  # noqa: F401 default configuration
+from monitoring.adapters import adc, sensor
+from monitoring.adapters.sensor import SensorAdapter
+
+
+class TransferMockMCP3008(object):
+
+    # duration of reading a channel (seconds)
+    TRANSFER_TIME = 0.0001
+
+    def __init__(self, channel=None, **options):
+        self._channel = channel
+
+    @property
+    def value(self):
+        sleep(TransferMockMCP3008.TRANSFER_TIME)
+        return 0.1
+
+
+def create_adapter(chip_count, bus_count):
+    '''Adapter with the chips distributed on the hardware buses'''
+    os.environ["ADC_BUSES"] = ",".join("hw:%d" % bus for bus in range(bus_count))
+    os.environ["ADC_CHIPS"] = ",".join("%d:%d:%d" % (chip % bus_count, chip // bus_count, adc.CHIP_CHANNELS)
+                                       for chip in range(chip_count))
+    SensorAdapter.IO_NUMBER = chip_count * adc.CHIP_CHANNELS
+    return SensorAdapter()
+
+
+def measure(chip_count, bus_count, samples):
+    adapter = create_adapter(chip_count, bus_count)
+    channels = list(range(adapter.channel_count))
+    adapter.get_values(channels)
+
+    start = perf_counter()
+    for _ in range(samples):
+        adapter.get_values(channels)
+    elapsed = perf_counter() - start
+    return {
+        "chips": chip_count,
+        "buses": bus_count,
+        "channels": len(channels),
+        "samples_per_second": samples / elapsed,
+        "channels_per_second": samples * len(channels) / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reading the channels of the ADC topologies")
+    parser.add_argument("-c", "--chips", type=int, default=4, help="Number of the chips")
+    parser.add_argument("-b", "--buses", type=int, default=4, help="Maximum number of the buses")
+    parser.add_argument("-t", "--transfer", type=int, default=100, help="Duration of a transfer (microseconds)")
+    parser.add_argument("-n", "--samples", type=int, default=100, help="Number of the samples")
+    parser.add_argument("-o", "--output", help="Save the results to JSON file")
+    args = parser.parse_args()
+
+    sensor.MCP3008 = TransferMockMCP3008
+    TransferMockMCP3008.TRANSFER_TIME = args.transfer / 1000000
+    results = {"results": [measure(args.chips, bus_count, args.samples)
+                           for bus_count in range(1, min(args.buses, args.chips) + 1)]}
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+'''
+Compare the throughput of the database backends (PostgreSQL, SQLite).
+
+Every backend is measured in a new interpreter (the REST server reads the
+configuration on import): the tables are created in an empty database, the
+REST requests are sent with the test client of the server and the writes of
+the monitor and the alert threads are executed with the sessions of the
+monitoring service, also with a REST client reading concurrently.
+
+The SQLite database is a temporary file. The PostgreSQL database is given by
+the environment (DB_USER, DB_HOST...) and the schema of the --schema option,
+its tables are dropped and recreated!
+
+    source etc/common.dev.env; source etc/server.dev.env; source etc/monitor.dev.env
+    PYTHONPATH=src python -m benchmarks.database --backend sqlite --backend postgresql --schema argus_benchmark
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from threading import Event, Thread
+from time import perf_counter
+
+BACKENDS = ("sqlite", "postgresql")
+SENSOR_COUNT = 15
+ALERT_COUNT = 100
+REST_REQUESTS = ("/api/sensors/", "/api/zones/", "/api/alerts", "/api/config/benchmark/values")
+
+
+def seed(db, models):
+    db.drop_all()
+    db.create_all()
+
+    sensor_type = models.SensorType(1, name="Motion", description="Detect motion")
+    zone = models.Zone(name="Benchmark")
+    db.session.add_all([sensor_type, zone])
+    db.session.add_all([models.Sensor(channel, sensor_type, zone, "Sensor %d" % channel)
+                        for channel in range(SENSOR_COUNT)])
+    db.session.add(models.Option("benchmark", "values", json.dumps({"value": 0})))
+    db.session.commit()
+
+    sensors = models.Sensor.query.limit(3).all()
+    for _ in range(ALERT_COUNT):
+        alert = models.Alert("away", datetime.now(), [], end_time=datetime.now())
+        for sensor in sensors:
+            alert_sensor = models.AlertSensor(sensor.channel, sensor.type_id, sensor.description)
+            alert_sensor.sensor = sensor
+            alert.sensors.append(alert_sensor)
+        db.session.add(alert)
+    db.session.commit()
+
+
+def measure_rest(client, headers, requests):
+    '''Requests per second of the read requests and the option updates'''
+    results = {}
+    for url in REST_REQUESTS[:-1]:
+        start = perf_counter()
+        for _ in range(requests):
+            assert client.get(url, headers=headers).status_code == 200
+        results[url] = requests / (perf_counter() - start)
+
+    url = REST_REQUESTS[-1]
+    start = perf_counter()
+    for value in range(requests):
+        assert client.put(url, headers=headers, json={"value": value + 1}).status_code == 200
+    results["PUT " + url] = requests / (perf_counter() - start)
+    return results
+
+
+def measure_monitor(database, models, operations):
+    '''Commits per second of the sensor state changes and of the alerts (start, add sensor, stop)'''
+    results = {}
+    session = database.create_session()
+    sensor = session.query(models.Sensor).first()
+
+    start = perf_counter()
+    for _ in range(operations):
+        sensor.alert = not sensor.alert
+        session.commit()
+    results["sensor_commits_per_second"] = operations / (perf_counter() - start)
+
+    start = perf_counter()
+    for _ in range(operations // 10 or 1):
+        alert = models.Alert("away", datetime.now(), sensors=[])
+        session.add(alert)
+        session.commit()
+        alert_sensor = models.AlertSensor(sensor.channel, sensor.type_id, sensor.description)
+        alert_sensor.sensor = sensor
+        alert.sensors.append(alert_sensor)
+        session.commit()
+        alert.end_time = datetime.now()
+        session.commit()
+    results["alerts_per_second"] = (operations // 10 or 1) / (perf_counter() - start)
+
+    session.close()
+    return results
+
+
+def measure_concurrent(database, models, client, headers, operations):
+    '''Sensor commits per second while the REST server reads the alerts'''
+    stop = Event()
+    reads = [0]
+
+    def read():
+        while not stop.is_set():
+            client.get("/api/alerts", headers=headers)
+            reads[0] += 1
+
+    reader = Thread(target=read, daemon=True)
+    reader.start()
+    result = measure_monitor(database, models, operations)
+    stop.set()
+    reader.join()
+    result["concurrent_reads"] = reads[0]
+    return result
+
+
+def run_backend(requests, operations):
+    '''Measure the backend of the environment in this process'''
+    import benchmarks.fixtures  # noqa: F401 default configuration
+    # the server imports the models
+    from server import app, db, generate_user_token
+    import models
+    from monitoring import database
+    from monitoring.constants import ROLE_ADMIN
+
+    with app.app_context():
+        seed(db, models)
+        client = app.test_client()
+        headers = {"Authorization": "Bearer %s" % generate_user_token("benchmark", ROLE_ADMIN)}
+        result = {
+            "backend": database.get_backend(),
+            "rest_requests_per_second": measure_rest(client, headers, requests),
+            "monitor": measure_monitor(database, models, operations),
+            "concurrent": measure_concurrent(database, models, client, headers, operations)
+        }
+        db.session.remove()
+        db.drop_all()
+
+    print(json.dumps(result))
+
+
+def measure_backend(backend, schema, requests, operations, data_path):
+    environment = dict(os.environ)
+    environment["DB_BACKEND"] = backend
+    environment["DB_FILE"] = os.path.join(data_path, "benchmark.db")
+    if schema:
+        environment["DB_SCHEMA"] = schema
+    source = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, (source, environment.get("PYTHONPATH"))))
+
+    process = subprocess.run(
+        [sys.executable, "-m", "benchmarks.database", "--run", "-r", str(requests), "-n", str(operations)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=environment,
+        universal_newlines=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError("Failed to measure %s:\n%s" % (backend, "\n".join(process.stderr.splitlines()[-3:])))
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the throughput of the database backends")
+    parser.add_argument("-b", "--backend", action="append", choices=BACKENDS,
+                        help="Database backend (default: sqlite)")
+    parser.add_argument("-s", "--schema", help="PostgreSQL database of the benchmark (tables are recreated)")
+    parser.add_argument("-r", "--requests", type=int, default=200, help="Number of REST requests per URL")
+    parser.add_argument("-n", "--operations", type=int, default=500, help="Number of monitor commits")
+    parser.add_argument("-o", "--output", help="Save the results to JSON file")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_backend(args.requests, args.operations)
+        return
+
+    backends = args.backend or ["sqlite"]
+    if "postgresql" in backends and not args.schema:
+        parser.error("the PostgreSQL benchmark needs a dedicated database (--schema)")
+
+    data_path = tempfile.mkdtemp(prefix="argus_benchmark_")
+    results = {"results": [measure_backend(backend, args.schema, args.requests, args.operations, data_path)
+                           for backend in backends]}
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+'''
+Common stand-ins for running the monitoring components without hardware and database.
+
+Import this module before the monitoring modules, it sets the default configuration
+(the values of the environment are kept).
+'''
+import os
+import tempfile
+from bisect import bisect_right
+from queue import Queue
+
+DEFAULT_ENVIRONMENT = {
+    "INPUT_NUMBER": "15",
+    "TOLERANCE": "0.1",
+    "SAMPLE_RATE": "10",
+    "CALIBRATION_SAMPLES": "100",
+    "SAMPLE_BUFFER_SIZE": "36000",
+    "APPLICATION_URIS": "http://localhost:8080",
+    "SALT": "benchmark",
+    "SECRET": "benchmark"
+}
+
+for name, value in DEFAULT_ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+if "DATA_PATH" not in os.environ:
+    os.environ["DATA_PATH"] = tempfile.mkdtemp(prefix="argus_benchmark_")
+
+
+class Zone(object):
+
+    def __init__(self, id=1, disarmed_delay=None, away_delay=None, stay_delay=None):
+        self.id = id
+        self.disarmed_delay = disarmed_delay
+        self.away_delay = away_delay
+        self.stay_delay = stay_delay
+        self.deleted = False
+
+
+class Sensor(object):
+    '''Sensor record with the attributes used by the monitor'''
+
+    def __init__(self, id, channel, zone, reference_value=0.0, tolerance=None):
+        self.id = id
+        self.channel = channel
+        self.zone = zone
+        self.zone_id = zone.id
+        self.reference_value = reference_value
+        self.tolerance = tolerance
+        self.alert = False
+        self.enabled = True
+        self.deleted = False
+
+
+class MemorySession(object):
+    '''In-process stand-in of the database session, counts the commits'''
+
+    def __init__(self, sensors=None):
+        self.sensors = sensors or []
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+class MockSensorAdapter(object):
+    '''
+    Sensor adapter with any number of channels using the mock MCP3008 classes.
+    The channels are mapped to the channels of the pattern.
+    '''
+
+    def __init__(self, channel_count, mock_class, pattern):
+        width = len(pattern[0])
+        self._channels = [mock_class(channel=channel % width) for channel in range(channel_count)]
+
+    def get_value(self, channel):
+        if 0 <= channel < len(self._channels):
+            return self._channels[channel].value
+        return 0
+
+    def get_values(self, channels=None):
+        if channels is None:
+            return [channel.value for channel in self._channels]
+        return [self.get_value(channel) for channel in channels]
+
+    @property
+    def channel_count(self):
+        return len(self._channels)
+
+
+class AlertSession(object):
+    '''
+    In-process stand-in of the database session of the syren alert.
+    The records are stored by model class and id, the added records get ids on commit.
+    '''
+
+    def __init__(self, records=None):
+        self._records = records or {}
+        self._added = []
+        self.commits = 0
+
+    def add(self, record):
+        self._added.append(record)
+
+    def commit(self):
+        for record in self._added:
+            records = self._records.setdefault(type(record), {})
+            if record.id is None:
+                record.id = len(records) + 1
+            records[record.id] = record
+        self._added = []
+        self.commits += 1
+
+    def query(self, model):
+        return RecordQuery(self._records.get(model, {}))
+
+    def close(self):
+        pass
+
+
+class RecordQuery(object):
+
+    def __init__(self, records):
+        self._records = records
+
+    def get(self, record_id):
+        return self._records.get(record_id)
+
+
+class TimedQueue(Queue):
+    '''Queue storing the items with the time of the clock when they were put'''
+
+    def __init__(self, clock):
+        super(TimedQueue, self).__init__()
+        self._clock = clock
+
+    def put(self, item, block=True, timeout=None):
+        super(TimedQueue, self).put((self._clock.time(), item), block, timeout)
+
+
+class TraceSensorAdapter(object):
+    '''
+    Sensor adapter replaying a trace of samples (time offset, [values]) by the clock.
+    The value of a channel is the last sample before the current time.
+    '''
+
+    def __init__(self, clock, trace, start=None):
+        self._clock = clock
+        self._start = clock.time() if start is None else start
+        self._times = [offset for offset, _ in trace]
+        self._values = [values for _, values in trace]
+
+    def get_value(self, channel):
+        index = max(0, bisect_right(self._times, self._clock.time() - self._start) - 1)
+        return self._values[index][channel]
+
+    def get_values(self, channels=None):
+        index = max(0, bisect_right(self._times, self._clock.time() - self._start) - 1)
+        values = self._values[index]
+        if channels is None:
+            return list(values)
+        return [values[channel] if 0 <= channel < len(values) else 0 for channel in channels]
+
+    @property
+    def channel_count(self):
+        return len(self._values[0])
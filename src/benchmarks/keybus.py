@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+'''
+Benchmark the DSC keypad protocol on the simulated keybus.
+
+The real DSCKeypad communicates with a software keypad model under a virtual clock
+so the frame throughput, the key press latency and the error rates can be measured
+on any machine.
+
+    PYTHONPATH=src python -m benchmarks.keybus --duration 600 --bit-error-rate 0.001
+'''
+import argparse
+import json
+import logging
+import random
+from itertools import cycle
+from time import perf_counter
+
+from monitoring.adapters.keypads.dsc import DSCKeypad
+from monitoring.adapters.mock.clock import VirtualClock
+from monitoring.adapters.mock.keybus import DSCKeypadModel, SimulatedGPIO
+
+# same as in the Keypad process
+CLOCK_PIN = 5
+DATA_PIN = 0
+COMMUNICATION_PERIOD = 0.5
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run(duration, press_interval, bit_error_rate, query_rate, seed, period=COMMUNICATION_PERIOD):
+    rng = random.Random(seed)
+    clock = VirtualClock(start=1000.0)
+    gpio = SimulatedGPIO()
+    model = DSCKeypadModel(gpio, CLOCK_PIN, DATA_PIN, clock, bit_error_rate=bit_error_rate, seed=seed)
+    keypad = DSCKeypad(CLOCK_PIN, DATA_PIN, gpio=gpio, timer=clock)
+
+    keys = cycle("0123456789")
+    next_press = clock.time() + rng.uniform(0, press_interval)
+    end = clock.time() + duration
+
+    latencies = []
+    pressed = correct = corrupted = lost = spurious = rounds = 0
+    processing = 0.0
+
+    start = perf_counter()
+    keypad.initialise()
+    processing += perf_counter() - start
+    model.take_transmitted()
+
+    while clock.time() < end:
+        while clock.time() >= next_press:
+            model.press(next(keys), at=next_press)
+            pressed += 1
+            next_press += rng.uniform(0.5 * press_interval, 1.5 * press_interval)
+
+        if query_rate and rng.random() < query_rate:
+            model.request_query()
+
+        start = perf_counter()
+        keypad.communicate()
+        processing += perf_counter() - start
+        rounds += 1
+
+        transmitted = model.take_transmitted()
+        decoded = keypad.pressed
+        keypad.pressed = None
+
+        if transmitted:
+            # only the last key of the round is visible for the keypad process
+            lost += len(transmitted) - 1
+            key, pressed_at, _ = transmitted[-1]
+            if decoded == key:
+                correct += 1
+                latencies.append(clock.time() - pressed_at)
+            elif decoded is None:
+                lost += 1
+            else:
+                corrupted += 1
+        elif decoded is not None:
+            spurious += 1
+
+        clock.sleep(period)
+
+    waiting = model.pending_keys
+    return {
+        "duration": duration,
+        "rounds": rounds,
+        "frames": model.frames,
+        "frames_by_command": {"0x%02X" % command: count for command, count in model.frames_by_command.items()},
+        "frames_per_second": model.frames / duration,
+        "processing_per_frame_us": processing / model.frames * 1e6 if model.frames else None,
+        "bit_error_rate": bit_error_rate,
+        "bit_errors": model.bit_errors,
+        "crc_errors": model.crc_errors,
+        "framing_errors": model.framing_errors,
+        "keys_pressed": pressed,
+        "keys_correct": correct,
+        "keys_corrupted": corrupted,
+        "keys_lost": lost + waiting,
+        "keys_spurious": spurious,
+        "key_error_rate": (corrupted + lost + waiting) / pressed if pressed else 0.0,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DSC keypad on the simulated keybus")
+    parser.add_argument("-d", "--duration", type=float, default=300, help="Simulated seconds")
+    parser.add_argument("-p", "--press-interval", type=float, default=2.0, help="Average seconds between key presses")
+    parser.add_argument("-e", "--bit-error-rate", type=float, default=0.0, help="Probability of a flipped bit")
+    parser.add_argument("-q", "--query-rate", type=float, default=0.0, help="Probability of unknown command answer")
+    parser.add_argument("-s", "--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Save the results to JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = run(args.duration, args.press_interval, args.bit_error_rate, args.query_rate, args.seed)
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+'''
+Benchmark the monitor loop with the mock MCP3008 adapters.
+
+The scan_sensors, handle_alerts and check_power phases of the Monitor are driven
+against the pattern based mocks without the action queue and the database (the
+session is an in-process stand-in). The results can be saved to JSON and compared
+across commits.
+
+    PYTHONPATH=src python -m benchmarks.monitor --ticks 5000 --output monitor.json
+    PYTHONPATH=src python -m benchmarks.monitor --ticks 5000 --compare monitor.json
+'''
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import tracemalloc
+from array import array
+from math import nan
+from os import environ, path
+from time import perf_counter
+
+from benchmarks.fixtures import MemorySession, MockSensorAdapter, Sensor, Zone
+
+from monitoring import storage
+from monitoring.adapters.mock.MCP3008 import (DoubleAlertMCP3008,
+                                              PowerMCP3008, ShortAlertMCP3008)
+from monitoring.constants import ARM_AWAY, MONITORING_ARMED
+from monitoring.history import SensorHistory
+from monitoring.monitor import Monitor
+from monitoring.recorder import SampleRecorder
+
+CHANNEL_COUNTS = (8, 15, 64)
+PATTERNS = {
+    "short": (ShortAlertMCP3008, ShortAlertMCP3008.SHORT_ALERT),
+    "double": (DoubleAlertMCP3008, DoubleAlertMCP3008.DOUBLE_ALERT),
+    "power": (PowerMCP3008, PowerMCP3008.POWER_ALERT)
+}
+PHASES = ("check_power", "scan_sensors", "handle_alerts")
+# the alerts are not escalated to the syren during the benchmark
+ALERT_DELAY = 3600
+
+
+def create_monitor(channel_count, pattern, data_path):
+    mock_class, source = PATTERNS[pattern]
+    monitor = Monitor(None)
+    monitor._sensorAdapter = MockSensorAdapter(channel_count, mock_class, source)
+    monitor._samples = array('f', [nan] * channel_count)
+    monitor._recorder = SampleRecorder(
+        path.join(data_path, "samples_%s_%d.bin" % (pattern, channel_count)), channel_count, 3600)
+    monitor._history = SensorHistory(path.join(data_path, "%s_%d" % (pattern, channel_count)), channel_count)
+
+    zone = Zone(away_delay=ALERT_DELAY, stay_delay=ALERT_DELAY)
+    monitor._sensors = [Sensor(channel + 1, channel, zone) for channel in range(channel_count)]
+    monitor._db_session = MemorySession(monitor._sensors)
+
+    storage.set('arm', ARM_AWAY)
+    storage.set('state', MONITORING_ARMED)
+    return monitor
+
+
+def close_monitor(monitor):
+    # stop the alert threads
+    monitor._stop_alert.set()
+    for alert in monitor._alerts.values():
+        alert['alert'].join()
+    monitor._recorder.close()
+    monitor._history.close()
+
+
+def measure_phases(monitor, ticks):
+    '''Run the ticks and measure the phases separately'''
+    phases = [(name, getattr(monitor, name)) for name in PHASES]
+    durations = {name: 0.0 for name in PHASES}
+    worst = 0.0
+
+    start = perf_counter()
+    for _ in range(ticks):
+        tick_start = perf_counter()
+        for name, phase in phases:
+            phase_start = perf_counter()
+            phase()
+            durations[name] += perf_counter() - phase_start
+        worst = max(worst, perf_counter() - tick_start)
+    elapsed = perf_counter() - start
+
+    return {
+        "ticks_per_second": ticks / elapsed,
+        "tick_us": elapsed / ticks * 1e6,
+        "tick_max_us": worst * 1e6,
+        "phases_us": {name: duration / ticks * 1e6 for name, duration in durations.items()}
+    }
+
+
+def measure_allocations(monitor, ticks):
+    '''Memory allocated during a tick (peak) and kept after it'''
+    peak = retained = 0
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    for _ in range(ticks):
+        tracemalloc.clear_traces()
+        monitor.check_power()
+        monitor.scan_sensors()
+        monitor.handle_alerts()
+        current, tick_peak = tracemalloc.get_traced_memory()
+        peak += tick_peak
+        retained += current
+    tracemalloc.stop()
+
+    return {
+        "allocated_blocks_per_tick": (sys.getallocatedblocks() - blocks) / ticks,
+        "peak_bytes_per_tick": peak / ticks,
+        "retained_bytes_per_tick": retained / ticks
+    }
+
+
+def run(channel_counts, patterns, ticks, allocation_ticks, data_path):
+    results = []
+    for pattern in patterns:
+        for channel_count in channel_counts:
+            monitor = create_monitor(channel_count, pattern, data_path)
+            # warm up (the first alerts start the threads)
+            measure_phases(monitor, len(PATTERNS[pattern][1]))
+
+            result = {"pattern": pattern, "channels": channel_count, "ticks": ticks}
+            result.update(measure_phases(monitor, ticks))
+            result.update(measure_allocations(monitor, allocation_ticks))
+            result["commits"] = monitor._db_session.commits
+            close_monitor(monitor)
+            results.append(result)
+
+    return results
+
+
+def compare(results, previous):
+    '''Print the change of the speed for the scenarios of the previous results'''
+    previous_results = {(result["pattern"], result["channels"]): result for result in previous["results"]}
+    for result in results["results"]:
+        before = previous_results.get((result["pattern"], result["channels"]))
+        if before:
+            print("%-8s %3d channels: %9.0f -> %9.0f ticks/s (%+.1f%%)" % (
+                result["pattern"], result["channels"], before["ticks_per_second"], result["ticks_per_second"],
+                (result["ticks_per_second"] / before["ticks_per_second"] - 1) * 100))
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the monitor loop with mock sensors")
+    parser.add_argument("-t", "--ticks", type=int, default=2000, help="Number of measured ticks")
+    parser.add_argument("-a", "--allocation-ticks", type=int, default=200,
+                        help="Number of ticks measured with tracemalloc")
+    parser.add_argument("-c", "--channels", type=int, action="append",
+                        help="Number of channels (default: %s)" % ", ".join(map(str, CHANNEL_COUNTS)))
+    parser.add_argument("-p", "--pattern", action="append", choices=sorted(PATTERNS.keys()),
+                        help="Mock sensor pattern (default: all)")
+    parser.add_argument("-d", "--data-path", help="Directory of the sample files, default: $DATA_PATH")
+    parser.add_argument("-o", "--output", help="Save the results to JSON file")
+    parser.add_argument("-b", "--compare", help="Compare with the results in the JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = {
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": run(
+            args.channels or CHANNEL_COUNTS,
+            args.pattern or sorted(PATTERNS.keys()),
+            args.ticks,
+            args.allocation_ticks,
+            args.data_path or environ["DATA_PATH"]
+        )
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
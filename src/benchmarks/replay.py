@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+'''
+Replay sensor traces through the monitor and the alerts in virtual time.
+
+The real Monitor, SensorAlert and SyrenAlert run with a simulated clock: the
+threads of the alerts wait in virtual time and the monitor loop is driven tick
+by tick, so a scenario of minutes is replayed in milliseconds. The scenarios are
+scripted (arm, trip a sensor, optionally disarm) or replayed from the recorded
+samples. The latency from the detection to the syren and to the notification
+is measured in virtual time.
+
+    PYTHONPATH=src python -m benchmarks.replay --scenarios 500 --seed 1
+    PYTHONPATH=src python -m benchmarks.replay --samples samples.bin \
+        --from "2019-10-27 10:00:00" --to "2019-10-27 10:05:00"
+'''
+import argparse
+import json
+import logging
+import random
+from array import array
+from datetime import datetime
+from math import nan
+from os import environ, path
+from queue import Queue
+from time import perf_counter
+
+from benchmarks.fixtures import (AlertSession, MemorySession, Sensor,
+                                 TimedQueue, TraceSensorAdapter, Zone)
+
+import models
+from monitoring.adapters.mock.clock import SimulatedClock
+from monitoring.alert import SensorAlert, SyrenAlert
+from monitoring.constants import (MONITOR_ARM_AWAY, MONITOR_ARM_STAY,
+                                  MONITOR_DISARM)
+from monitoring.history import SensorHistory
+from monitoring.monitor import Monitor
+from monitoring.notifications.notifier import ALERT_STARTED, Notifier
+from monitoring.recorder import SampleReader, SampleRecorder
+
+ARM_ACTIONS = {
+    "away": MONITOR_ARM_AWAY,
+    "stay": MONITOR_ARM_STAY
+}
+# start of the virtual time
+START_TIME = 1500000000.0
+# scripted traces
+IDLE_VALUE = 0.0
+TRIP_VALUE = 1.0
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def scripted_trace(channel_count, trip, channel=0):
+    idle = [IDLE_VALUE] * channel_count
+    tripped = list(idle)
+    tripped[channel] = TRIP_VALUE
+    return [(0.0, idle), (trip, tripped)]
+
+
+def generate_scenarios(count, seed, channel_count):
+    '''Random scenarios with the expected outcome'''
+    rng = random.Random(seed)
+    scenarios = []
+    for index in range(count):
+        delay = rng.randint(0, 30)
+        trip = round(rng.uniform(1, 10), 1)
+        disarm = round(trip + rng.uniform(0, 2 * delay + 5), 1) if rng.random() < 0.5 else None
+        scenarios.append({
+            "name": "scenario-%d" % index,
+            "arm": rng.choice(sorted(ARM_ACTIONS.keys())),
+            "delay": delay,
+            "trip": trip,
+            "disarm": disarm,
+            "duration": trip + delay + 10,
+            "trace": scripted_trace(channel_count, trip, rng.randrange(channel_count))
+        })
+    return scenarios
+
+
+def recorded_scenario(samples_path, start, end, arm, delay):
+    reader = SampleReader(samples_path)
+    samples = reader.window(start, end)
+    reader.close()
+    if not samples:
+        raise ValueError("No samples between %s and %s" % (start, end))
+
+    first = samples[0][0]
+    trace = [(timestamp - first, [IDLE_VALUE if value is None else value for value in values])
+             for timestamp, values in samples]
+    return {
+        "name": "recorded",
+        "arm": arm,
+        "delay": delay,
+        "trip": None,
+        "disarm": None,
+        "duration": samples[-1][0] - first,
+        "trace": trace,
+        # monitor only the recorded channels with the first values as references
+        "references": {channel: value for channel, value in enumerate(samples[0][1]) if value is not None}
+    }
+
+
+class Replay(object):
+    '''
+    Run a scenario through the monitor and the alerts with a simulated clock.
+    '''
+
+    def __init__(self, scenario, data_path):
+        self._scenario = scenario
+        self._clock = SimulatedClock(START_TIME)
+        self._period = 1 / int(environ["SAMPLE_RATE"])
+
+        trace = scenario["trace"]
+        channel_count = len(trace[0][1])
+        references = scenario.get("references") or {channel: IDLE_VALUE for channel in range(channel_count)}
+
+        zone = Zone(away_delay=scenario["delay"], stay_delay=scenario["delay"])
+        sensors = [Sensor(channel + 1, channel, zone, reference) for channel, reference in references.items()]
+        records = {}
+        for sensor in sensors:
+            record = models.Sensor(sensor.channel, None, description="CH%02d" % (sensor.channel + 1))
+            record.id = sensor.id
+            record.type_id = 1
+            records[record.id] = record
+
+        # the class level queues and the db of the alerts
+        self._notifications = TimedQueue(self._clock)
+        Notifier._actions = self._notifications
+        SensorAlert._sensor_queue = Queue()
+        self._alert_session = AlertSession({models.Sensor: records})
+        SyrenAlert._session_factory = lambda: self._alert_session
+
+        self._monitor = Monitor(None, clock=self._clock)
+        self._monitor._sensorAdapter = TraceSensorAdapter(self._clock, trace)
+        self._monitor._samples = array('f', [nan] * channel_count)
+        self._monitor._sensors = sensors
+        self._monitor._db_session = MemorySession(sensors)
+        self._monitor._recorder = SampleRecorder(
+            path.join(data_path, "replay_samples.bin"), channel_count, 3600)
+        self._monitor._history = SensorHistory(path.join(data_path, "replay"), channel_count)
+
+    def _syren_started(self):
+        syren = SyrenAlert._alert
+        if syren is not None and syren._alert is not None:
+            return syren._alert.start_time.timestamp()
+        return None
+
+    def run(self):
+        scenario = self._scenario
+        start = self._clock.time()
+        detection = syren = None
+        disarmed = False
+
+        self._monitor.handle_action(ARM_ACTIONS[scenario["arm"]])
+        while self._clock.time() - start < scenario["duration"]:
+            if scenario["disarm"] is not None and not disarmed and self._clock.time() - start >= scenario["disarm"]:
+                self._monitor.handle_action(MONITOR_DISARM)
+                disarmed = True
+
+            self._monitor.tick()
+            if detection is None and any(sensor.alert for sensor in self._monitor._sensors):
+                detection = self._clock.time()
+
+            self._clock.advance(self._period)
+            if syren is None:
+                syren = self._syren_started()
+
+        # stop the alerts
+        self._monitor.handle_action(MONITOR_DISARM)
+        self._clock.settle()
+        self._monitor._recorder.close()
+        self._monitor._history.close()
+
+        notification = None
+        while not self._notifications.empty():
+            timestamp, message = self._notifications.get()
+            if message["type"] == ALERT_STARTED and notification is None:
+                notification = timestamp
+
+        trip = start + scenario["trip"] if scenario["trip"] is not None else None
+        return {
+            "name": scenario["name"],
+            "arm": scenario["arm"],
+            "delay": scenario["delay"],
+            "trip_to_detection": detection - trip if detection is not None and trip is not None else None,
+            "detection_to_syren": syren - detection if syren is not None and detection is not None else None,
+            "detection_to_notification":
+                notification - detection if notification is not None and detection is not None else None,
+            "syren": syren is not None,
+            "expected_syren": expected_syren(scenario),
+            "virtual_seconds": self._clock.time() - start
+        }
+
+
+def expected_syren(scenario):
+    '''
+    The syren is expected if the sensor trips and it's not disarmed before the delay,
+    unknown (None) if the disarm is within one tick of the deadline (the ticks quantize the times)
+    '''
+    if scenario["trip"] is None:
+        return None
+    if scenario["disarm"] is None:
+        return True
+
+    deadline = scenario["trip"] + scenario["delay"]
+    if abs(scenario["disarm"] - deadline) <= 1 / int(environ["SAMPLE_RATE"]):
+        return None
+    return scenario["disarm"] > deadline
+
+
+def summarize(results, elapsed):
+    def stats(name):
+        values = [result[name] for result in results if result[name] is not None]
+        return {
+            "count": len(values),
+            "mean": sum(values) / len(values) if values else None,
+            "p95": percentile(values, 95),
+            "max": max(values) if values else None
+        }
+
+    virtual = sum(result["virtual_seconds"] for result in results)
+    # the syren is expected after the delay of the zone, the overhead is the rest
+    overheads = [result["detection_to_syren"] - result["delay"] for result in results
+                 if result["detection_to_syren"] is not None]
+    return {
+        "scenarios": len(results),
+        "syrens": sum(1 for result in results if result["syren"]),
+        "unexpected": [result["name"] for result in results
+                       if result["expected_syren"] is not None and result["syren"] != result["expected_syren"]],
+        "trip_to_detection": stats("trip_to_detection"),
+        "detection_to_syren": stats("detection_to_syren"),
+        "detection_to_notification": stats("detection_to_notification"),
+        "syren_overhead_max": max(overheads) if overheads else None,
+        "virtual_seconds": virtual,
+        "elapsed_seconds": elapsed,
+        "speedup": virtual / elapsed if elapsed else None
+    }
+
+
+def parse_time(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay sensor traces through the alert pipeline in virtual time")
+    parser.add_argument("-n", "--scenarios", type=int, default=100, help="Number of generated scenarios")
+    parser.add_argument("-c", "--channels", type=int, default=8,
+                        help="Number of channels of the generated scenarios")
+    parser.add_argument("-s", "--seed", type=int, default=1)
+    parser.add_argument("--samples", help="Replay the recorded samples from the file instead")
+    parser.add_argument("--from", dest="start", help="Start of the recorded samples (YYYY-MM-DD HH:MM:SS)")
+    parser.add_argument("--to", dest="end", help="End of the recorded samples (YYYY-MM-DD HH:MM:SS)")
+    parser.add_argument("--arm", choices=sorted(ARM_ACTIONS.keys()), default="away",
+                        help="Arm type of the recorded samples")
+    parser.add_argument("--delay", type=int, default=0, help="Zone delay of the recorded samples")
+    parser.add_argument("-d", "--data-path", help="Directory of the sample files, default: $DATA_PATH")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the results of the scenarios")
+    parser.add_argument("-o", "--output", help="Save the results to JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    if args.samples:
+        scenarios = [recorded_scenario(args.samples, parse_time(args.start), parse_time(args.end),
+                                       args.arm, args.delay)]
+    else:
+        scenarios = generate_scenarios(args.scenarios, args.seed, args.channels)
+
+    data_path = args.data_path or environ["DATA_PATH"]
+    start = perf_counter()
+    results = [Replay(scenario, data_path).run() for scenario in scenarios]
+    summary = summarize(results, perf_counter() - start)
+
+    output = {"summary": summary}
+    if args.verbose:
+        output["results"] = results
+    print(json.dumps(output, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"summary": summary, "results": results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
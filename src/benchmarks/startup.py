@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+'''
+Benchmark the import time of the REST server and the monitoring service.
+
+Every target is imported in a new interpreter with "python -X importtime" and the
+best cumulative time of the repeats is reported with the slowest modules. The check
+fails (exit code 1) if a module which has to be loaded lazily is imported eagerly
+or the import time is slower than the saved baseline with more than the tolerance.
+
+    source etc/common.dev.env; source etc/server.dev.env; source etc/monitor.dev.env
+    PYTHONPATH=src python -m benchmarks.startup --save-baseline startup.json
+    PYTHONPATH=src python -m benchmarks.startup --baseline startup.json --tolerance 20
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+TARGETS = ("server", "monitoring.__main__")
+
+# loaded only by the rare actions (dyndns, certificates, cron jobs, GSM modem),
+# requests is not listed: the Socket.IO client of python-engineio imports it
+LAZY_MODULES = ("dyndns", "certificates", "gsmmodem", "crontab", "noipy", "pydbus", "eventlet")
+
+
+def measure(target):
+    '''Import the target in a new interpreter, returns the import times (us) by module'''
+    source = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, (source, environment.get("PYTHONPATH"))))
+    process = subprocess.run(
+        [sys.executable, "-s", "-X", "importtime", "-c", "import %s" % target],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=environment,
+        universal_newlines=True
+    )
+    if process.returncode != 0:
+        errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError("Failed to import %s:\n%s" % (target, "\n".join(errors[-3:])))
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        _, own, cumulative, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        modules[name] = (int(own), int(cumulative))
+
+    return modules
+
+
+def run(targets, repeat, top):
+    results = {}
+    for target in targets:
+        best = None
+        for _ in range(repeat):
+            modules = measure(target)
+            if best is None or modules[target][1] < best[target][1]:
+                best = modules
+
+        slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        results[target] = {
+            "import_ms": best[target][1] / 1000,
+            "modules": len(best),
+            "eager": sorted(name for name in best if name.split(".")[0] in LAZY_MODULES),
+            "slowest_ms": {name: times[0] / 1000 for name, times in slowest}
+        }
+
+    return results
+
+
+def check(results, baseline, tolerance):
+    '''Returns the list of the regressions'''
+    errors = []
+    for target, result in results.items():
+        if result["eager"]:
+            errors.append("%s imports lazy modules: %s" % (target, ", ".join(result["eager"])))
+
+        if baseline and target in baseline:
+            limit = baseline[target]["import_ms"] * (1 + tolerance / 100)
+            if result["import_ms"] > limit:
+                errors.append("%s import time %.1f ms > %.1f ms (baseline %.1f ms + %s%%)" % (
+                    target, result["import_ms"], limit, baseline[target]["import_ms"], tolerance))
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the services")
+    parser.add_argument("-t", "--target", action="append", help="Module to import (default: %s)" % ", ".join(TARGETS))
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of imports, the best is used")
+    parser.add_argument("-n", "--top", type=int, default=10, help="Number of the slowest modules")
+    parser.add_argument("-b", "--baseline", help="Compare with the results in the JSON file")
+    parser.add_argument("-l", "--tolerance", type=float, default=20, help="Allowed slowdown in percent")
+    parser.add_argument("-s", "--save-baseline", help="Save the results as baseline to the JSON file")
+    args = parser.parse_args()
+
+    try:
+        results = run(args.target or TARGETS, args.repeat, args.top)
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+        sys.exit(2)
+
+    print(json.dumps(results, indent=2))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    errors = check(results, baseline, args.tolerance)
+    for error in errors:
+        print("REGRESSION: %s" % error, file=sys.stderr)
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,31 @@
 
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
+from sqlalchemy import text
 
+from monitoring import database
 from server import app, db
 
-migrate = Migrate(app, db)
+# SQLite can't alter the tables, the migrations recreate them
+migrate = Migrate(app, db, render_as_batch=database.is_sqlite())
 
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
+
+@manager.command
+def dedupe_options():
+    """Remove the duplicated options (same name and section) keeping the last one before the migration"""
+    with db.engine.begin() as connection:
+        if not db.engine.dialect.has_table(connection, "option"):
+            return
+
+        result = connection.execute(text(
+            "DELETE FROM option WHERE id NOT IN (SELECT MAX(id) FROM option GROUP BY name, section)"
+        ))
+        print("Removed %s duplicated option(s)" % result.rowcount)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -5,7 +5,6 @@ import json
 import locale
 import os
 import uuid
-from copy import deepcopy
 
 from sqlalchemy.orm.mapper import validates
 from stringcase import camelcase, snakecase
@@ -131,6 +130,8 @@ class Sensor(BaseModel):
     id = db.Column(db.Integer, primary_key=True)
     channel = db.Column(db.Integer, nullable=False)
     reference_value = db.Column(db.Float)
+    # measured by the calibration, the default tolerance is used if missing
+    tolerance = db.Column(db.Float)
     alert = db.Column(db.Boolean, default=False)
     enabled = db.Column(db.Boolean, default=True)
     deleted = db.Column(db.Boolean, default=False)
@@ -321,33 +322,42 @@ class Option(BaseModel):
     """Model for option table"""
 
     __tablename__ = "option"
+    # the duplicates of the older databases are removed before the migration (manage.py dedupe_options)
+    __table_args__ = (db.UniqueConstraint("name", "section"),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(32), nullable=False)
     section = db.Column(db.String(32), nullable=False)
     value = db.Column(db.String)
+    # incremented on every change of the value
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     def __init__(self, name, section, value):
         self.name = name
         self.section = section
         self.value = value
+        self.version = 0
 
     def update_value(self, value):
         """Update the value field (merging dictionaries). Return true if value changed"""
         if not self.value:
             self.value = json.dumps(value)
-            return True
+            changed = True
         else:
             tmp_value = json.loads(self.value)
             merge_dicts(tmp_value, value)
             tmp_value = json.dumps(tmp_value)
             changed = self.value != tmp_value
             self.value = tmp_value
-            return changed
+
+        if changed:
+            self.version = (self.version or 0) + 1
+        return changed
 
     @property
     def serialize(self):
-        filtered_value = deepcopy(json.loads(self.value))
+        # a new object, no need to copy it before filtering
+        filtered_value = json.loads(self.value)
         filter_keys(filtered_value, ["smtp_password"])
         filter_keys(filtered_value, ["password"])
         return convert2camel({
@@ -1,40 +1,30 @@
 import logging
 import os
 import sys
-from multiprocessing import Queue
 from signal import SIGTERM, signal
 from threading import Event, Thread
 from time import sleep
 
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from monitoring import database, journal, logs, metrics, snapshot, startup
 from monitoring.adapters.keypad import Keypad
-from monitoring.constants import (LOG_SERVICE, LOGGING_MODULES, MONITOR_STOP,
+from monitoring.adapters.keypad_channel import KeypadChannel, KeypadLink
+from monitoring.constants import (ARM_AWAY, ARM_STAY, LOG_SERVICE,
+                                  MONITOR_ARM_AWAY, MONITOR_ARM_STAY,
+                                  MONITOR_DISARM,
+                                  MONITOR_STOP, MONITOR_UPDATE_CONFIG,
+                                  MONITOR_UPDATE_KEYPAD, MONITOR_UPDATE_OPTION,
                                   THREAD_SOCKETIO)
+from monitoring.events import EventBus
 from monitoring.ipc import IPCServer
 from monitoring.monitor import Monitor
 from monitoring.notifications.notifier import Notifier
 from monitoring.socket_io import start_socketio
-from server.broadcast import Broadcaster
-
-
-def initialize_logging():
-    formatter = logging.Formatter('%(asctime)s-[%(threadName)10s|%(name)9s] %(levelname)5s: %(message)s')
 
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
 
-    file_handler = logging.FileHandler('monitoring.log')
-    file_handler.setFormatter(formatter)
-
-    for name, level in LOGGING_MODULES:
-        logger = logging.getLogger(name)
-        logger.setLevel(level)
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-
-    logging.getLogger('SocketIOServer').setLevel(logging.INFO)
-    logging.getLogger('gsmmodem.modem.GsmModem').setLevel(logging.ERROR)
-    logging.getLogger('gsmmodem.serial_comms.SerialComms').setLevel(logging.ERROR)
-    # logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
+QUEUE_DEPTH = metrics.gauge("argus_queue_depth", "Number of the waiting actions", ("queue",))
 
 
 def createPidFile():
@@ -44,38 +34,82 @@ def createPidFile():
     f.close()
 
 
+def declare_components():
+    startup.declare(startup.COMPONENT_KEYPAD)
+    # don't open connections before forking the keypad process
+    startup.declare(startup.COMPONENT_DATABASE, (startup.COMPONENT_KEYPAD,))
+    startup.declare(startup.COMPONENT_SOCKETIO)
+    startup.declare(startup.COMPONENT_IPC)
+    startup.declare(startup.COMPONENT_MONITOR, (startup.COMPONENT_DATABASE, startup.COMPONENT_SOCKETIO))
+    startup.declare(startup.COMPONENT_NOTIFIER, (startup.COMPONENT_DATABASE,))
+
+
+def connect_database(logger):
+    startup.wait_for(startup.COMPONENT_DATABASE)
+    while True:
+        try:
+            with database.get_engine().connect() as connection:
+                connection.execute(text("SELECT 1"))
+            break
+        except OperationalError as error:
+            logger.warning("Database not available: %s", error)
+            sleep(1)
+
+    startup.ready(startup.COMPONENT_DATABASE)
+
+
 def start():
     createPidFile()
-    initialize_logging()
+    logs.initialize_logging()
 
     logger = logging.getLogger(LOG_SERVICE)
+    declare_components()
+
+    bus = EventBus()
+    monitor_actions = bus.subscribe((MONITOR_ARM_AWAY, MONITOR_ARM_STAY, MONITOR_DISARM,
+                                     MONITOR_UPDATE_CONFIG, MONITOR_STOP))
+    notifier_actions = bus.subscribe((MONITOR_UPDATE_CONFIG, MONITOR_UPDATE_OPTION, MONITOR_STOP))
+    # the keypad runs in another process
+    keypad_channel = bus.subscribe((MONITOR_ARM_AWAY, MONITOR_ARM_STAY, MONITOR_DISARM,
+                                    MONITOR_UPDATE_KEYPAD, MONITOR_STOP), KeypadChannel())
+    QUEUE_DEPTH.set_function(monitor_actions.qsize, queue="monitor")
+    QUEUE_DEPTH.set_function(notifier_actions.qsize, queue="notifier")
+    QUEUE_DEPTH.set_function(keypad_channel.qsize, queue="keypad")
+
+    # continue from the state of the last run (crash or restart)
+    state = snapshot.load()
+    if state is not None and state.arm in (ARM_AWAY, ARM_STAY):
+        keypad_channel.put(MONITOR_ARM_AWAY if state.arm == ARM_AWAY else MONITOR_ARM_STAY)
+
+    # fork the keypad process before starting any thread
+    keypad = Keypad(keypad_channel)
+    keypad.start()
+    logs.start_writer()
+    journal_writer = journal.start()
+
+    stop_event = Event()
+    keypad_link = KeypadLink(keypad_channel, bus, stop_event)
+    keypad_link.start()
 
-    monitor_actions = Queue()
-    monitor = Monitor(monitor_actions)
+    monitor = Monitor(monitor_actions, state=state)
     monitor.start()
 
-    notifier_actions = Queue()
     Notifier._actions = notifier_actions
     notifier = Notifier()
     notifier.start()
 
-    keypad_actions = Queue()
-    keypad = Keypad(keypad_actions, monitor_actions)
-    keypad.start()
-
-    broadcaster = Broadcaster([monitor_actions, notifier_actions, keypad_actions])
-
-    stop_event = Event()
-    ipc_server = IPCServer(stop_event, broadcaster)
+    ipc_server = IPCServer(stop_event, bus)
     ipc_server.start()
 
     # start the socket IO server in he main thread
     socketio_server = Thread(target=start_socketio, name=THREAD_SOCKETIO, daemon=True)
     socketio_server.start()
 
+    connect_database(logger)
+
     def stop_service():
         logger.info("Stopping service...")
-        broadcaster.send_message(MONITOR_STOP)
+        bus.publish(MONITOR_STOP)
         stop_event.set()
 
         keypad.join()
@@ -86,7 +120,9 @@ def start():
         logger.debug("Monitor thread stopped")
         ipc_server.join()
         logger.debug("IPC thread stopped")
+        journal.stop()
         logger.info("All threads stopped")
+        logs.stop_writer()
         sys.exit(0)
 
     def signal_term_handler(signal, frame):
@@ -103,7 +139,7 @@ def start():
     '''
     while True:
         try:
-            for thread in (monitor, ipc_server, notifier, keypad, socketio_server):
+            for thread in (monitor, ipc_server, notifier, keypad, keypad_link, journal_writer, socketio_server):
                 if not thread.is_alive():
                     logger.error("Thread crashed: %s", thread.name)
                     stop_service()
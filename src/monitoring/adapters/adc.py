@@ -0,0 +1,142 @@
+'''
+Topology of the analog-digital converters (MCP3008) of the sensors and the power sense.
+
+ADC_BUSES: SPI buses (comma separated) referred by their index:
+    software SPI "sw:<clock>:<mosi>:<miso>" (BCM pins) or hardware SPI "hw:<port>"
+ADC_CHIPS: chips in the order of the sensor channels (comma separated):
+    "<bus>:<select>:<channels>" (bus index, chip select BCM pin or the device
+    of the hardware SPI, number of the used channels from the first one)
+POWER_SENSE: channel of the power source: "<bus>:<select>:<channel>"
+    (it can't be a sensor channel)
+
+The sensor channels are numbered continuously on the chips (board numbering
+CH1..CHn => 0..n-1), the chips of different buses can be read in parallel.
+
+    ADC_BUSES=sw:21:16:20,hw:0
+    ADC_CHIPS=0:12:8,0:1:7,1:0:8,1:1:8
+'''
+import os
+from collections import namedtuple
+
+from monitoring.adapters import SPI_CLK, SPI_MISO, SPI_MOSI
+
+DEFAULT_BUSES = "sw:%d:%d:%d" % (SPI_CLK, SPI_MOSI, SPI_MISO)
+# the last channel of the second chip is the power sense
+DEFAULT_CHIPS = "0:12:8,0:1:7"
+DEFAULT_POWER_SENSE = "0:1:7"
+# number of channels on MCP3008
+CHIP_CHANNELS = 8
+
+# sensor channel => channel of the chip
+Address = namedtuple("Address", ("chip", "channel"))
+
+
+class Bus(object):
+    '''
+    SPI bus of the chips, the transfers of one bus are sequential.
+    '''
+
+    def __init__(self, index, port=None, clock_pin=None, mosi_pin=None, miso_pin=None):
+        self.index = index
+        self.port = port
+        self.clock_pin = clock_pin
+        self.mosi_pin = mosi_pin
+        self.miso_pin = miso_pin
+
+    @property
+    def hardware(self):
+        return self.port is not None
+
+    def get_options(self, select):
+        '''Parameters of the MCP3008 device on the chip select'''
+        if self.hardware:
+            return {"port": self.port, "device": select}
+
+        return {
+            "clock_pin": self.clock_pin,
+            "mosi_pin": self.mosi_pin,
+            "miso_pin": self.miso_pin,
+            "select_pin": select
+        }
+
+    def __repr__(self):
+        if self.hardware:
+            return "Bus(%d: SPI%d)" % (self.index, self.port)
+        return "Bus(%d: BCM%02d/%02d/%02d)" % (self.index, self.clock_pin, self.mosi_pin, self.miso_pin)
+
+
+class Chip(object):
+
+    def __init__(self, bus, select, channel_count):
+        self.bus = bus
+        self.select = select
+        self.channel_count = channel_count
+
+    def __repr__(self):
+        return "Chip(%r, select: %d, channels: %d)" % (self.bus, self.select, self.channel_count)
+
+
+def parse_buses(value):
+    buses = []
+    for index, definition in enumerate(value.split(",")):
+        fields = definition.strip().split(":")
+        try:
+            if fields[0] == "hw" and len(fields) == 2:
+                buses.append(Bus(index, port=int(fields[1])))
+                continue
+            if fields[0] == "sw" and len(fields) == 4:
+                clock_pin, mosi_pin, miso_pin = (int(field) for field in fields[1:])
+                buses.append(Bus(index, clock_pin=clock_pin, mosi_pin=mosi_pin, miso_pin=miso_pin))
+                continue
+        except ValueError:
+            pass
+        raise ValueError("Invalid ADC bus: '%s'" % definition)
+    return buses
+
+
+def parse_address(definition, buses):
+    '''Bus, chip select and number: "<bus>:<select>:<number>"'''
+    try:
+        bus, select, number = (int(field) for field in definition.strip().split(":"))
+        return buses[bus], select, number
+    except (ValueError, IndexError):
+        raise ValueError("Invalid ADC address: '%s'" % definition)
+
+
+def parse_chips(value, buses):
+    chips = []
+    used = set()
+    for definition in value.split(","):
+        bus, select, channel_count = parse_address(definition, buses)
+        if not 0 < channel_count <= CHIP_CHANNELS:
+            raise ValueError("Invalid number of ADC channels: '%s'" % definition)
+        if (bus.index, select) in used:
+            raise ValueError("Chip select is used twice: '%s'" % definition)
+        used.add((bus.index, select))
+        chips.append(Chip(bus, select, channel_count))
+    return chips
+
+
+def get_buses():
+    return parse_buses(os.environ.get("ADC_BUSES", DEFAULT_BUSES))
+
+
+def get_chips(buses=None):
+    return parse_chips(os.environ.get("ADC_CHIPS", DEFAULT_CHIPS), buses or get_buses())
+
+
+def get_addresses(chips):
+    '''The chip and the channel of the sensor channels'''
+    return [Address(chip, channel) for chip in chips for channel in range(chip.channel_count)]
+
+
+def get_power_sense(buses=None):
+    '''Bus, chip select and channel of the power sense'''
+    buses = buses or get_buses()
+    bus, select, channel = parse_address(os.environ.get("POWER_SENSE", DEFAULT_POWER_SENSE), buses)
+    if not 0 <= channel < CHIP_CHANNELS:
+        raise ValueError("Invalid power sense channel: %d" % channel)
+    for chip in get_chips(buses):
+        if chip.bus is bus and chip.select == select and channel < chip.channel_count:
+            raise ValueError("The power sense is a sensor channel of %r: %d" % (chip, channel))
+    return bus, select, channel
@@ -3,16 +3,17 @@ Created on 2018. jan. 7.
 
 @author: gkovacs
 '''
-import json
 import logging
 import os
 
-from gsmmodem.modem import GsmModem
-from gsmmodem.exceptions import PinRequiredError, IncorrectPinError, TimeoutException, CmsError,\
-    CommandError
+from monitoring import options
 from monitoring.constants import LOG_ADGSM
-from models import db, Option
 from time import sleep
+from tools.lazy import lazy_import
+
+# loaded in the notifier thread when the modem is connected
+modem = lazy_import("gsmmodem.modem")
+exceptions = lazy_import("gsmmodem.exceptions")
 
 
 class GSM(object):
@@ -21,14 +22,11 @@ class GSM(object):
         self._logger = logging.getLogger(LOG_ADGSM)
 
     def setup(self):
-        db_session = db.create_scoped_session()
-        section = db.session.query(Option).filter_by(name='notifications', section='gsm').first()
-        db_session.close()
-        self._options = json.loads(section.value) if section else {'pin_code': ''}
+        self._options = options.get('notifications', 'gsm', {'pin_code': ''})
         self._options['port'] = os.environ['GSM_PORT']
         self._options['baud'] = os.environ['GSM_PORT_BAUD']
 
-        self._modem = GsmModem(self._options['port'], int(self._options['baud']))
+        self._modem = modem.GsmModem(self._options['port'], int(self._options['baud']))
         self._modem.smsTextMode = True
 
         self._logger.info('Connecting to GSM modem on %s with %s baud (PIN: %s)...',
@@ -42,19 +40,19 @@ class GSM(object):
                 self._modem.connect(self._options['pin_code'], waitingForModemToStartInSeconds=10)
                 self._logger.debug("GSM modem connected")
                 connected = True
-            except PinRequiredError:
+            except exceptions.PinRequiredError:
                 self._logger.error('SIM card PIN required!')
                 self._modem = None
                 return False
-            except IncorrectPinError:
+            except exceptions.IncorrectPinError:
                 self._logger.error('Incorrect SIM card PIN entered!')
                 self._modem = None
                 return False
-            except TimeoutException as error:
+            except exceptions.TimeoutException as error:
                 self._logger.error('No answer from GSM module: %s', error)
                 self._modem = None
                 return False
-            except CmsError as error:
+            except exceptions.CmsError as error:
                 if str(error) == "CMS 302":
                     self._logger.debug('GSM modem not ready. Retry...')
                     sleep(5)
@@ -80,20 +78,20 @@ class GSM(object):
         self._logger.debug('Checking for network coverage...')
         try:
             self._modem.waitForNetworkCoverage(5)
-        except CommandError as error:
+        except exceptions.CommandError as error:
             self._logger.error('Command error: %s', error)
             return False
-        except TimeoutException:
+        except exceptions.TimeoutException:
             self._logger.error(('Network signal strength is not sufficient,'
                                 ' please adjust modem position/antenna and try again.'))
             return False
         else:
             try:
                 self._modem.sendSms(phone_number, message)
-            except TimeoutException:
+            except exceptions.TimeoutException:
                 self._logger.error('Failed to send message: the send operation timed out')
                 return False
-            except CmsError as error:
+            except exceptions.CmsError as error:
                 self._logger.error('Failed to send message: %s', error)
                 return False
             else:
@@ -1,20 +1,16 @@
 import logging
 import os
 from multiprocessing import Process
-from queue import Empty
 from time import time
 
-from sqlalchemy.engine import create_engine
-from sqlalchemy.orm.session import sessionmaker
-
 import models
 from models import Keypad, User, hash_code
+from monitoring import database, startup
 from monitoring.adapters.keypads.base import KeypadBase
 from monitoring.adapters.mock.keypad import MockKeypad
 from monitoring.constants import (LOG_ADKEYPAD, MONITOR_ARM_AWAY,
-                                  MONITOR_ARM_STAY, MONITOR_DISARM,
-                                  MONITOR_STOP, MONITOR_UPDATE_KEYPAD,
-                                  THREAD_KEYPAD)
+                                  MONITOR_ARM_STAY, MONITOR_STOP,
+                                  MONITOR_UPDATE_KEYPAD, THREAD_KEYPAD)
 
 if os.uname()[4][:3] == "arm":
     from monitoring.adapters.keypads.dsc import DSCKeypad
@@ -27,11 +23,13 @@ class Keypad(Process):
     CLOCK_PIN = 5
     DATA_PIN = 0
 
-    def __init__(self, commands, responses):
+    def __init__(self, channel):
         super(Keypad, self).__init__(name=THREAD_KEYPAD)
         self._logger = logging.getLogger(LOG_ADKEYPAD)
-        self._commands = commands
-        self._responses = responses
+        self._channel = channel
+        self._arm_sequence = None
+        # the arm state shown on the keypad
+        self._armed = False
         self._codes = []
         self._keypad: KeypadBase = None
 
@@ -52,10 +50,7 @@ class Keypad(Process):
     def configure(self):
         # load from db
         # when hangs here check workaround in Notifier
-        uri = f"postgresql+psycopg2://{os.environ.get('DB_USER', None)}:{os.environ.get('DB_PASSWORD', None)}@{os.environ.get('DB_HOST', None)}:{os.environ.get('DB_PORT', None)}/{os.environ.get('DB_SCHEMA', None)}"
-        engine = create_engine(uri)
-        Session = sessionmaker(bind=engine)
-        db_session = Session()
+        db_session = database.create_session()
 
         users = db_session.query(User).all()
         self._codes = [user.fourkey_code for user in users]
@@ -69,11 +64,31 @@ class Keypad(Process):
 
         if self._keypad and self._keypad.enabled:
             self._keypad.initialise()
+            # show the current arm state on the new keypad (disarmed after the initialisation)
+            self._armed = False
+            self._arm_sequence = None
+            self.sync_arm_state()
 
         db_session.close()
 
+    def sync_arm_state(self):
+        arm, sequence = self._channel.get_arm()
+        if sequence == self._arm_sequence:
+            return
+
+        self._arm_sequence = sequence
+        armed = arm in (MONITOR_ARM_AWAY, MONITOR_ARM_STAY)
+        # the keypad shows the state already (disarmed by the keypad or at startup)
+        if self._keypad and armed != self._armed:
+            self._logger.info("Keypad %s", "armed" if armed else "disarmed")
+            self._keypad.set_armed(armed)
+            self._channel.set_armed_light(armed)
+            self._armed = armed
+
     def run(self):
+        startup.wait_for(startup.COMPONENT_KEYPAD)
         self.configure()
+        startup.ready(startup.COMPONENT_KEYPAD)
 
         try:
             self.communicate()
@@ -88,25 +103,20 @@ class Keypad(Process):
         last_press = int(time())
         presses = ""
         while True:
-            try:
-                self._logger.debug("Wait for command...")
-                message = self._commands.get(timeout=COMMUNICATION_PERIOD)
-                self._logger.info("Command: %s", message)
-
-                if message == MONITOR_UPDATE_KEYPAD:
-                    self._logger.info("Updating keypad")
-                    self.configure()
-                    last_press = int(time())
-                elif message in (MONITOR_ARM_AWAY, MONITOR_ARM_STAY) and self._keypad:
-                    self._logger.info("Keypad armed")
-                    self._keypad.set_armed(True)
-                elif message == MONITOR_DISARM and self._keypad:
-                    self._keypad.set_armed(False)
-                elif message == MONITOR_STOP:
-                    break
+            self._logger.debug("Wait for command...")
+            self._channel.wait_for_monitor(timeout=COMMUNICATION_PERIOD)
+            commands = self._channel.get_commands()
+            if commands:
+                self._logger.info("Commands: %s", commands)
+
+            if MONITOR_STOP in commands:
+                break
+            elif MONITOR_UPDATE_KEYPAD in commands:
+                self._logger.info("Updating keypad")
+                self.configure()
+                last_press = int(time())
 
-            except Empty:
-                pass
+            self.sync_arm_state()
 
             if self._keypad and self._keypad.enabled:
                 self._keypad.communicate()
@@ -115,6 +125,9 @@ class Keypad(Process):
                     presses = ""
                     self._logger.info("Cleared presses after 3 secs")
 
+                if self._keypad.pressed:
+                    self._channel.set_key(self._keypad.pressed)
+
                 if self._keypad.pressed in ("0", "1", "2", "3", "4", "5", "6", "7", "8", "9"):
                     presses += self._keypad.pressed
                     last_press = time()
@@ -134,8 +147,10 @@ class Keypad(Process):
 
                 if hash_code(presses) in self._codes:
                     self._logger.debug("Code: %s", presses)
-                    self._responses.put(MONITOR_DISARM)
+                    self._channel.disarm()
                     self._keypad.set_armed(False)
+                    self._channel.set_armed_light(False)
+                    self._armed = False
                     presses = ""
                 elif len(presses) == 4:
                     self._logger.info("Invalid code")
@@ -0,0 +1,171 @@
+'''
+Shared memory channel between the monitoring service and the keypad process.
+
+The control block holds the arm state, the state of the armed light on the
+keypad, the last pressed key and the sequence numbers of the changes. Both
+sides write the block under its lock and ring the doorbell (a pipe) of the
+other side, which wakes up from waiting immediately.
+
+The rare commands (updating the keypad, stopping) are sent through a queue
+with the doorbell.
+
+Create the channel before forking the keypad process.
+'''
+import os
+from ctypes import Structure, c_bool, c_char, c_uint32, c_uint8
+from multiprocessing import Queue
+from multiprocessing.sharedctypes import Value
+from queue import Empty
+from select import select
+from threading import Thread
+
+from monitoring.constants import (MONITOR_ARM_AWAY, MONITOR_ARM_STAY,
+                                  MONITOR_DISARM, THREAD_KEYPAD_LINK)
+
+# arm states of the control block
+ARM_CODES = {
+    MONITOR_DISARM: 0,
+    MONITOR_ARM_AWAY: 1,
+    MONITOR_ARM_STAY: 2
+}
+KEY_LENGTH = 16
+
+
+class ControlBlock(Structure):
+    _fields_ = [
+        ("arm", c_uint8),
+        ("armed_light", c_bool),
+        ("key", c_char * KEY_LENGTH),
+        # incremented on every change
+        ("arm_sequence", c_uint32),
+        ("key_sequence", c_uint32),
+        ("disarm_sequence", c_uint32)
+    ]
+
+
+class Doorbell(object):
+    '''
+    Wake up the waiting process, the rings are merged until the next wait.
+    '''
+
+    def __init__(self):
+        self._read, self._write = os.pipe()
+        os.set_blocking(self._read, False)
+        os.set_blocking(self._write, False)
+
+    def ring(self):
+        try:
+            os.write(self._write, b"\x01")
+        except BlockingIOError:
+            # the pipe is full, it's ringing already
+            pass
+
+    def wait(self, timeout=None):
+        '''Wait for a ring, returns False on timeout'''
+        readable, _, _ = select([self._read], [], [], timeout)
+        if not readable:
+            return False
+
+        try:
+            os.read(self._read, 512)
+        except BlockingIOError:
+            pass
+        return True
+
+
+class KeypadChannel(object):
+    '''
+    The monitoring side subscribes it on the event bus (arm commands and keypad commands),
+    the keypad process reads the arm state and reports the disarm and the pressed keys.
+    '''
+
+    def __init__(self):
+        self._block = Value(ControlBlock, lock=True)
+        self._commands = Queue()
+        # monitoring -> keypad
+        self._keypad_doorbell = Doorbell()
+        # keypad -> monitoring
+        self._monitor_doorbell = Doorbell()
+
+    # monitoring side
+    def put(self, message):
+        '''Receive the messages of the event bus'''
+        if message in ARM_CODES:
+            with self._block.get_lock():
+                self._block.arm = ARM_CODES[message]
+                self._block.arm_sequence += 1
+        else:
+            self._commands.put(message)
+        self._keypad_doorbell.ring()
+
+    def wait_for_keypad(self, timeout=None):
+        return self._monitor_doorbell.wait(timeout)
+
+    @property
+    def disarm_sequence(self):
+        return self._block.disarm_sequence
+
+    @property
+    def last_key(self):
+        with self._block.get_lock():
+            return self._block.key.decode(), self._block.key_sequence
+
+    @property
+    def armed_light(self):
+        return self._block.armed_light
+
+    def qsize(self):
+        return self._commands.qsize()
+
+    # keypad side
+    def wait_for_monitor(self, timeout=None):
+        return self._keypad_doorbell.wait(timeout)
+
+    def get_commands(self):
+        commands = []
+        try:
+            while True:
+                commands.append(self._commands.get_nowait())
+        except Empty:
+            pass
+        return commands
+
+    def get_arm(self):
+        '''The arm state (MONITOR_DISARM/ARM_AWAY/ARM_STAY) and its sequence number'''
+        with self._block.get_lock():
+            arm, sequence = self._block.arm, self._block.arm_sequence
+        for message, code in ARM_CODES.items():
+            if code == arm:
+                return message, sequence
+
+    def set_armed_light(self, state):
+        self._block.armed_light = state
+
+    def set_key(self, key):
+        with self._block.get_lock():
+            self._block.key = key.encode()[:KEY_LENGTH]
+            self._block.key_sequence += 1
+
+    def disarm(self):
+        with self._block.get_lock():
+            self._block.disarm_sequence += 1
+        self._monitor_doorbell.ring()
+
+
+class KeypadLink(Thread):
+    '''
+    Publish the disarm of the keypad on the event bus of the monitoring service.
+    '''
+
+    def __init__(self, channel, bus, stop_event):
+        super(KeypadLink, self).__init__(name=THREAD_KEYPAD_LINK, daemon=True)
+        self._channel = channel
+        self._bus = bus
+        self._stop_event = stop_event
+
+    def run(self):
+        sequence = self._channel.disarm_sequence
+        while not self._stop_event.is_set():
+            if self._channel.wait_for_keypad(timeout=1) and self._channel.disarm_sequence != sequence:
+                sequence = self._channel.disarm_sequence
+                self._bus.publish(MONITOR_DISARM)
@@ -1,3 +1,9 @@
+from monitoring import metrics
+
+# shared with the keypad process, created before forking it
+FRAME_ERRORS = metrics.shared_counter("argus_keypad_frame_errors_total", "Invalid frames received from the keypad",
+                                      "error", ("unknown_command", "unknown_button"))
+
 
 class KeypadBase:
 
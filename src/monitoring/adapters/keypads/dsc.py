@@ -1,11 +1,15 @@
 
 import logging
+import time
 from datetime import datetime
-from time import sleep, time
 
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # not on a Raspberry: a simulated GPIO has to be injected (see mock.keybus)
+    GPIO = None
 
-from monitoring.adapters.keypads.base import KeypadBase
+from monitoring.adapters.keypads.base import FRAME_ERRORS, KeypadBase
 from monitoring.constants import LOG_ADKEYPAD
 
 # Magic numbers
@@ -89,53 +93,59 @@ class Buttons:
 class Line:
     BYTE_GAP = 0  # 0.001
 
-    def __init__(self, clock, data):
+    def __init__(self, clock, data, gpio=None, timer=None):
+        """
+        The gpio (RPi.GPIO compatible) and the timer (time and sleep) can be replaced
+        for running the protocol without hardware.
+        """
         self._clock = clock
         self._data = data
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup([self._clock, self._data], GPIO.OUT)
+        self._gpio = gpio or GPIO
+        self._timer = timer or time
+        self._gpio.setmode(self._gpio.BCM)
+        self._gpio.setup([self._clock, self._data], self._gpio.OUT)
         self.conversation = []
 
     def receive_bit(self):
-        GPIO.output(self._clock, 0)
-        GPIO.output(self._data, 1)
-        sleep(0.000200)
-        bit = GPIO.input(self._data)
-        sleep(0.000200)
-        GPIO.output(self._data, 1)
-        GPIO.output(self._clock, 1)
-        sleep(0.000450)
+        self._gpio.output(self._clock, 0)
+        self._gpio.output(self._data, 1)
+        self._timer.sleep(0.000200)
+        bit = self._gpio.input(self._data)
+        self._timer.sleep(0.000200)
+        self._gpio.output(self._data, 1)
+        self._gpio.output(self._clock, 1)
+        self._timer.sleep(0.000450)
 
         self.conversation.append({"sent_b": 0, "received_b": bit})
         return bit
 
     def send_receive_byte(self, byte):
         response = "0b"
-        GPIO.output(self._data, 1)
+        self._gpio.output(self._data, 1)
         for bit in "{0:08b}".format(byte):
-            GPIO.output(self._clock, 0)
-            sleep(0.000200)
+            self._gpio.output(self._clock, 0)
+            self._timer.sleep(0.000200)
 
-            response += str(GPIO.input(self._data))
-            GPIO.output(self._data, int(bit))
-            sleep(0.000020)
-            GPIO.output(self._clock, 1)
-            sleep(0.000020)
-            GPIO.output(self._data, 1)
-            sleep(0.000350)
+            response += str(self._gpio.input(self._data))
+            self._gpio.output(self._data, int(bit))
+            self._timer.sleep(0.000020)
+            self._gpio.output(self._clock, 1)
+            self._timer.sleep(0.000020)
+            self._gpio.output(self._data, 1)
+            self._timer.sleep(0.000350)
 
         self.conversation.append({"sent": byte, "received": int(response, 2)})
         return response
 
     def send_and_receive(self, messages):
         self.send_receive_byte(messages.pop(0))
-        sleep(Line.BYTE_GAP)
+        self._timer.sleep(Line.BYTE_GAP)
         self.receive_bit()
-        sleep(Line.BYTE_GAP)
+        self._timer.sleep(Line.BYTE_GAP)
 
         while messages:
             self.send_receive_byte(messages.pop(0))
-            sleep(Line.BYTE_GAP)
+            self._timer.sleep(Line.BYTE_GAP)
 
 
 class DSCKeypad(KeypadBase):
@@ -147,16 +157,17 @@ class DSCKeypad(KeypadBase):
     DATETIME_STATUS = 0xA5
     BEEP = 0x64
 
-    def __init__(self, clock_pin, data_pin):
+    def __init__(self, clock_pin, data_pin, gpio=None, timer=None):
         super(DSCKeypad, self).__init__(clock_pin, data_pin)
         self._logger = logging.getLogger(LOG_ADKEYPAD)
         self._lights = Lights()
-        self._line = Line(clock=clock_pin, data=data_pin)
+        self._timer = timer or time
+        self._line = Line(clock=clock_pin, data=data_pin, gpio=gpio, timer=self._timer)
         self._start_time = None
 
     def initialise(self):
         # initialize connection
-        self._start_time = time()
+        self._start_time = self._timer.time()
         self.send_command(self.send_partition_status)
         self.send_command(self.send_zone_status)
         self.send_command(self.send_zone_lights)
@@ -181,30 +192,30 @@ class DSCKeypad(KeypadBase):
         self.send_command(self.send_partition_status)
 
         # send additional info in every 4th minute
-        if time() - self._start_time > 240:
+        if self._timer.time() - self._start_time > 240:
             self.send_command(self.send_zone_status)
             self.send_command(self.send_zone_lights)
             self.send_command(self.send_datetime)
-            self._start_time = time()
+            self._start_time = self._timer.time()
 
     def send_command_with_retry(self, method, param=None):
         '''
         Not use, can be later deleted
         '''
         BIT_PERIOD = 0.0015
-        start_time = time()
+        start_time = self._timer.time()
         sent_bytes = self.send_command(method, param)
         safe_communication_time = BIT_PERIOD * 8 * sent_bytes + 0.008
-        period = time() - start_time
+        period = self._timer.time() - start_time
         self._logger.debug("Period: %.3f > %.3f", period, safe_communication_time)
 
         while period > safe_communication_time:
             # clear pressed button
             self.pressed = None
             self._logger.debug("RETRY: %.3f > %.3f", period, safe_communication_time)
-            start_time = time()
+            start_time = self._timer.time()
             sent_bytes = self.send_command(method, param)
-            period = time() - start_time
+            period = self._timer.time() - start_time
 
     def send_command(self, method, param=None):
         if param:
@@ -218,7 +229,12 @@ class DSCKeypad(KeypadBase):
         except IndexError:
             pass
 
+        if do_keybus_query:
+            FRAME_ERRORS.inc(error="unknown_command")
+
         if self._line.conversation[2]["received"] != VOID:
+            if self._line.conversation[2]['received'] not in Buttons.codes:
+                FRAME_ERRORS.inc(error="unknown_button")
             self.pressed = Buttons.get_button(self._line.conversation[2]['received'])
 
         sent_bytes = len(self._line.conversation) - 1  # remove 9. bit
@@ -250,7 +266,7 @@ class DSCKeypad(KeypadBase):
         ]))
 
     def send_keybus_query(self):
-        self._logger.info("KEYBUS QUERY 0x%0X" % self.KEYBUS_QUERY)
+        self._logger.info("KEYBUS QUERY 0x%0X", self.KEYBUS_QUERY)
         self._line.send_and_receive([
             self.KEYBUS_QUERY,
             PLACEHOLDER,
@@ -267,7 +283,7 @@ class DSCKeypad(KeypadBase):
         ])
 
     def send_partition_status(self):
-        self._logger.debug("PARTITION STATUS 0x%0X" % self.PARTITION_STATUS)
+        self._logger.debug("PARTITION STATUS 0x%0X", self.PARTITION_STATUS)
         led_status = self._lights.get_lights()
         self._line.send_and_receive([
             self.PARTITION_STATUS,
@@ -278,13 +294,13 @@ class DSCKeypad(KeypadBase):
         ])
 
     def send_zone_status(self):
-        self._logger.debug("ZONE STATUS 0x%0X" % self.ZONE_STATUS)
+        self._logger.debug("ZONE STATUS 0x%0X", self.ZONE_STATUS)
         led_status = self._lights.get_lights()
         self._line.send_and_receive(self.add_CRC([self.ZONE_STATUS, led_status, 0x01, UNKNOWN_DATA, 0XC7, 0x02]))
 
     def send_datetime(self):
         timestamp = datetime.now()
-        self._logger.debug("DATETIME 0x%0X => %s" % (self.DATETIME_STATUS, timestamp.isoformat()))
+        self._logger.debug("DATETIME 0x%0X => %s", self.DATETIME_STATUS, timestamp)
 
         b1 = (int((timestamp.year-2000)/10) << 4)
         b1 |= (0x0F & ((timestamp.year-2000) % 10))
@@ -296,7 +312,7 @@ class DSCKeypad(KeypadBase):
         self._line.send_and_receive(self.add_CRC([self.DATETIME_STATUS, b1, b2, b3, b4, NULL, NULL]))
 
     def send_zone_lights(self):
-        self._logger.debug("ZONE LIGHTS 0x%0X" % self.ZONE_LIGHTS)
+        self._logger.debug("ZONE LIGHTS 0x%0X", self.ZONE_LIGHTS)
         led_status = self._lights.get_lights()
         self._line.send_and_receive(self.add_CRC([self.ZONE_LIGHTS, led_status, 0x01, 0x65, NULL, NULL, NULL, NULL]))
 
@@ -309,18 +325,21 @@ class DSCKeypad(KeypadBase):
         return messages
 
     def print_communication(self):
-        sent = ""
-        received = ""
-        for message in self._line.conversation:
-            if "sent_b" in message and "received_b" in message:
-                sent += " {0:01b}".format(message["sent_b"])
-                received += " {0:01b}".format(message["received_b"])
-            elif "sent" in message and "received" in message:
-                sent += " {0:08b}".format(message["sent"])
-                received += " {0:08b}".format(message["received"])
-
-        # self._logger.debug("Sent:     {}".format(sent))
-        # self._logger.debug("Received: {}".format(received))
+        # the bits are formatted only for debugging
+        if self._logger.isEnabledFor(logging.DEBUG):
+            sent = ""
+            received = ""
+            for message in self._line.conversation:
+                if "sent_b" in message and "received_b" in message:
+                    sent += " {0:01b}".format(message["sent_b"])
+                    received += " {0:01b}".format(message["received_b"])
+                elif "sent" in message and "received" in message:
+                    sent += " {0:08b}".format(message["sent"])
+                    received += " {0:08b}".format(message["received"])
+
+            self._logger.debug("Sent:     %s", sent)
+            self._logger.debug("Received: %s", received)
+
         try:
             if self._line.conversation[4]["received"] == 0xFE:
                 self._logger.warning("!!! Unknown command !!!")
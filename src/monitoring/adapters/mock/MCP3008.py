@@ -9,7 +9,8 @@ class TimeBasedMockMCP3008(object):
     CHANGE_TIME = 11
     DEFAULT_VALUE = 0.1
 
-    def __init__(self, channel=None, clock_pin=None, mosi_pin=None, miso_pin=None, select_pin=None):
+    def __init__(self, channel=None, clock_pin=None, mosi_pin=None, miso_pin=None, select_pin=None, port=None,
+                 device=None):
         self._channel = channel
         self._logger = logging.getLogger(LOG_ADSENSOR)
         self._starttime = None
@@ -33,7 +34,8 @@ class TimeBasedMockMCP3008(object):
 
 class PatternBasedMockMCP3008(object):
 
-    def __init__(self, channel=None, clock_pin=None, mosi_pin=None, miso_pin=None, select_pin=None):
+    def __init__(self, channel=None, clock_pin=None, mosi_pin=None, miso_pin=None, select_pin=None, port=None,
+                 device=None):
         self._channel = channel
         self._logger = logging.getLogger(LOG_ADSENSOR)
         self._starttime = None
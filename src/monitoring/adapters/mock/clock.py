@@ -0,0 +1,127 @@
+from threading import Condition, current_thread, enumerate as enumerate_threads
+from time import perf_counter
+
+
+class VirtualClock(object):
+    '''
+    Clock replacing the time module (time and sleep) for simulations.
+
+    Sleeping doesn't block only steps the time so the protocol timings
+    can be simulated faster than the real time.
+    '''
+
+    def __init__(self, start=0.0):
+        self._now = start
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self._now += seconds
+
+    def advance(self, seconds):
+        '''Step the clock without the meaning of waiting'''
+        self.sleep(seconds)
+
+
+class SimulatedClock(object):
+    '''
+    Virtual clock shared by the threads of a simulation.
+
+    Unlike the VirtualClock the waiting threads are blocked until the driver
+    thread advances the time past their deadline (or their event is set).
+    The driver advances the time only when all the other threads of the
+    simulation wait on the clock, so the simulation is deterministic and
+    runs as fast as the code.
+
+    The threads of the simulation are the non daemon threads started after
+    the clock was created.
+    '''
+    # real seconds between checking the events of the waiting threads
+    POLL = 0.0005
+    # real seconds to wait for the threads to reach the clock
+    SETTLE_TIMEOUT = 10
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._condition = Condition()
+        # thread -> (event, deadline)
+        self._waiting = {}
+        self._driver = current_thread()
+        self._ignored = set(enumerate_threads())
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.wait(None, seconds)
+
+    def wait(self, event, timeout=None):
+        '''Wait for the event or the virtual timeout like Event.wait'''
+        with self._condition:
+            deadline = None if timeout is None else self._now + timeout
+            self._waiting[current_thread()] = (event, deadline)
+            self._condition.notify_all()
+            try:
+                while True:
+                    if event is not None and event.is_set():
+                        return True
+                    if deadline is not None and self._now >= deadline:
+                        return False
+                    self._condition.wait(SimulatedClock.POLL)
+            finally:
+                del self._waiting[current_thread()]
+
+    def _is_settled(self):
+        for thread in enumerate_threads():
+            if thread is self._driver or thread.daemon or thread in self._ignored:
+                continue
+
+            if thread not in self._waiting:
+                # running
+                return False
+
+            event, deadline = self._waiting[thread]
+            if event is not None and event.is_set() or deadline is not None and deadline <= self._now:
+                # will wake up
+                return False
+
+        return True
+
+    def settle(self):
+        '''Wait until all the threads of the simulation wait for the future'''
+        with self._condition:
+            self._settle()
+
+    def _settle(self):
+        start = perf_counter()
+        while not self._is_settled():
+            if perf_counter() - start > SimulatedClock.SETTLE_TIMEOUT:
+                running = [thread.name for thread in enumerate_threads()
+                           if thread not in self._waiting and thread is not self._driver and
+                           not thread.daemon and thread not in self._ignored]
+                raise RuntimeError("Threads are not waiting on the clock: %s" % running)
+            self._condition.wait(SimulatedClock.POLL)
+
+    def advance(self, seconds):
+        '''Step the time (from the driver) waking up the threads at their deadlines in order'''
+        target = self._now + seconds
+        with self._condition:
+            self._settle()
+            while True:
+                deadlines = [deadline for _, deadline in self._waiting.values()
+                             if deadline is not None and deadline <= target]
+                if not deadlines:
+                    break
+                self._now = max(self._now, min(deadlines))
+                self._condition.notify_all()
+                self._settle()
+
+            self._now = target
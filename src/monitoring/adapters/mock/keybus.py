@@ -0,0 +1,240 @@
+'''
+Simulated DSC keybus for running the DSCKeypad without hardware.
+
+The SimulatedGPIO replaces the RPi.GPIO module in the Line class and the
+DSCKeypadModel attached to it plays the role of the keypad on the wire:
+it decodes the frames of the panel and answers the key presses.
+'''
+import logging
+import random
+from collections import deque
+
+from monitoring.adapters.keypads.dsc import DSCKeypad, Buttons
+from monitoring.constants import LOG_ADKEYPAD
+
+
+class SimulatedGPIO(object):
+    '''
+    RPi.GPIO compatible module with open collector (wired AND) lines.
+
+    The attached devices are notified about the changes of the outputs and
+    can pull the lines low when the value of the line is read.
+    '''
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self._mode = None
+        self._levels = {}
+        self._devices = []
+
+    def attach(self, device):
+        self._devices.append(device)
+
+    def setmode(self, mode):
+        self._mode = mode
+
+    def setup(self, channels, direction, initial=HIGH):
+        if isinstance(channels, int):
+            channels = [channels]
+
+        for channel in channels:
+            self._levels[channel] = initial
+
+    def output(self, channel, value):
+        level = SimulatedGPIO.HIGH if value else SimulatedGPIO.LOW
+        if self._levels.get(channel) == level:
+            return
+
+        self._levels[channel] = level
+        for device in self._devices:
+            device.output_changed(channel, level)
+
+    def input(self, channel):
+        level = self._levels.get(channel, SimulatedGPIO.HIGH)
+        for device in self._devices:
+            level &= device.drive(channel)
+        return level
+
+    def level(self, channel):
+        '''The level driven by the owner of the GPIO (without the devices)'''
+        return self._levels.get(channel, SimulatedGPIO.HIGH)
+
+    def cleanup(self, channels=None):
+        self._levels = {}
+
+
+class DSCKeypadModel(object):
+    '''
+    Software model of a DSC keypad on the keybus.
+
+    The panel sends the bits on the rising edge of the clock and the keypad answers
+    on the falling edge. The keypad sends the pressed key in the byte after the
+    command and the stop bit.
+    '''
+
+    # frame length in bytes (with CRC) by command
+    FRAME_LENGTHS = {
+        DSCKeypad.PARTITION_STATUS: 5,
+        DSCKeypad.ZONE_STATUS: 7,
+        DSCKeypad.ZONE_LIGHTS: 9,
+        DSCKeypad.DATETIME_STATUS: 8,
+        DSCKeypad.BEEP: 3,
+        DSCKeypad.KEYBUS_QUERY: 12
+    }
+    CRC_COMMANDS = (
+        DSCKeypad.ZONE_STATUS,
+        DSCKeypad.ZONE_LIGHTS,
+        DSCKeypad.DATETIME_STATUS,
+        DSCKeypad.BEEP
+    )
+    # clock high for longer than this starts a new frame
+    FRAME_GAP = 0.003
+    KEY_SLOTS = range(9, 17)
+    QUERY_SLOTS = range(25, 33)
+    UNKNOWN_COMMAND = 0xFE
+
+    def __init__(self, gpio, clock_pin, data_pin, timer, bit_error_rate=0.0, seed=None):
+        self._logger = logging.getLogger(LOG_ADKEYPAD)
+        self._gpio = gpio
+        self._clock = clock_pin
+        self._data = data_pin
+        self._timer = timer
+        self._bit_error_rate = bit_error_rate
+        self._random = random.Random(seed)
+        self._key_codes = {key: code for code, key in Buttons.codes.items()}
+
+        self._slot = -1
+        self._bits = []
+        self._drive = 1
+        self._last_edge = None
+        self._sending = None
+        self._query = False
+
+        self._keys = deque()
+        self._transmitted = []
+
+        self.lights = None
+        self.frames = 0
+        self.frames_by_command = {}
+        self.crc_errors = 0
+        self.framing_errors = 0
+        self.bit_errors = 0
+        self.last_frame = None
+
+        gpio.attach(self)
+
+    def press(self, key, at=None):
+        '''Queue a key press (pressed now or at the given time), it will be sent in the next frame'''
+        self._keys.append((key, self._timer.time() if at is None else at))
+
+    def request_query(self):
+        '''Answer unknown command in the next frame to make the panel send a keybus query'''
+        self._query = True
+
+    @property
+    def pending_keys(self):
+        return len(self._keys)
+
+    def take_transmitted(self):
+        '''Return and forget the keys (key, pressed time, sent time) sent since the last call'''
+        transmitted = self._transmitted
+        self._transmitted = []
+        return transmitted
+
+    def drive(self, channel):
+        if channel != self._data:
+            return 1
+        return self._noise(self._drive)
+
+    def output_changed(self, channel, level):
+        if channel != self._clock:
+            return
+
+        if level:
+            self._clock_rising()
+        else:
+            self._clock_falling()
+
+    def _noise(self, bit):
+        if self._bit_error_rate and self._random.random() < self._bit_error_rate:
+            self.bit_errors += 1
+            return bit ^ 1
+        return bit
+
+    def _clock_falling(self):
+        now = self._timer.time()
+        if self._bits and self._last_edge is not None and now - self._last_edge > DSCKeypadModel.FRAME_GAP:
+            self._finish_frame()
+        self._last_edge = now
+
+        self._slot += 1
+        if self._slot == DSCKeypadModel.KEY_SLOTS[0] and self._keys:
+            key, pressed_at = self._keys.popleft()
+            self._sending = (key, self._key_codes.get(key, 0xFF))
+            self._transmitted.append((key, pressed_at, now))
+
+        self._drive = 1
+        if self._sending and self._slot in DSCKeypadModel.KEY_SLOTS:
+            position = self._slot - DSCKeypadModel.KEY_SLOTS[0]
+            self._drive = (self._sending[1] >> (7 - position)) & 1
+        elif self._query and self._slot in DSCKeypadModel.QUERY_SLOTS:
+            position = self._slot - DSCKeypadModel.QUERY_SLOTS[0]
+            self._drive = (DSCKeypadModel.UNKNOWN_COMMAND >> (7 - position)) & 1
+
+    def _clock_rising(self):
+        self._last_edge = self._timer.time()
+        if self._slot < 0:
+            return
+
+        self._bits.append(self._noise(self._gpio.level(self._data)))
+        self._drive = 1
+
+        length = self._frame_length()
+        if length is not None and len(self._bits) == length * 8 + 1:
+            self._finish_frame()
+
+    def _frame_length(self):
+        if len(self._bits) < 8:
+            return None
+
+        command = self._byte(0)
+        return DSCKeypadModel.FRAME_LENGTHS.get(command)
+
+    def _byte(self, index):
+        # the stop bit is after the first byte
+        start = 0 if index == 0 else 9 + (index - 1) * 8
+        value = 0
+        for bit in self._bits[start:start + 8]:
+            value = (value << 1) | bit
+        return value
+
+    def _finish_frame(self):
+        length = self._frame_length()
+        if length is None or len(self._bits) != length * 8 + 1:
+            self.framing_errors += 1
+            self._logger.debug("Framing error after %s bits", len(self._bits))
+        else:
+            frame = [self._byte(index) for index in range(length)]
+            command = frame[0]
+            self.frames += 1
+            self.frames_by_command[command] = self.frames_by_command.get(command, 0) + 1
+            self.last_frame = frame
+
+            if command in DSCKeypadModel.CRC_COMMANDS and sum(frame[:-1]) % 256 != frame[-1]:
+                self.crc_errors += 1
+                self._logger.debug("CRC error in frame: %s", frame)
+            elif command in (DSCKeypad.PARTITION_STATUS, DSCKeypad.ZONE_STATUS, DSCKeypad.ZONE_LIGHTS):
+                self.lights = frame[1]
+
+            if self._query and self._slot >= DSCKeypadModel.QUERY_SLOTS[-1]:
+                self._query = False
+
+        self._slot = -1
+        self._bits = []
+        self._drive = 1
+        self._sending = None
@@ -7,7 +7,7 @@ Created on 2017. aug. 28.
 import os
 import logging
 
-from monitoring.adapters import SPI_CLK, SPI_MISO, SPI_MOSI
+from monitoring.adapters import adc
 from monitoring.constants import LOG_ADPOWER
 
 # check if running on Raspberry
@@ -25,9 +25,6 @@ class PowerAdapter(object):
     SOURCE_NETWORK = 'network'
     SOURCE_BATTERY = 'battery'
 
-    # MCP3008/2 chip select BCM pin
-    SPI_CS = 1
-
     def __init__(self):
         '''
         Constructor
@@ -35,15 +32,10 @@ class PowerAdapter(object):
         self._sense = None
         self._logger = logging.getLogger(LOG_ADPOWER)
 
-        self._logger.debug("Power sense on BCM1 creating...")
-        # the sense is on the last channel
-        self._sense = MCP3008(
-            channel=7,
-            clock_pin=SPI_CLK,
-            mosi_pin=SPI_MOSI,
-            miso_pin=SPI_MISO,
-            select_pin=PowerAdapter.SPI_CS
-        )
+        # the last channel of the second sensor chip by default
+        bus, select, channel = adc.get_power_sense()
+        self._logger.debug("Power sense on %s select %s channel %s creating...", bus, select, channel)
+        self._sense = MCP3008(channel=channel, **bus.get_options(select))
 
     @property
     def source_type(self):
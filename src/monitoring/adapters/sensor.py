@@ -6,9 +6,10 @@ Created on 2017. aug. 28.
 
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from monitoring.adapters import SPI_CLK, SPI_MISO, SPI_MOSI
-from monitoring.constants import LOG_ADSENSOR
+from monitoring.adapters import adc
+from monitoring.constants import LOG_ADSENSOR, THREAD_ADC
 
 # check if running on Raspberry
 if os.uname()[4][:3] == 'arm':
@@ -20,46 +21,74 @@ else:
 
 class SensorAdapter(object):
     '''
-    Load sensor values.
+    Load sensor values from the chips of the ADC topology (see monitoring.adapters.adc).
+    The chips of the different buses are read in parallel.
     '''
-    SPI_CS = [12, 1]
-    # number of channels on MCP3008
-    CHANNEL_COUNT = 8
     # total number of channels on the board
     IO_NUMBER = int(os.environ["INPUT_NUMBER"])
 
     def __init__(self):
         self._channels = []
+        # bus index of the channels
+        self._buses = []
         self._logger = logging.getLogger(LOG_ADSENSOR)
 
-        for i in range(SensorAdapter.IO_NUMBER):
-            self._logger.debug("Channel (index:{:2} channel:{:2}<=CH{:0>2} on BCM{:0>2} ({})) creating...".format(
-                i, i % SensorAdapter.CHANNEL_COUNT, i + 1, SensorAdapter.SPI_CS[i // SensorAdapter.CHANNEL_COUNT], MCP3008.__name__))
-            self._channels.append(
-                MCP3008(
-                    channel=i % SensorAdapter.CHANNEL_COUNT,
-                    clock_pin=SPI_CLK,
-                    mosi_pin=SPI_MOSI,
-                    miso_pin=SPI_MISO,
-                    select_pin=SensorAdapter.SPI_CS[i // SensorAdapter.CHANNEL_COUNT]
-                )
-            )
+        addresses = adc.get_addresses(adc.get_chips())
+        if len(addresses) < SensorAdapter.IO_NUMBER:
+            raise ValueError("The ADC chips have %d channels instead of %d" % (len(addresses), SensorAdapter.IO_NUMBER))
+
+        for i, (chip, channel) in enumerate(addresses[:SensorAdapter.IO_NUMBER]):
+            self._logger.debug("Channel (index:{:2} channel:{:2}<=CH{:0>2} on {} select {} ({})) creating...".format(
+                i, channel, i + 1, chip.bus, chip.select, MCP3008.__name__))
+            self._channels.append(MCP3008(channel=channel, **chip.bus.get_options(chip.select)))
+            self._buses.append(chip.bus.index)
+
+        # the first bus is read by the caller
+        bus_count = len(set(self._buses))
+        self._executor = ThreadPoolExecutor(max_workers=bus_count - 1, thread_name_prefix=THREAD_ADC) \
+            if bus_count > 1 else None
+        # reading the last requested channels: channels => [[(index, device)] by bus]
+        self._plan_channels = None
+        self._plan = None
 
     def get_value(self, channel):
         '''Get the value from one channel'''
-        if 0 <= channel <= 14:
+        if 0 <= channel < len(self._channels):
             # !!! channel numbering correction board numbering CH1..CH15 => array 0..14
             return self._channels[channel].value
         else:
             return 0
 
-    def get_values(self):
-        '''Get the values from all the channels'''
-        values = []
-        for channel in self._channels:
-            values.append(channel.value)
+    def get_values(self, channels=None):
+        '''Get the values from the channels (all by default) in the same order'''
+        channels = tuple(range(len(self._channels)) if channels is None else channels)
+        if channels != self._plan_channels:
+            self._plan = self._create_plan(channels)
+            self._plan_channels = channels
+
+        values = [0] * len(channels)
+        if len(self._plan) > 1:
+            futures = [self._executor.submit(self._read, reads, values) for reads in self._plan[1:]]
+            self._read(self._plan[0], values)
+            for future in futures:
+                future.result()
+        elif self._plan:
+            self._read(self._plan[0], values)
         return values
 
+    def _create_plan(self, channels):
+        '''The channels grouped by bus'''
+        reads = {}
+        for index, channel in enumerate(channels):
+            if 0 <= channel < len(self._channels):
+                reads.setdefault(self._buses[channel], []).append((index, self._channels[channel]))
+        return list(reads.values())
+
+    @staticmethod
+    def _read(reads, values):
+        for index, device in reads:
+            values[index] = device.value
+
     @property
     def channel_count(self):
         '''Retrieve the number of the handled channels'''
@@ -7,16 +7,15 @@ Created on 2017. szept. 13.
 from datetime import datetime
 import logging
 import pytz
-from threading import Thread, BoundedSemaphore
-from time import time
+from threading import Thread, BoundedSemaphore, Lock
 
-from models import db, Alert, AlertSensor, Sensor
+from models import Alert, AlertSensor, Sensor
 from monitoring.adapters.syren import SyrenAdapter
+from monitoring.clock import SystemClock
 from monitoring.socket_io import send_syren_state, send_alert_state, send_system_state_change
 from monitoring.constants import ALERT_SABOTAGE, MONITORING_SABOTAGE, LOG_ALERT, THREAD_ALERT
-from multiprocessing import Queue
-from queue import Empty
-from monitoring import storage
+from queue import Empty, Queue
+from monitoring import database, journal, metrics, storage
 from monitoring.notifications.notifier import Notifier
 
 
@@ -31,7 +30,7 @@ class SensorAlert(Thread):
 
     _sensor_queue = Queue()
 
-    def __init__(self, sensor_id, delay, alert_type, stop_event):
+    def __init__(self, sensor_id, delay, alert_type, stop_event, clock=None):
         """
         Constructor
         """
@@ -41,18 +40,33 @@ class SensorAlert(Thread):
         self._delay = delay
         self._alert_type = alert_type
         self._stop_event = stop_event
+        self._clock = clock or SystemClock()
+        # starting the syren (epoch)
+        self.deadline = self._clock.time() + delay
+        self._lock = Lock()
+        self._cancelled = False
+
+    def cancel(self):
+        '''Don't start the syren after the delay (the sensor is removed)'''
+        with self._lock:
+            self._cancelled = True
 
     def run(self):
         self._logger.info("Alert (%s) started on sensor (id:%s) waiting %s sec before starting syren",
                           self._alert_type, self._sensor_id, self._delay)
-        if not self._stop_event.wait(self._delay):
-            self._logger.info("Start syren because not disarmed (%s) sensor (id:%s) in %s secs",
-                              self._alert_type, self._sensor_id, self._delay)
-            SyrenAlert.start_syren(self._alert_type, SensorAlert._sensor_queue, self._stop_event)
-            SensorAlert._sensor_queue.put(self._sensor_id)
-            if self._alert_type == ALERT_SABOTAGE:
-                storage.set("state", MONITORING_SABOTAGE)
-                send_system_state_change(MONITORING_SABOTAGE)
+        if not self._clock.wait(self._stop_event, self._delay):
+            # the cancel waits for starting the syren
+            with self._lock:
+                if self._cancelled:
+                    self._logger.info("Sensor alert cancelled (id:%s)", self._sensor_id)
+                    return
+                self._logger.info("Start syren because not disarmed (%s) sensor (id:%s) in %s secs",
+                                  self._alert_type, self._sensor_id, self._delay)
+                SyrenAlert.start_syren(self._alert_type, SensorAlert._sensor_queue, self._stop_event, self._clock)
+                SensorAlert._sensor_queue.put(self._sensor_id)
+                if self._alert_type == ALERT_SABOTAGE:
+                    storage.set("state", MONITORING_SABOTAGE)
+                    send_system_state_change(MONITORING_SABOTAGE)
         else:
             self._logger.info("Sensor alert stopped")
 
@@ -64,49 +78,64 @@ class SyrenAlert(Thread):
 
     _semaphore = BoundedSemaphore()
     _alert = None
+    # creating the db sessions of the alerts (replaced by the simulations)
+    _session_factory = None
 
     @classmethod
-    def start_syren(cls, alert_type, sensor_queue, stop_event):
+    def start_syren(cls, alert_type, sensor_queue, stop_event, clock=None, alert_id=None):
+        '''Start the syren alert if not running, continue the open alert of the id if given'''
         with cls._semaphore:
             if not cls._alert:
-                cls._alert = SyrenAlert(alert_type, sensor_queue, stop_event)
+                cls._alert = SyrenAlert(alert_type, sensor_queue, stop_event, clock, alert_id)
                 cls._alert.start()
             return cls._alert
 
+    @classmethod
+    def get_active_alert(cls):
+        '''The id and the type of the saved alert of the running syren alert'''
+        syren_alert = cls._alert
+        alert = syren_alert._alert if syren_alert else None
+        if alert is None or alert.id is None:
+            return None
+        return {"id": alert.id, "type": syren_alert._alert_type}
+
     @classmethod
     def get_sensor_queue(cls):
         return cls._sensor_queue
 
-    def __init__(self, arm_type, sensor_queue, stop_event):
+    def __init__(self, arm_type, sensor_queue, stop_event, clock=None, alert_id=None):
         super(SyrenAlert, self).__init__(name=THREAD_ALERT)
+        self._clock = clock or SystemClock()
         self._alert_type = arm_type
         self._sensor_queue = sensor_queue
         self._stop_event = stop_event
         self._logger = logging.getLogger(LOG_ALERT)
         self._syren = SyrenAdapter()
         self._alert = None
+        # the open alert of the previous run
+        self._resumed_alert_id = alert_id
         self._db_session = None
 
     def run(self):
         if not self._db_session:
-            self._db_session = db.create_scoped_session()
+            self._db_session = (SyrenAlert._session_factory or database.create_session)()
 
         self.start_alert()
-        start_time = time()
+        start_time = self._clock.time()
         sysren_is_on = True
         while not self._stop_event.is_set():
-            if self._stop_event.wait(timeout=1):
+            if self._clock.wait(self._stop_event, timeout=1):
                 break
 
-            now = time()
+            now = self._clock.time()
             if (now - start_time > SYREN_DEFAULT_ALERT_TIME) and sysren_is_on:
-                start_time = time()
+                start_time = self._clock.time()
                 sysren_is_on = False
                 self._syren.alert(sysren_is_on)
                 send_syren_state(sysren_is_on)
                 self._logger.info("Syren suspended")
             elif (now - start_time > SYREN_DEFAULT_SUSPEND_TIME) and not sysren_is_on:
-                start_time = time()
+                start_time = self._clock.time()
                 sysren_is_on = True
                 self._syren.alert(sysren_is_on)
                 send_syren_state(sysren_is_on)
@@ -118,10 +147,14 @@ class SyrenAlert(Thread):
         self._db_session.close()
 
     def start_alert(self):
-        start_time = datetime.now(pytz.timezone("CET"))
+        if self._resumed_alert_id is not None and self.resume_alert():
+            return
+
+        start_time = datetime.fromtimestamp(self._clock.time(), pytz.timezone("CET"))
         self._alert = Alert(self._alert_type, start_time=start_time, sensors=[])
         self._db_session.add(self._alert)
-        self._db_session.commit()
+        metrics.commit(self._db_session, "alert")
+        journal.record_alert(journal.EVENT_ALERT_STARTED, self._alert.id, self._alert_type)
 
         send_alert_state(self._alert.serialize)
         self._syren.alert(True)
@@ -132,12 +165,27 @@ class SyrenAlert(Thread):
 
         self._logger.info("Alert started")
 
+    def resume_alert(self):
+        '''Continue the open alert, it was notified already'''
+        alert = self._db_session.query(Alert).get(self._resumed_alert_id)
+        if alert is None or alert.end_time is not None:
+            self._logger.info("Alert (id:%s) can't be resumed", self._resumed_alert_id)
+            return False
+
+        self._alert = alert
+        send_alert_state(self._alert.serialize)
+        self._syren.alert(True)
+        send_syren_state(True)
+        self._logger.info("Alert resumed (id:%s)", alert.id)
+        return True
+
     def stop_alert(self):
         with SyrenAlert._semaphore:
             SyrenAlert._alert = None
             self.handle_sensors()
-            self._alert.end_time = datetime.now(pytz.timezone("CET"))
-            self._db_session.commit()
+            self._alert.end_time = datetime.fromtimestamp(self._clock.time(), pytz.timezone("CET"))
+            metrics.commit(self._db_session, "alert")
+            journal.record_alert(journal.EVENT_ALERT_STOPPED, self._alert.id, self._alert_type)
 
             send_alert_state(None)
             self._syren.alert(False)
@@ -175,7 +223,7 @@ class SyrenAlert(Thread):
             pass
 
         if sensor_added:
-            self._db_session.commit()
+            metrics.commit(self._db_session, "alert")
             send_alert_state(self._alert.serialize)
 
         return sensor_added
@@ -0,0 +1,56 @@
+'''
+Measuring the reference values of the sensors.
+
+The calibration collects the samples of the monitor loop (it doesn't read the
+channels itself and never blocks) and calculates a robust reference (median)
+and noise (scaled median absolute deviation) for every channel.
+'''
+from array import array
+from math import isnan
+from statistics import median
+
+# scale of the median absolute deviation to estimate the standard deviation
+MAD_SCALE = 1.4826
+
+
+class Calibration(object):
+    '''
+    Incremental calibration of the channels.
+    '''
+
+    def __init__(self, channels, sample_count):
+        self._sample_count = sample_count
+        self._values = {channel: array('f') for channel in channels}
+
+    @property
+    def channels(self):
+        return list(self._values.keys())
+
+    @property
+    def finished(self):
+        return all(len(values) >= self._sample_count for values in self._values.values())
+
+    @property
+    def progress(self):
+        '''Ratio of the collected samples (0.0 - 1.0)'''
+        if not self._values:
+            return 1.0
+        collected = sum(min(len(values), self._sample_count) for values in self._values.values())
+        return collected / (self._sample_count * len(self._values))
+
+    def add(self, samples):
+        '''Add the values of the channels from the sample (NaN if not available)'''
+        for channel, values in self._values.items():
+            value = samples[channel]
+            if len(values) < self._sample_count and not isnan(value):
+                values.append(value)
+
+    def results(self):
+        '''The reference and the noise by channel'''
+        results = {}
+        for channel, values in self._values.items():
+            reference = median(values)
+            noise = MAD_SCALE * median(abs(value - reference) for value in values)
+            results[channel] = (reference, noise)
+
+        return results
@@ -0,0 +1,26 @@
+'''
+Clock of the monitoring components.
+
+The monitor and the alerts get the time and wait through a clock object so the
+simulations can replace the real time (see adapters.mock.clock.SimulatedClock).
+'''
+import time
+
+
+class SystemClock(object):
+    '''
+    The real time.
+    '''
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        '''Wait for the event like Event.wait'''
+        return event.wait(timeout)
@@ -14,6 +14,11 @@ THREAD_NOTIFIER = 'Notifier'
 THREAD_SOCKETIO = 'SocketIO'
 THREAD_ALERT    = 'Alert'
 THREAD_KEYPAD   = 'Keypad'
+THREAD_PROFILER = 'Profiler'
+THREAD_KEYPAD_LINK = 'KeypadLink'
+THREAD_JOURNAL = 'Journal'
+THREAD_ADC = 'ADC'
+THREAD_SNAPSHOT = 'Snapshot'
 
 LOG_SERVICE   = THREAD_SERVICE
 LOG_MONITOR   = THREAD_MONITOR
@@ -21,6 +26,8 @@ LOG_IPC       = THREAD_IPC
 LOG_ALERT     = THREAD_ALERT
 LOG_SOCKETIO  = THREAD_SOCKETIO
 LOG_NOTIFIER  = THREAD_NOTIFIER
+LOG_PROFILER  = THREAD_PROFILER
+LOG_JOURNAL   = THREAD_JOURNAL
 LOG_ADSENSOR  = 'AD.Sensor'
 LOG_ADPOWER   = 'AD.Power'
 LOG_ADSYREN   = 'AD.Syren'
@@ -34,6 +41,8 @@ LOGGING_MODULES = [
     (LOG_ALERT, INFO),
     (LOG_SOCKETIO, INFO),
     (LOG_NOTIFIER, INFO),
+    (LOG_PROFILER, INFO),
+    (LOG_JOURNAL, INFO),
     (LOG_ADSENSOR, INFO),
     (LOG_ADSYREN, INFO),
     (LOG_ADGSM, INFO),
@@ -46,11 +55,14 @@ MONITOR_ARM_AWAY = 'monitor_arm_away'
 MONITOR_ARM_STAY = 'monitor_arm_stay'
 MONITOR_DISARM = 'monitor_disarm'
 MONITOR_UPDATE_CONFIG = 'monitor_update_config'
+MONITOR_UPDATE_OPTION = 'monitor_update_option'
 MONITOR_UPDATE_KEYPAD = 'monitor_update_keypad'
 MONITOR_UPDATE_DYNDNS = 'monitor_update_dyndns'
 MONITOR_STOP = 'monitor_stop'
 MONITOR_SYNC_CLOCK = 'monitor_sync_clock'
 MONITOR_SET_CLOCK = 'monitor_set_clock'
+MONITOR_START_PROFILER = 'monitor_start_profiler'
+MONITOR_STOP_PROFILER = 'monitor_stop_profiler'
 
 '''---------------------------------------------------------------'''
 # CONSTANTS USED ALSO BY THE WEB APPLICATION
@@ -77,5 +89,16 @@ MONITORING_ARMED = 'monitoring_armed'
 MONITORING_SABOTAGE = 'monitoring_sabotage'
 MONITORING_ERROR = 'monitoring_error'
 
+# configuration changes (entity, change)
+CONFIG_SENSOR = 'sensor'
+CONFIG_ZONE = 'zone'
+CONFIG_CREATED = 'created'
+CONFIG_UPDATED = 'updated'
+CONFIG_DELETED = 'deleted'
+
+# output formats of the profiler
+PROFILE_COLLAPSED = 'collapsed'
+PROFILE_SPEEDSCOPE = 'speedscope'
+
 ROLE_ADMIN = 'admin'
 ROLE_USER = 'user'
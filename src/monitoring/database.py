@@ -0,0 +1,150 @@
+'''
+Database access of the monitoring service.
+
+The components of a process share one engine (connection pool) and create
+their sessions from the same factory. The engine is created on the first use
+in the process. The connections are never shared between processes: a
+connection opened by the parent is detached (not closed) and replaced when
+the forked keypad process checks it out.
+
+The backend is PostgreSQL by default, DB_BACKEND=sqlite selects an embedded
+database file (DB_FILE) for the devices with low memory. The SQLite database
+is used in WAL mode: the readers (REST server, monitoring) don't block the
+writer and the writers of the processes wait for each other (busy timeout).
+'''
+import os
+import sqlite3
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.orm.session import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from monitoring import metrics
+
+# connections kept open (monitor, notifier, alert, keypad, gsm) and the temporary ones
+POOL_SIZE = 5
+MAX_OVERFLOW = 5
+# reopen the connections after (sec)
+POOL_RECYCLE = 3600
+# waiting for a connection from the pool (sec)
+POOL_TIMEOUT = 10
+CONNECT_TIMEOUT = 5  # sec
+STATEMENT_TIMEOUT = 5000  # ms
+
+BACKEND_POSTGRESQL = "postgresql"
+BACKEND_SQLITE = "sqlite"
+# applied on every new SQLite connection
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    # fsync only at the checkpoints, the commits are not lost by a crash of the processes
+    "synchronous=NORMAL",
+    "foreign_keys=ON",
+    # waiting for the writer of the other process (ms)
+    "busy_timeout=%d" % STATEMENT_TIMEOUT,
+    "temp_store=MEMORY",
+    # KiB per connection
+    "cache_size=-2000"
+)
+
+POOL_CONNECTIONS = metrics.gauge("argus_db_pool_connections", "Connections of the database pool", ("state",))
+
+_engine = None
+_session_factory = None
+
+
+def get_backend():
+    return os.environ.get("DB_BACKEND", BACKEND_POSTGRESQL)
+
+
+def is_sqlite():
+    return get_backend() == BACKEND_SQLITE
+
+
+def get_uri():
+    if is_sqlite():
+        return "sqlite:///%s" % os.path.abspath(os.environ.get("DB_FILE", "argus.db"))
+
+    return "postgresql://%s:%s@%s:%s/%s" % (
+        os.environ.get("DB_USER", None),
+        os.environ.get("DB_PASSWORD", None),
+        os.environ.get("DB_HOST", None),
+        os.environ.get("DB_PORT", None),
+        os.environ.get("DB_SCHEMA", None)
+    )
+
+
+def get_engine_options():
+    '''Options of create_engine for the backend (also used by the REST server)'''
+    if is_sqlite():
+        return {
+            # the file databases don't use a pool by default
+            "poolclass": QueuePool,
+            "pool_size": POOL_SIZE,
+            "max_overflow": MAX_OVERFLOW,
+            "pool_timeout": POOL_TIMEOUT,
+            "connect_args": {
+                # the sessions of the threads check out the connections of the pool
+                "check_same_thread": False
+            }
+        }
+
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_pre_ping": True,
+        "connect_args": {
+            "connect_timeout": CONNECT_TIMEOUT,
+            "options": "-c statement_timeout=%d" % STATEMENT_TIMEOUT
+        }
+    }
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    '''Configure the SQLite connections of all the engines (REST server, monitoring, migrations)'''
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute("PRAGMA %s" % pragma)
+    cursor.close()
+
+
+def on_connect(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    if connection_record.info["pid"] != os.getpid():
+        # opened by the parent process, closing it would terminate the parent's connection
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise exc.DisconnectionError("Connection record belongs to pid %s, attempting to check out in pid %s" %
+                                     (connection_record.info["pid"], os.getpid()))
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(get_uri(), **get_engine_options())
+        event.listen(_engine, "connect", on_connect)
+        event.listen(_engine, "checkout", on_checkout)
+
+        pool = _engine.pool
+        POOL_CONNECTIONS.set_function(pool.checkedin, state="idle")
+        POOL_CONNECTIONS.set_function(pool.checkedout, state="used")
+        # negative while the pool is not full
+        POOL_CONNECTIONS.set_function(lambda: max(0, pool.overflow()), state="overflow")
+    return _engine
+
+
+def create_session():
+    '''New session of the shared engine, close it after use'''
+    global _session_factory
+    if _session_factory is None:
+        # avoid reloading records from database after session commit
+        _session_factory = sessionmaker(bind=get_engine(), expire_on_commit=False)
+    return _session_factory()
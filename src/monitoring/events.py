@@ -0,0 +1,62 @@
+'''
+Event bus of the monitoring service.
+
+The components subscribe to the topics of the messages they handle and get
+them in their own queue. The threads of the service use plain thread-safe
+queues, the messages are not copied. Any object with a put method can be
+subscribed (e.g. the channel of the keypad process).
+
+The topic of a command is the command itself (e.g. MONITOR_DISARM), the topic
+of a dictionary message is its action (e.g. the configuration changes).
+'''
+from queue import Queue
+from threading import Lock
+
+
+def get_topic(message):
+    if isinstance(message, dict):
+        return message.get('action')
+    return message
+
+
+class Subscription(object):
+
+    def __init__(self, queue, topics):
+        self.queue = queue
+        # None: all the topics
+        self.topics = frozenset(topics) if topics is not None else None
+
+    def accepts(self, topic):
+        return self.topics is None or topic in self.topics
+
+
+class EventBus(object):
+    '''
+    Deliver the published messages to the queues of the subscribed topics.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        # replaced on change, publishing doesn't need the lock
+        self._subscriptions = ()
+
+    def subscribe(self, topics=None, queue=None):
+        '''
+        Subscribe to the topics (all if None), the messages are put into the queue
+        (a new in-process queue by default) which is returned.
+        '''
+        queue = Queue() if queue is None else queue
+        with self._lock:
+            self._subscriptions = self._subscriptions + (Subscription(queue, topics),)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscriptions = tuple(subscription for subscription in self._subscriptions
+                                        if subscription.queue is not queue)
+
+    def publish(self, message):
+        topic = get_topic(message)
+        for subscription in self._subscriptions:
+            if subscription.accepts(topic):
+                subscription.queue.put(message)
@@ -0,0 +1,249 @@
+'''
+Rollups of the sensor samples (min, max, mean and count per channel).
+
+The rollups are maintained incrementally from the samples of the monitor
+with 1 sec, 1 min and 1 hour resolution. A closed bucket of a resolution is
+merged into the bucket of the next resolution. Every resolution is stored in
+a memory mapped ring (see recorder.MappedRing) so the retention is limited
+by the number of the buckets.
+'''
+import os
+from math import isnan
+
+from monitoring.recorder import MappedRing
+
+# resolution (sec), number of buckets
+RESOLUTIONS = (
+    (1, 3600),              # 1 hour
+    (60, 7 * 24 * 60),      # 1 week
+    (3600, 365 * 24)        # 1 year
+)
+# maximum number of points when the resolution is not requested
+MAX_POINTS = 1000
+
+
+def get_history_path():
+    return os.environ["DATA_PATH"]
+
+
+class Rollup(object):
+    '''
+    Buckets with one resolution of all the channels.
+
+    The open bucket is always stored in the slot of the head and it's committed
+    when a sample (or bucket) arrives for a later bucket.
+    '''
+
+    def __init__(self, path, resolution, capacity, channel_count=None, readonly=False):
+        self.resolution = resolution
+        if readonly:
+            self._ring = MappedRing(path, readonly=True)
+            channel_count = self._ring.widths["count"]
+        else:
+            self._ring = MappedRing(path, [
+                ("start", "d", 1),
+                ("min", "f", channel_count),
+                ("max", "f", channel_count),
+                ("sum", "d", channel_count),
+                ("count", "I", channel_count)
+            ], capacity)
+
+        self.channel_count = channel_count
+        self.capacity = self._ring.capacity
+        self.starts = self._ring.columns["start"]
+        self.mins = self._ring.columns["min"]
+        self.maxs = self._ring.columns["max"]
+        self.sums = self._ring.columns["sum"]
+        self.counts = self._ring.columns["count"]
+        self._start = None
+
+        if not readonly:
+            self._restore()
+
+    def _restore(self):
+        '''Continue the open bucket after restart'''
+        slot = self._ring.head % self.capacity
+        if self.starts[slot] and self._ring.head and self.starts[slot] <= self.starts[(slot - 1) % self.capacity]:
+            # it's an old bucket from before the wrap around
+            return
+
+        if self.starts[slot]:
+            self._start = self.starts[slot]
+
+    def bucket_of(self, timestamp):
+        return timestamp - timestamp % self.resolution
+
+    def _switch(self, start):
+        '''
+        Close the open bucket if the new bucket starts later.
+        Returns the slot of the closed bucket.
+        '''
+        if self._start == start:
+            return None
+
+        closed = None
+        if self._start is not None:
+            closed = self._ring.head % self.capacity
+            self._ring.commit()
+
+        self._start = start
+        slot = self._ring.head % self.capacity
+        self.starts[slot] = start
+        offset = slot * self.channel_count
+        for index in range(offset, offset + self.channel_count):
+            self.counts[index] = 0
+            self.sums[index] = 0.0
+
+        return closed
+
+    def add_sample(self, timestamp, values):
+        closed = self._switch(self.bucket_of(timestamp))
+        offset = (self._ring.head % self.capacity) * self.channel_count
+        for channel in range(self.channel_count):
+            value = values[channel]
+            if isnan(value):
+                continue
+
+            index = offset + channel
+            if self.counts[index]:
+                if value < self.mins[index]:
+                    self.mins[index] = value
+                if value > self.maxs[index]:
+                    self.maxs[index] = value
+            else:
+                self.mins[index] = self.maxs[index] = value
+            self.sums[index] += value
+            self.counts[index] += 1
+
+        return closed
+
+    def add_bucket(self, source, source_slot):
+        '''Merge a closed bucket of a finer rollup'''
+        closed = self._switch(self.bucket_of(source.starts[source_slot]))
+        offset = (self._ring.head % self.capacity) * self.channel_count
+        source_offset = source_slot * self.channel_count
+        for channel in range(self.channel_count):
+            count = source.counts[source_offset + channel]
+            if not count:
+                continue
+
+            index = offset + channel
+            minimum = source.mins[source_offset + channel]
+            maximum = source.maxs[source_offset + channel]
+            if self.counts[index]:
+                if minimum < self.mins[index]:
+                    self.mins[index] = minimum
+                if maximum > self.maxs[index]:
+                    self.maxs[index] = maximum
+            else:
+                self.mins[index] = minimum
+                self.maxs[index] = maximum
+            self.sums[index] += source.sums[source_offset + channel]
+            self.counts[index] += count
+
+        return closed
+
+    def retention_start(self, now):
+        return self.bucket_of(now) - (self.capacity - 1) * self.resolution
+
+    def query(self, channel, start, end):
+        '''The buckets (start, min, max, mean, count) of the channel between the timestamps'''
+        if not 0 <= channel < self.channel_count:
+            # not recorded (the channels of the board were changed)
+            return []
+
+        head = self._ring.head
+        slots = [index % self.capacity for index in range(max(0, head - self.capacity + 1), head)]
+        # the open bucket (if it's not an old one before the wrap around)
+        open_slot = head % self.capacity
+        if not slots or self.starts[open_slot] > self.starts[slots[-1]]:
+            slots.append(open_slot)
+
+        points = []
+        for slot in slots:
+            bucket = self.starts[slot]
+            if not bucket or bucket + self.resolution <= start or bucket > end:
+                continue
+
+            index = slot * self.channel_count + channel
+            count = self.counts[index]
+            if count:
+                points.append({
+                    "time": bucket,
+                    "min": self.mins[index],
+                    "max": self.maxs[index],
+                    "mean": self.sums[index] / count,
+                    "count": count
+                })
+
+        # the wall clock may be set back
+        points.sort(key=lambda point: point["time"])
+        return points
+
+    def close(self):
+        self.starts = self.mins = self.maxs = self.sums = self.counts = None
+        self._ring.close()
+
+
+class SensorHistory(object):
+    '''
+    Rollups of the sensor samples in all the resolutions.
+    '''
+
+    def __init__(self, path=None, channel_count=None, readonly=False):
+        path = path or get_history_path()
+        self._rollups = [
+            Rollup(
+                os.path.join(path, "history_%ds.bin" % resolution),
+                resolution,
+                capacity,
+                channel_count,
+                readonly
+            )
+            for resolution, capacity in RESOLUTIONS
+        ]
+
+    @property
+    def channel_count(self):
+        return self._rollups[0].channel_count
+
+    @property
+    def resolutions(self):
+        return [rollup.resolution for rollup in self._rollups]
+
+    def add(self, timestamp, values):
+        '''Add the sample (the values of all the channels, NaN if not monitored)'''
+        closed = self._rollups[0].add_sample(timestamp, values)
+        for finer, coarser in zip(self._rollups, self._rollups[1:]):
+            if closed is None:
+                break
+            closed = coarser.add_bucket(finer, closed)
+
+    def select(self, start, end, now, resolution=None):
+        '''
+        Select the coarsest rollup not coarser than the requested resolution
+        (by default the number of points is limited) which still covers the start.
+        '''
+        if resolution is None:
+            resolution = (end - start) / MAX_POINTS
+
+        selected = self._rollups[0]
+        for rollup in self._rollups:
+            if rollup.resolution <= resolution:
+                selected = rollup
+
+        for rollup in self._rollups[self._rollups.index(selected):]:
+            selected = rollup
+            if rollup.retention_start(now) <= start:
+                break
+
+        return selected
+
+    def query(self, channel, start, end, now, resolution=None):
+        '''Returns the selected resolution and the points'''
+        rollup = self.select(start, end, now, resolution)
+        return rollup.resolution, rollup.query(channel, start, end)
+
+    def close(self):
+        for rollup in self._rollups:
+            rollup.close()
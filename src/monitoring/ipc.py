@@ -9,18 +9,25 @@ import socket
 from os import chmod, chown, environ, makedirs, path, remove
 from threading import Thread
 
-from certificates import update_certificates
-from dyndns import update_ip
-from monitoring import storage
+from monitoring import journal, metrics, options, profiler, startup, storage
 from monitoring.constants import (LOG_IPC, MONITOR_ARM_AWAY, MONITOR_ARM_STAY,
                                   MONITOR_DISARM, MONITOR_SET_CLOCK,
+                                  MONITOR_START_PROFILER, MONITOR_STOP_PROFILER,
                                   MONITOR_SYNC_CLOCK, MONITOR_UPDATE_CONFIG,
                                   MONITOR_UPDATE_DYNDNS, MONITOR_UPDATE_KEYPAD,
-                                  THREAD_IPC)
-from server.tools import enable_certbot_job, enable_dyndns_job
+                                  MONITOR_UPDATE_OPTION,
+                                  PROFILE_COLLAPSED, THREAD_IPC)
 from tools.clock import set_clock, sync_clock
+from tools.lazy import lazy_import
+
+# requests, noipy, pydbus and crontab are needed only for updating the dyndns
+certificates = lazy_import("certificates")
+dyndns = lazy_import("dyndns")
+cron = lazy_import("server.tools")
 
 MONITOR_INPUT_SOCKET = environ["MONITOR_INPUT_SOCKET"]
+# journal events in a response
+EVENTS_LIMIT = 1000
 
 
 class IPCServer(Thread):
@@ -28,14 +35,14 @@ class IPCServer(Thread):
     Class for handling the actions from the server and executing them on monitoring.
     """
 
-    def __init__(self, stop_event, broadcaster):
+    def __init__(self, stop_event, bus):
         """
         Constructor
         """
         super(IPCServer, self).__init__(name=THREAD_IPC)
         self._logger = logging.getLogger(LOG_IPC)
         self._stop_event = stop_event
-        self._broadcaster = broadcaster
+        self._bus = bus
         self._initialize_socket()
         self._logger.info("IPC server created")
 
@@ -68,34 +75,70 @@ class IPCServer(Thread):
     def handle_actions(self, message):
         if message["action"] == MONITOR_ARM_AWAY:
             self._logger.info("Action: arm AWAY")
-            self._broadcaster.send_message(MONITOR_ARM_AWAY)
+            self._bus.publish(MONITOR_ARM_AWAY)
         if message["action"] == MONITOR_ARM_STAY:
             self._logger.info("Action: arm STAY")
-            self._broadcaster.send_message(MONITOR_ARM_STAY)
+            self._bus.publish(MONITOR_ARM_STAY)
         elif message["action"] == MONITOR_DISARM:
             self._logger.info("Action: disarm")
-            self._broadcaster.send_message(MONITOR_DISARM)
+            self._bus.publish(MONITOR_DISARM)
         elif message["action"] == "get_arm":
             arm = storage.get("arm")
             return {"type": arm}
         elif message["action"] == "get_state":
             return {"state": storage.get("state")}
+        elif message["action"] == "get_startup":
+            return startup.get_timings()
+        elif message["action"] == "get_metrics":
+            return metrics.REGISTRY.snapshot()
+        elif message["action"] == "get_events":
+            events = journal.read(message.get("since", 0), min(message.get("limit") or EVENTS_LIMIT, EVENTS_LIMIT))
+            return {"events": [event.serialize for event in events]}
         elif message["action"] == MONITOR_UPDATE_CONFIG:
-            self._logger.info("Update configuration...")
-            self._broadcaster.send_message(MONITOR_UPDATE_CONFIG)
+            if message.get("changes"):
+                self._logger.info("Update configuration: %s", message["changes"])
+                self._bus.publish(message)
+            else:
+                self._logger.info("Update configuration...")
+                options.invalidate()
+                self._bus.publish(MONITOR_UPDATE_CONFIG)
+        elif message["action"] == MONITOR_UPDATE_OPTION:
+            if options.invalidate(message["name"], message["section"], message.get("version")):
+                self._logger.info("Update option: %s/%s (version %s)",
+                                  message["name"], message["section"], message.get("version"))
+                self._bus.publish(message)
+            else:
+                self._logger.debug("Option already loaded: %s/%s", message["name"], message["section"])
         elif message["action"] == MONITOR_UPDATE_KEYPAD:
             self._logger.info("Update keypad...")
-            self._broadcaster.send_message(MONITOR_UPDATE_KEYPAD)
+            self._bus.publish(MONITOR_UPDATE_KEYPAD)
         elif message["action"] == MONITOR_UPDATE_DYNDNS:
             self._logger.info("Update dyndns...")
             # update configuration
-            update_ip(True)
-            update_certificates()
+            dyndns.update_ip(True)
+            certificates.update_certificates()
             # enable cron jobs for update configuration periodically
-            enable_dyndns_job()
-            enable_certbot_job()
+            cron.enable_dyndns_job()
+            cron.enable_certbot_job()
         elif message["action"] == MONITOR_SYNC_CLOCK:
             sync_clock()
+        elif message["action"] == MONITOR_START_PROFILER:
+            self._logger.info("Start profiler...")
+            try:
+                interval = float(message.get("interval", profiler.DEFAULT_INTERVAL))
+                duration = float(message.get("duration", profiler.DEFAULT_DURATION))
+            except (TypeError, ValueError):
+                self._logger.warning("Invalid profiler settings: %s", message)
+                return {"result": False, "profiler": profiler.get_status()}
+            started = profiler.start(interval, duration)
+            return {"result": started, "profiler": profiler.get_status()}
+        elif message["action"] == MONITOR_STOP_PROFILER:
+            self._logger.info("Stop profiler...")
+            return {"result": profiler.stop(), "profiler": profiler.get_status()}
+        elif message["action"] == "get_profiler":
+            return profiler.get_status()
+        elif message["action"] == "get_profile":
+            return {"profile": profiler.get_profile(message.get("format", PROFILE_COLLAPSED))}
         elif message["action"] == MONITOR_SET_CLOCK:
             del message["action"]
             set_clock(message)
@@ -103,7 +146,9 @@ class IPCServer(Thread):
         return {"result": True}
 
     def run(self):
+        startup.wait_for(startup.COMPONENT_IPC)
         self._logger.info("IPC server started")
+        startup.ready(startup.COMPONENT_IPC)
         # read all the messages
         while not self._stop_event.is_set():
             connection = None
@@ -124,7 +169,7 @@ class IPCServer(Thread):
                 response = self.handle_actions(json.loads(data.decode()))
 
                 try:
-                    connection.send(json.dumps(response).encode())
+                    connection.sendall(json.dumps(response).encode())
                 except BrokenPipeError:
                     pass
 
@@ -0,0 +1,459 @@
+'''
+Append-only journal of the monitoring events.
+
+The arm and state changes, the sensor alerts, the start and the stop of the
+alerts and the syren are recorded as fixed size binary records with a
+sequence number (incremented across the restarts) and a timestamp. Recording
+an event only appends it to a buffer, a writer thread writes the buffered
+records together and syncs the file (group commit) periodically.
+
+The journal is a directory of segment files named by their first sequence
+number. A new segment is started when the current one is full. The oldest
+segments over the limit are compacted into one segment which keeps only the
+last event of every subject (e.g. the last state of a sensor).
+
+    PYTHONPATH=src python -m monitoring.journal --since 1000
+'''
+import argparse
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from threading import Condition, Lock, Thread
+from time import time
+
+from monitoring import metrics
+from monitoring.constants import (ALERT_AWAY, ALERT_SABOTAGE, ALERT_STAY,
+                                  ARM_AWAY, ARM_DISARM, ARM_STAY, LOG_JOURNAL,
+                                  MONITORING_ARMED, MONITORING_ERROR,
+                                  MONITORING_INVALID_CONFIG, MONITORING_READY,
+                                  MONITORING_SABOTAGE, MONITORING_STARTUP,
+                                  MONITORING_UPDATING_CONFIG, THREAD_JOURNAL)
+
+JOURNAL_DIRECTORY = "journal"
+SEGMENT_SUFFIX = ".journal"
+
+HEADER = struct.Struct("<8sHH")
+MAGIC = b"ARGUSJNL"
+VERSION = 1
+# sequence, time, event, subject, value, CRC32 of the previous fields
+RECORD = struct.Struct("<QdIIiI")
+CHECKED = struct.Struct("<QdIIi")
+
+# records in a segment file (1 MiB)
+SEGMENT_RECORDS = 32768
+# segments kept without compaction
+MAX_SEGMENTS = 8
+# writing the buffered records (sec)
+FLUSH_INTERVAL = 1.0
+# writing earlier if many records are waiting
+FLUSH_RECORDS = 1024
+# records waiting for writing (2 MiB), the new events are dropped over it
+MAX_BUFFERED = 65536
+
+# events (subject, value)
+EVENT_ARM = 1            # -, arm type
+EVENT_STATE = 2          # -, monitoring state
+EVENT_SENSOR = 3         # sensor id, 1: alert / 0: cleared
+EVENT_ALERT_STARTED = 4  # alert id, alert type
+EVENT_ALERT_STOPPED = 5  # alert id, alert type
+EVENT_SYREN = 6          # -, 1: on / 0: suspended / -1: stopped
+EVENTS = {
+    EVENT_ARM: "arm",
+    EVENT_STATE: "state",
+    EVENT_SENSOR: "sensor",
+    EVENT_ALERT_STARTED: "alert_started",
+    EVENT_ALERT_STOPPED: "alert_stopped",
+    EVENT_SYREN: "syren"
+}
+# the values are stored by their index
+ARM_TYPES = (ARM_DISARM, ARM_AWAY, ARM_STAY)
+STATES = (MONITORING_STARTUP, MONITORING_READY, MONITORING_UPDATING_CONFIG, MONITORING_INVALID_CONFIG,
+          MONITORING_ARMED, MONITORING_SABOTAGE, MONITORING_ERROR)
+ALERT_TYPES = (ALERT_AWAY, ALERT_STAY, ALERT_SABOTAGE)
+VALUE_NAMES = {
+    EVENT_ARM: ARM_TYPES,
+    EVENT_STATE: STATES,
+    EVENT_ALERT_STARTED: ALERT_TYPES,
+    EVENT_ALERT_STOPPED: ALERT_TYPES
+}
+
+RECORDED_EVENTS = metrics.counter("argus_journal_events_total", "Events recorded in the journal")
+FLUSH_DURATION = metrics.histogram("argus_journal_flush_seconds", "Duration of writing and syncing the journal")
+DROPPED_EVENTS = metrics.counter("argus_journal_dropped_events_total", "Events dropped with full buffer")
+WRITE_ERRORS = metrics.counter("argus_journal_write_errors_total", "Failed writes of the journal")
+
+_journal = None
+
+
+def get_journal_path():
+    return os.path.join(os.environ["DATA_PATH"], JOURNAL_DIRECTORY)
+
+
+def encode_value(names, value):
+    '''Index of the name, -1 if unknown'''
+    try:
+        return names.index(value)
+    except ValueError:
+        return -1
+
+
+class Event(namedtuple("Event", ("sequence", "time", "event", "subject", "value"))):
+
+    @property
+    def serialize(self):
+        names = VALUE_NAMES.get(self.event)
+        return {
+            "sequence": self.sequence,
+            "time": self.time,
+            "event": EVENTS.get(self.event, self.event),
+            "subject": self.subject,
+            "value": names[self.value] if names and 0 <= self.value < len(names) else self.value
+        }
+
+
+def pack(sequence, timestamp, event, subject, value):
+    fields = CHECKED.pack(sequence, timestamp, event, subject, value)
+    return fields + struct.pack("<I", zlib.crc32(fields))
+
+
+def read_segment(path):
+    '''The valid records of the segment file, reading stops at the first damaged record'''
+    events = []
+    with open(path, "rb") as segment:
+        header = segment.read(HEADER.size)
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION, RECORD.size):
+            return events
+
+        data = segment.read()
+
+    for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+        sequence, timestamp, event, subject, value, checksum = RECORD.unpack_from(data, offset)
+        if zlib.crc32(data[offset:offset + CHECKED.size]) != checksum:
+            break
+        events.append(Event(sequence, timestamp, event, subject, value))
+    return events
+
+
+def write_segment(path, events):
+    '''Write a complete segment file atomically'''
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as segment:
+        segment.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        segment.write(b"".join(pack(*event) for event in events))
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(temporary_path, path)
+
+
+class Journal(Thread):
+    '''
+    Recording the events and writing them in the background.
+    '''
+
+    def __init__(self, path, segment_records=SEGMENT_RECORDS, max_segments=MAX_SEGMENTS,
+                 flush_interval=FLUSH_INTERVAL):
+        super(Journal, self).__init__(name=THREAD_JOURNAL, daemon=True)
+        self._logger = logging.getLogger(LOG_JOURNAL)
+        self._path = path
+        self._segment_records = segment_records
+        self._max_segments = max_segments
+        self._flush_interval = flush_interval
+        self._condition = Condition(Lock())
+        # protects the segment files (writing, compacting, reading)
+        self._files = Lock()
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._stopped = False
+        # the last write failed, the records are kept in the buffer
+        self._failed = False
+        self._file = None
+        self._segment_size = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._sequence = self._recover()
+
+    def _segments(self):
+        '''The segment files ordered by their first sequence number'''
+        return sorted(os.path.join(self._path, name) for name in os.listdir(self._path)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _recover(self):
+        '''The last sequence number, the damaged end of the last segment is removed'''
+        segments = self._segments()
+        if not segments:
+            return 0
+
+        events = read_segment(segments[-1])
+        if events:
+            with open(segments[-1], "r+b") as segment:
+                segment.truncate(HEADER.size + len(events) * RECORD.size)
+        else:
+            # also a missing or damaged header
+            write_segment(segments[-1], [])
+        self._segment_size = len(events)
+        if events:
+            return events[-1].sequence
+
+        # empty last segment, the sequence continues from the previous one
+        for path in reversed(segments[:-1]):
+            events = read_segment(path)
+            if events:
+                return events[-1].sequence
+        return 0
+
+    def append(self, event, subject=0, value=0, timestamp=None):
+        '''Record the event, returns its sequence number (None if dropped)'''
+        with self._condition:
+            if self._buffered >= MAX_BUFFERED:
+                # the writing fails for long
+                DROPPED_EVENTS.inc()
+                return None
+            self._sequence += 1
+            self._buffer += pack(self._sequence, time() if timestamp is None else timestamp, event, subject, value)
+            self._buffered += 1
+            if self._buffered >= FLUSH_RECORDS:
+                self._condition.notify()
+            sequence = self._sequence
+        RECORDED_EVENTS.inc()
+        return sequence
+
+    @property
+    def sequence(self):
+        '''Sequence number of the last event'''
+        return self._sequence
+
+    def run(self):
+        self._logger.info("Journal started (last event: %s)", self._sequence)
+        while True:
+            with self._condition:
+                if not self._stopped and (self._buffered < FLUSH_RECORDS or self._failed):
+                    self._condition.wait(self._flush_interval)
+                stopped = self._stopped
+
+            self.flush()
+            if stopped:
+                break
+
+        with self._files:
+            if self._file:
+                self._file.close()
+                self._file = None
+        if self._buffered:
+            self._logger.error("Lost %s event(s) of the journal", self._buffered)
+        self._logger.info("Journal stopped (last event: %s)", self._sequence)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.join()
+
+    def flush(self):
+        '''Write the buffered records and sync the segment'''
+        with self._condition:
+            if not self._buffered:
+                return
+            data, count = bytes(self._buffer), self._buffered
+            self._buffer = bytearray()
+            self._buffered = 0
+
+        with FLUSH_DURATION.time(), self._files:
+            try:
+                self._write(data)
+            except OSError:
+                self._logger.exception("Failed to write %s event(s)", count)
+                WRITE_ERRORS.inc()
+                self._failed = True
+                self._keep(data)
+                return
+        self._failed = False
+        self._logger.debug("Written %s event(s)", count)
+
+        try:
+            if len(self._segments()) > self._max_segments:
+                self.compact()
+        except OSError:
+            self._logger.exception("Failed to compact the journal")
+
+    def _write(self, data):
+        offset = 0
+        while offset < len(data):
+            if self._file is None or self._segment_size >= self._segment_records:
+                self._start_segment(RECORD.unpack_from(data, offset)[0])
+
+            records = min(self._segment_records - self._segment_size, (len(data) - offset) // RECORD.size)
+            self._file.write(data[offset:offset + records * RECORD.size])
+            self._segment_size += records
+            offset += records * RECORD.size
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _keep(self, data):
+        '''Put back the records of the failed write which are not in the segment for the next write'''
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+        try:
+            # the last segment is reopened from its valid records
+            written = self._recover()
+        except OSError:
+            self._logger.exception("Failed to recover the journal")
+            written = 0
+            # continue in a new segment
+            self._segment_size = self._segment_records
+
+        offset = 0
+        while offset < len(data) and RECORD.unpack_from(data, offset)[0] <= written:
+            offset += RECORD.size
+        with self._condition:
+            self._buffer[0:0] = data[offset:]
+            self._buffered += (len(data) - offset) // RECORD.size
+
+    def _start_segment(self, sequence):
+        '''Continue the last segment after the start if it's not full or create a new one'''
+        if self._file is not None:
+            # the current segment is full
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        else:
+            segments = self._segments()
+            if segments and self._segment_size < self._segment_records:
+                self._file = open(segments[-1], "ab")
+                return
+
+        path = os.path.join(self._path, "%020d%s" % (sequence, SEGMENT_SUFFIX))
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._segment_size = 0
+
+    def compact(self):
+        '''Merge the oldest segments keeping the last event of the subjects'''
+        with self._files:
+            segments = self._segments()
+            # the current segment is never compacted
+            old_segments = segments[:len(segments) - self._max_segments + 1]
+            if len(old_segments) < 2:
+                return
+
+            last_events = {}
+            for path in old_segments:
+                for event in read_segment(path):
+                    last_events[(event.event, event.subject)] = event
+            events = sorted(last_events.values())
+
+            write_segment(old_segments[0], events)
+            for path in old_segments[1:]:
+                os.remove(path)
+        self._logger.info("Compacted %s segment(s) into %s event(s)", len(old_segments), len(events))
+
+    def read(self, since=0, limit=None):
+        '''
+        The events after the sequence number (written and buffered), the segments are read
+        without blocking the writer until the limit is reached
+        '''
+        with self._condition:
+            buffered = bytes(self._buffer)
+        with self._files:
+            segments = self._segments()
+
+        # skip the segments before the sequence number
+        first = 0
+        for index, path in enumerate(segments):
+            if int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)]) <= since:
+                first = index
+
+        events = []
+        last = since
+        for path in segments[first:]:
+            if limit is not None and len(events) >= limit:
+                return events[:limit]
+            try:
+                segment_events = read_segment(path)
+            except FileNotFoundError:
+                # compacted in the meantime (merged into an older segment)
+                continue
+            # the torn record at the end of the current segment is skipped by the CRC
+            for event in segment_events:
+                if event.sequence > last:
+                    events.append(event)
+                    last = event.sequence
+
+        for offset in range(0, len(buffered), RECORD.size):
+            event = Event(*RECORD.unpack_from(buffered, offset)[:5])
+            if event.sequence > last:
+                events.append(event)
+
+        return events[:limit] if limit is not None else events
+
+
+def start(path=None):
+    '''Start the journal of the service (after forking the keypad process)'''
+    global _journal
+    if _journal is None:
+        _journal = Journal(path or get_journal_path())
+        _journal.start()
+    return _journal
+
+
+def stop():
+    global _journal
+    if _journal is not None:
+        _journal.stop()
+        _journal = None
+
+
+def record(event, subject=0, value=0):
+    '''Record the event if the journal is running, returns its sequence number'''
+    journal = _journal
+    if journal is None:
+        return None
+    return journal.append(event, subject, value)
+
+
+def record_arm(arm):
+    return record(EVENT_ARM, value=encode_value(ARM_TYPES, arm))
+
+
+def record_state(state):
+    return record(EVENT_STATE, value=encode_value(STATES, state))
+
+
+def record_alert(event, alert_id, alert_type):
+    return record(event, alert_id, encode_value(ALERT_TYPES, alert_type))
+
+
+def read(since=0, limit=None):
+    journal = _journal
+    if journal is None:
+        return []
+    return journal.read(since, limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the events of the journal")
+    parser.add_argument("-s", "--since", type=int, default=0, help="Events after the sequence number")
+    parser.add_argument("-p", "--path", help="Journal directory, default: $DATA_PATH/" + JOURNAL_DIRECTORY)
+    args = parser.parse_args()
+
+    path = args.path or get_journal_path()
+    for segment in sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX)):
+        for event in read_segment(os.path.join(path, segment)):
+            if event.sequence > args.since:
+                data = event.serialize
+                data["time"] = datetime.fromtimestamp(event.time).isoformat(sep=" ", timespec="milliseconds")
+                print(json.dumps(data))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+'''
+Logging pipeline of the monitoring service.
+
+The loggers put the records into a queue and a single writer thread formats
+and writes them to the console and the rotated log file, so a log call never
+waits for the disk or the terminal. The queue is shared with the keypad
+process (set up the logging before starting it). When the queue is full the
+records are dropped instead of blocking the caller.
+
+The repetitive messages (below warning) are rate limited by logger and message
+template, the number of the suppressed messages is added to the next message
+let through.
+'''
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from multiprocessing import Queue
+from queue import Full
+from threading import Lock
+from time import monotonic
+
+from monitoring import metrics
+from monitoring.constants import LOGGING_MODULES
+
+LOG_FILE = 'monitoring.log'
+LOG_FORMAT = '%(asctime)s-[%(threadName)10s|%(name)9s] %(levelname)5s: %(message)s'
+# rotation of the log file
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# records waiting for the writer
+LOG_QUEUE_SIZE = 10000
+# number of the same messages let through in a period (sec)
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_PERIOD = 60
+
+DROPPED_RECORDS = metrics.counter("argus_log_dropped_total", "Log records dropped by the logging pipeline",
+                                  ("reason",))
+
+_listener = None
+_writing = False
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Let through RATE_LIMIT_BURST records of a message template in a period,
+    the warnings and the errors are not limited.
+    '''
+
+    def __init__(self, burst=RATE_LIMIT_BURST, period=RATE_LIMIT_PERIOD):
+        super(RateLimitFilter, self).__init__()
+        self._burst = burst
+        self._period = period
+        self._lock = Lock()
+        # (logger, level, template) => [start of the period, count, suppressed]
+        self._messages = {}
+        # removing the old messages
+        self._pruned = monotonic()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.name, record.levelno, record.msg)
+        now = monotonic()
+        with self._lock:
+            if now - self._pruned >= self._period:
+                self._prune(now)
+            state = self._messages.get(key)
+            if state is None or now - state[0] >= self._period:
+                suppressed = state[2] if state else 0
+                self._messages[key] = [now, 1, 0]
+            elif state[1] < self._burst:
+                state[1] += 1
+                suppressed = 0
+            else:
+                state[2] += 1
+                DROPPED_RECORDS.inc(reason="rate_limit")
+                return False
+
+        if suppressed:
+            record.msg = str(record.msg) + " [%d similar messages suppressed]" % suppressed
+        return True
+
+    def _prune(self, now):
+        '''
+        Forget the messages of the expired periods, the suppressed counts are kept
+        for the next message until the next period
+        '''
+        self._messages = {key: state for key, state in self._messages.items()
+                          if now - state[0] < (2 * self._period if state[2] else self._period)}
+        self._pruned = now
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    '''
+    Put the records into the queue without waiting, only the message is formatted in the caller.
+    '''
+
+    def prepare(self, record):
+        # the arguments may change or can't be pickled, the time and the layout are formatted by the writer
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            DROPPED_RECORDS.inc(reason="queue_full")
+
+
+def initialize_logging():
+    '''Route the loggers of the service to the queue, the records are written after start_writer()'''
+    global _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(formatter)
+
+    records = Queue(LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter())
+
+    for name, level in LOGGING_MODULES:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(queue_handler)
+
+    logging.getLogger('SocketIOServer').setLevel(logging.INFO)
+    logging.getLogger('gsmmodem.modem.GsmModem').setLevel(logging.ERROR)
+    logging.getLogger('gsmmodem.serial_comms.SerialComms').setLevel(logging.ERROR)
+    # logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
+
+    _listener = QueueListener(records, console_handler, file_handler)
+
+
+def start_writer():
+    '''Start the writer thread (after forking the keypad process)'''
+    global _writing
+    _listener.start()
+    _writing = True
+
+
+def stop_writer():
+    '''Write the waiting records and stop the writer thread'''
+    global _writing
+    if _writing:
+        _listener.stop()
+        _writing = False
@@ -0,0 +1,264 @@
+'''
+Metrics of the monitoring service (counters, gauges and histograms).
+
+The metrics are registered in the default registry and exported in the
+Prometheus text format or as a dictionary (over IPC). Updating a metric is
+a lock and an addition so it can be used in the monitor loop.
+
+The shared counters are stored in shared memory, they have to be created
+before the keypad process is forked (at import time).
+'''
+from bisect import bisect_left
+from multiprocessing import Value
+from threading import Lock
+from time import perf_counter
+
+# default buckets of the histograms (sec)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(names, values, extra=None):
+    labels = ['%s="%s"' % (name, value) for name, value in zip(names, values)]
+    if extra:
+        labels.append('%s="%s"' % extra)
+    return "{%s}" % ",".join(labels) if labels else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        '''List of (suffix, label values, extra label, value)'''
+        raise NotImplementedError()
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.description),
+            "# TYPE %s %s" % (self.name, self.TYPE)
+        ]
+        for suffix, values, extra, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, format_labels(self.labels, values, extra),
+                                        format_value(value)))
+        return "\n".join(lines)
+
+    def snapshot(self):
+        '''The values by the joined label values'''
+        return {",".join(values) if values else "": value for values, value in self._values.items()}
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name, description, labels=()):
+        super(Counter, self).__init__(name, description, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", key, None, value) for key, value in sorted(self._values.items())]
+
+
+class SharedCounter(Counter):
+    '''
+    Counter shared with the forked processes, the label values have to be declared.
+    '''
+
+    def __init__(self, name, description, label, values):
+        super(SharedCounter, self).__init__(name, description, (label,))
+        self._values = {(value,): Value('Q', 0) for value in values}
+
+    def inc(self, amount=1, **labels):
+        counter = self._values[self._key(labels)]
+        with counter.get_lock():
+            counter.value += amount
+
+    def samples(self):
+        return [("", key, None, counter.value) for key, counter in sorted(self._values.items())]
+
+    def snapshot(self):
+        return {",".join(key): counter.value for key, counter in self._values.items()}
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, description, labels=(), function=None):
+        super(Gauge, self).__init__(name, description, labels)
+        self._values = {}
+        # the values collected when the metrics are read (e.g. queue sizes)
+        self._functions = {}
+        if function is not None:
+            self.set_function(function)
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function, **labels):
+        self._functions[self._key(labels)] = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _collect(self):
+        for key, function in list(self._functions.items()):
+            try:
+                self._values[key] = function()
+            except (NotImplementedError, OSError):
+                # qsize() is not available on every platform
+                pass
+
+    def samples(self):
+        self._collect()
+        with self._lock:
+            return [("", key, None, value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        self._collect()
+        return super(Gauge, self).snapshot()
+
+
+class Timer(object):
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(perf_counter() - self._start, **self._labels)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts (the last is +Inf), sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def time(self, **labels):
+        '''Context manager observing the duration of the block'''
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket
+                    samples.append(("_bucket", key, ("le", format_value(float(bound))), cumulative))
+                samples.append(("_sum", key, None, total))
+                samples.append(("_count", key, None, count))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                ",".join(key) if key else "": {
+                    "count": count,
+                    "sum": total,
+                    "buckets": dict(zip([format_value(float(bound)) for bound in self.buckets + (float("inf"),)],
+                                        counts))
+                }
+                for key, (counts, total, count) in self._values.items()
+            }
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric already registered: %s" % metric.name)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        '''The metrics in Prometheus text format'''
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+
+def counter(name, description, labels=()):
+    return REGISTRY.register(Counter(name, description, labels))
+
+
+def shared_counter(name, description, label, values):
+    return REGISTRY.register(SharedCounter(name, description, label, values))
+
+
+def gauge(name, description, labels=(), function=None):
+    return REGISTRY.register(Gauge(name, description, labels, function))
+
+
+def histogram(name, description, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, description, labels, buckets))
+
+
+# the database is used by several components
+DB_COMMIT_DURATION = histogram("argus_db_commit_seconds", "Duration of the database commits", ("component",))
+
+
+def commit(session, component):
+    '''Commit the session and measure the duration'''
+    with DB_COMMIT_DURATION.time(component=component):
+        session.commit()
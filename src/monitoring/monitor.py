@@ -4,16 +4,19 @@ Created on 2017. aug. 28.
 @author: gkovacs
 '''
 
-from datetime import datetime
+from array import array
 import logging
 
+from math import nan
 from os import environ
 from threading import Thread, Event
-from time import sleep
-from eventlet.queue import Empty
+from queue import Empty
 
-from models import db, Alert, Sensor
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import Sensor, Zone
 import monitoring.alert
+import repository
 
 from monitoring.adapters.power import PowerAdapter
 from monitoring.adapters.sensor import SensorAdapter
@@ -21,19 +24,42 @@ from monitoring.constants import THREAD_MONITOR, LOG_MONITOR, MONITORING_STARTUP
     ARM_DISARM, MONITOR_STOP, MONITOR_ARM_AWAY, ARM_AWAY, MONITORING_ARMED,\
     MONITOR_ARM_STAY, ARM_STAY, MONITOR_DISARM, MONITORING_READY,\
     MONITOR_UPDATE_CONFIG, MONITORING_UPDATING_CONFIG, MONITORING_INVALID_CONFIG,\
-    MONITORING_SABOTAGE, ALERT_AWAY, ALERT_STAY, ALERT_SABOTAGE
+    MONITORING_SABOTAGE, ALERT_AWAY, ALERT_STAY, ALERT_SABOTAGE, CONFIG_SENSOR,\
+    CONFIG_ZONE
 from monitoring.socket_io import send_system_state_change, send_sensors_state, \
-    send_arm_state, send_alert_state, send_syren_state
-from monitoring import storage
+    send_arm_state, send_alert_state, send_syren_state, send_sensor_state, scope_stream
+from monitoring import database, journal, metrics, startup, storage
+from monitoring.calibration import Calibration
+from monitoring.clock import SystemClock
+from monitoring.history import SensorHistory
+from monitoring.recorder import SampleRecorder, get_samples_path
+from monitoring.scheduler import TickScheduler
+from monitoring.snapshot import Snapshot, SnapshotWriter, State, get_snapshot_path
 
 
-MEASUREMENT_CYCLES = 2
-MEASUREMENT_TIME = 3
 TOLERANCE = float(environ['TOLERANCE'])
+# period of the ticks (sec)
+SAMPLE_PERIOD = 1 / int(environ['SAMPLE_RATE'])
+# time budgets of the phases of a tick
+PHASE_BUDGETS = {
+    'check_power': 0.05 * SAMPLE_PERIOD,
+    'scan_sensors': 0.5 * SAMPLE_PERIOD,
+    'handle_alerts': 0.25 * SAMPLE_PERIOD,
+    # writing the snapshot (only on change)
+    'save_state': 0.2 * SAMPLE_PERIOD
+}
+# number of samples for measuring the references
+CALIBRATION_SAMPLES = int(environ['CALIBRATION_SAMPLES'])
+# tolerance of a calibrated sensor in the multiple of the measured noise
+NOISE_FACTOR = 5
+# number of samples kept in the sample buffer
+SAMPLE_BUFFER_SIZE = int(environ['SAMPLE_BUFFER_SIZE'])
 
 # 2000.01.01 00:00:00
 DEFAULT_DATETIME = 946684800
 
+TICK_DURATION = metrics.histogram("argus_monitor_tick_seconds", "Duration of the monitor ticks")
+
 
 def is_close(a, b, tolerance=0.0):
     return abs(a - b) < tolerance
@@ -44,12 +70,14 @@ class Monitor(Thread):
     classdocs
     '''
 
-    def __init__(self, actions):
+    def __init__(self, actions, clock=None, state=None):
         '''
-        Constructor
+        Constructor, the monitoring continues from the state of the last run if given
         '''
         super(Monitor, self).__init__(name=THREAD_MONITOR)
         self._logger = logging.getLogger(LOG_MONITOR)
+        self._clock = clock or SystemClock()
+        self._scheduler = TickScheduler(LOG_MONITOR, SAMPLE_PERIOD, self._clock, PHASE_BUDGETS)
         self._sensorAdapter = SensorAdapter()
         self._powerAdapter = PowerAdapter()
         self._actions = actions
@@ -59,20 +87,33 @@ class Monitor(Thread):
         self._alerts = {}
         self._stop_alert = Event()
         self._db_session = None
+        # the last raw values of the channels (NaN if not monitored)
+        self._samples = array('f', [nan] * self._sensorAdapter.channel_count)
+        self._recorder = None
+        self._history = None
+        self._calibration = None
+        self._snapshot_writer = SnapshotWriter(Snapshot(get_snapshot_path()))
+        # the state is saved only if it changes (see save_state)
+        self._state_fingerprint = None
+        self._restored_state = state
+        # deadlines of the sensor alerts of the last run (used at the first tick)
+        self._restored_deadlines = {}
 
         self._logger.info('Monitoring created')
         storage.set('state', MONITORING_STARTUP)
         storage.set('arm', ARM_DISARM)
 
     def run(self):
+        startup.wait_for(startup.COMPONENT_MONITOR)
         self._logger.info('Monitoring started')
-        self._db_session = db.create_scoped_session()
-
-        # wait some seconds to build up socket IO connection before emit messages
-        sleep(5)
+        self._snapshot_writer.start()
+        self._db_session = database.create_session()
+        self._recorder = SampleRecorder(get_samples_path(), self._sensorAdapter.channel_count, SAMPLE_BUFFER_SIZE)
+        self._history = SensorHistory(channel_count=self._sensorAdapter.channel_count)
 
-        # remove invalid state items from db before startup
-        self.cleanup_database()
+        if self._restored_state is None:
+            # remove invalid state items from db before startup
+            self.cleanup_database()
 
         # initialize state
         send_alert_state(None)
@@ -80,49 +121,75 @@ class Monitor(Thread):
         send_arm_state(ARM_DISARM)
 
         self.load_sensors()
+        if self._restored_state is not None:
+            self.restore_state(self._restored_state)
+        startup.ready(startup.COMPONENT_MONITOR)
 
+        self._scheduler.start()
         while True:
-            try:
-                action = self._actions.get(True, 1 / int(environ['SAMPLE_RATE']))
-                self._logger.debug("Action: %s" % action)
-                if action == MONITOR_STOP:
-                    break
-                elif action == MONITOR_ARM_AWAY:
-                    storage.set('arm', ARM_AWAY)
-                    send_arm_state(ARM_AWAY)
-                    storage.set('state', MONITORING_ARMED)
-                    send_system_state_change(MONITORING_ARMED)
-                    self._stop_alert.clear()
-                elif action == MONITOR_ARM_STAY:
-                    storage.set('arm', ARM_STAY)
-                    send_arm_state(ARM_STAY)
-                    storage.set('state', MONITORING_ARMED)
-                    send_system_state_change(MONITORING_ARMED)
-                    self._stop_alert.clear()
-                elif action == MONITOR_DISARM:
-                    current_state = storage.get('state')
-                    current_arm = storage.get('arm')
-                    if current_state == MONITORING_ARMED and current_arm in (ARM_AWAY, ARM_STAY) or \
-                       current_state == MONITORING_SABOTAGE:
-                        storage.set('arm', ARM_DISARM)
-                        send_arm_state(ARM_DISARM)
-                        storage.set('state', MONITORING_READY)
-                        send_system_state_change(MONITORING_READY)
-                    self._stop_alert.set()
+            # handle the actions until the next tick is due
+            timeout = self._scheduler.time_left()
+            if timeout > 0:
+                try:
+                    action = self._actions.get(True, timeout)
+                    self._logger.debug("Action: %s", action)
+                    if action == MONITOR_STOP:
+                        break
+
+                    self.handle_action(action)
+                    self.save_state()
                     continue
-                elif action == MONITOR_UPDATE_CONFIG:
-                    self.load_sensors()
-            except Empty:
-                pass
+                except Empty:
+                    pass
 
-            self.check_power()
-            self.scan_sensors()
-            self.handle_alerts()
+            with TICK_DURATION.time():
+                self._scheduler.run_tick(self.tick)
 
         self._stop_alert.set()
         self._db_session.close()
+        self._recorder.close()
+        self._history.close()
+        self._snapshot_writer.stop()
         self._logger.info("Monitoring stopped")
 
+    def handle_action(self, action):
+        if action == MONITOR_ARM_AWAY:
+            storage.set('arm', ARM_AWAY)
+            send_arm_state(ARM_AWAY)
+            storage.set('state', MONITORING_ARMED)
+            send_system_state_change(MONITORING_ARMED)
+            self._stop_alert.clear()
+        elif action == MONITOR_ARM_STAY:
+            storage.set('arm', ARM_STAY)
+            send_arm_state(ARM_STAY)
+            storage.set('state', MONITORING_ARMED)
+            send_system_state_change(MONITORING_ARMED)
+            self._stop_alert.clear()
+        elif action == MONITOR_DISARM:
+            current_state = storage.get('state')
+            current_arm = storage.get('arm')
+            if current_state == MONITORING_ARMED and current_arm in (ARM_AWAY, ARM_STAY) or \
+               current_state == MONITORING_SABOTAGE:
+                storage.set('arm', ARM_DISARM)
+                send_arm_state(ARM_DISARM)
+                storage.set('state', MONITORING_READY)
+                send_system_state_change(MONITORING_READY)
+            self._stop_alert.set()
+        elif action == MONITOR_UPDATE_CONFIG:
+            self.load_sensors()
+        elif type(action) is dict and action['action'] == MONITOR_UPDATE_CONFIG:
+            self.update_sensors(action['changes'])
+
+    def tick(self):
+        with self._scheduler.phase('check_power'):
+            self.check_power()
+        with self._scheduler.phase('scan_sensors'):
+            self.scan_sensors()
+        with self._scheduler.phase('handle_alerts'):
+            self.handle_alerts()
+        with self._scheduler.phase('save_state'):
+            self.save_state()
+
     def check_power(self):
         # load the value once fron the adapter
         new_power_source = self._powerAdapter.source_type
@@ -139,11 +206,11 @@ class Monitor(Thread):
             self._logger.info("Power outage ended!")
         self._power_source = new_power_source
 
-    def validate_sensor_config(self):
+    def validate_sensor_config(self, sensors=None):
         self._logger.debug("Validating config...")
         channels = set()
-        for sensor in self._sensors:
-            if sensor.channel in channels:
+        for sensor in self._sensors if sensors is None else sensors:
+            if sensor.channel in channels or not 0 <= sensor.channel < self._sensorAdapter.channel_count:
                 self._logger.debug("Channels: %s", channels)
                 return False
             else:
@@ -158,11 +225,11 @@ class Monitor(Thread):
         send_sensors_state(None)
         send_system_state_change(MONITORING_UPDATING_CONFIG)
 
-        # TODO: wait a little bit to see status for debug
-        sleep(3)
-
         # !!! delete old sensors before load again
         self._sensors = []
+        self._calibration = None
+        for channel in range(len(self._samples)):
+            self._samples[channel] = nan
         self._sensors = self._db_session.query(Sensor).filter_by(deleted=False).all()
         self._logger.debug("Sensors reloaded!")
 
@@ -179,7 +246,7 @@ class Monitor(Thread):
             send_system_state_change(MONITORING_INVALID_CONFIG)
         elif self.has_uninitialized_sensor():
             self._logger.info("Found sensor(s) without reference value")
-            self.calibrate_sensors()
+            self.start_calibration()
             storage.set('state', MONITORING_READY)
             send_system_state_change(MONITORING_READY)
         else:
@@ -188,14 +255,74 @@ class Monitor(Thread):
 
         send_sensors_state(False)
 
-    def calibrate_sensors(self):
-        self._logger.info("Initialize sensor references...")
-        new_references = self.measure_sensor_references()
-        if len(new_references) == self._sensorAdapter.channel_count:
-            self._logger.info("New references: %s", new_references)
-            self.save_sensor_references(new_references)
+    def update_sensors(self, changes):
+        '''
+        Apply the changes of the sensors and zones on the loaded configuration
+        without stopping the monitoring. The alerts of the other sensors are kept.
+        '''
+        if self._sensors is None or storage.get('state') == MONITORING_INVALID_CONFIG:
+            self.load_sensors()
+            return
+
+        sensors = {sensor.id: sensor for sensor in self._sensors}
+        for change in changes:
+            self._logger.debug("Configuration change: %s", change)
+            if change['entity'] == CONFIG_SENSOR:
+                sensor = self._db_session.query(Sensor).get(change['id'])
+                if sensor is not None:
+                    self._db_session.refresh(sensor)
+
+                if sensor is None or sensor.deleted:
+                    sensors.pop(change['id'], None)
+                    self.remove_alert(change['id'], cancel=True)
+                else:
+                    sensors[sensor.id] = sensor
+            elif change['entity'] == CONFIG_ZONE:
+                zone = self._db_session.query(Zone).get(change['id'])
+                if zone is not None:
+                    self._db_session.refresh(zone)
+
+        new_sensors = sorted(sensors.values(), key=lambda sensor: sensor.channel)
+        if len(new_sensors) > self._sensorAdapter.channel_count or not self.validate_sensor_config(new_sensors):
+            # fall back to the full reload which reports the invalid configuration
+            self.load_sensors()
+            return
+
+        # the channels of the removed or moved sensors are not monitored any more
+        channels = set(sensor.channel for sensor in new_sensors)
+        for channel in range(len(self._samples)):
+            if channel not in channels:
+                self._samples[channel] = nan
+
+        self._sensors = new_sensors
+        self._logger.info("Sensors updated!")
+        # restart the calibration with the current channels, the removed channels wouldn't finish it
+        if self.has_uninitialized_sensor():
+            self.start_calibration()
         else:
-            self._logger.error("Error measure values! %s", self._references)
+            self._calibration = None
+
+        send_sensors_state(any(sensor.alert for sensor in self._sensors))
+
+    def start_calibration(self):
+        '''
+        Measure the references of the new sensors from the next samples,
+        the other sensors are monitored in the meantime.
+        '''
+        channels = [sensor.channel for sensor in self._sensors if sensor.reference_value is None]
+        self._logger.info("Initialize sensor references on channels: %s", channels)
+        self._calibration = Calibration(channels, CALIBRATION_SAMPLES)
+
+    def calibrate_sensors(self):
+        '''Collect the samples for the calibration and save the results when finished'''
+        self._calibration.add(self._samples)
+        if not self._calibration.finished:
+            return
+
+        results = self._calibration.results()
+        self._calibration = None
+        self._logger.info("New references (reference, noise): %s", results)
+        self.save_sensor_references(results)
 
     def has_uninitialized_sensor(self):
         for sensor in self._sensors:
@@ -204,72 +331,143 @@ class Monitor(Thread):
 
         return False
 
-    def cleanup_database(self):
-        changed = False
-        for sensor in self._db_session.query(Sensor).all():
-            if sensor.alert:
-                sensor.alert = False
-                changed = True
-                self._logger.debug('Cleared sensor')
-
-        for alert in self._db_session.query(Alert).filter_by(end_time=None).all():
-            alert.end_time = datetime.fromtimestamp(DEFAULT_DATETIME)
-            self._logger.debug('Cleared alert')
-            changed = True
-
-        if changed:
-            self._logger.debug('Cleared db')
-            self._db_session.commit()
-        else:
-            self._logger.debug('Cleared nothing')
-
-    def save_sensor_references(self, references):
+    def get_state(self):
+        return State(
+            arm=storage.get('arm'),
+            state=storage.get('state'),
+            alert=monitoring.alert.SyrenAlert.get_active_alert(),
+            deadlines={sensor_id: (alert['alert']._alert_type, alert['alert'].deadline)
+                       for sensor_id, alert in self._alerts.items() if alert['alert'].is_alive()},
+            sensor_alerts=sum(1 << sensor.channel for sensor in self._sensors if sensor.alert)
+        )
+
+    def save_state(self):
+        '''Hand the state to the snapshot writer if it changed (written in the background)'''
+        active_alert = monitoring.alert.SyrenAlert.get_active_alert()
+        fingerprint = (storage.get('arm'), storage.get('state'), active_alert and active_alert['id'],
+                       tuple(sensor_id for sensor_id, alert in self._alerts.items() if alert['alert'].is_alive()),
+                       tuple((sensor.channel, sensor.alert) for sensor in self._sensors))
+        if fingerprint == self._state_fingerprint:
+            return
+
+        self._state_fingerprint = fingerprint
+        self._snapshot_writer.save(self.get_state())
+
+    def restore_state(self, state):
+        '''
+        Continue the monitoring after a crash or a restart: the arm state, the alerting sensors,
+        the open alert and the remaining delays of the sensor alerts are restored.
+        '''
+        alert_id = state.alert['id'] if state.alert else None
+        # the alerts not saved in the snapshot ended with the last run
+        closed = repository.close_open_alerts(self._db_session, state.time, keep_alert_id=alert_id)
         for sensor in self._sensors:
-            sensor.reference_value = references[sensor.channel]
-            self._db_session.commit()
+            sensor.alert = state.is_alerting(sensor.channel)
+        metrics.commit(self._db_session, "monitor")
+        send_sensors_state(any(sensor.alert for sensor in self._sensors))
+
+        if state.arm == ARM_AWAY:
+            self.handle_action(MONITOR_ARM_AWAY)
+        elif state.arm == ARM_STAY:
+            self.handle_action(MONITOR_ARM_STAY)
+        if state.state == MONITORING_SABOTAGE:
+            storage.set('state', MONITORING_SABOTAGE)
+            send_system_state_change(MONITORING_SABOTAGE)
+
+        self._restored_deadlines = dict(state.deadlines)
+        if alert_id is not None:
+            self._stop_alert.clear()
+            monitoring.alert.SyrenAlert.start_syren(state.alert['type'], monitoring.alert.SensorAlert._sensor_queue,
+                                                    self._stop_alert, self._clock, alert_id)
+
+        self._logger.info("State restored (arm: %s, alert: %s, pending sensor alerts: %s, closed alerts: %s)",
+                          state.arm, alert_id, len(state.deadlines), closed)
 
-    def measure_sensor_references(self):
-        measurements = []
-        for cycle in range(MEASUREMENT_CYCLES):
-            measurements.append(self._sensorAdapter.get_values())
-            sleep(MEASUREMENT_TIME)
+    def cleanup_database(self):
+        sensors = repository.clear_sensor_alerts(self._db_session)
+        alerts = repository.close_open_alerts(self._db_session, DEFAULT_DATETIME)
 
-        self._logger.debug("Measured values: %s", measurements)
+        if sensors or alerts:
+            self._logger.debug('Cleared db (sensors: %s, alerts: %s)', sensors, alerts)
+            metrics.commit(self._db_session, "monitor")
+        else:
+            self._logger.debug('Cleared nothing')
 
+    def save_sensor_references(self, results):
+        '''Save the references and the tolerances of the calibrated sensors in one transaction'''
         references = {}
-        for channel in range(self._sensorAdapter.channel_count):
-            value_sum = 0
-            for cycle in range(MEASUREMENT_CYCLES):
-                value_sum += measurements[cycle][channel]
-            references[channel] = value_sum / MEASUREMENT_CYCLES
+        for sensor in self._sensors:
+            if sensor.channel in results:
+                reference, noise = results[sensor.channel]
+                tolerance = max(TOLERANCE, NOISE_FACTOR * noise)
+                # the loaded sensors are not flushed again
+                set_committed_value(sensor, 'reference_value', reference)
+                set_committed_value(sensor, 'tolerance', tolerance)
+                references[sensor.id] = (reference, tolerance)
 
-        return list(references.values())
+        repository.save_sensor_references(self._db_session, references)
+        metrics.commit(self._db_session, "monitor")
 
     def scan_sensors(self):
         changes = False
         found_alert = False
-        for sensor in self._sensors:
-            value = self._sensorAdapter.get_value(sensor.channel)
+        # the chips of the different buses are read in parallel
+        values = self._sensorAdapter.get_values([sensor.channel for sensor in self._sensors])
+        for sensor, value in zip(self._sensors, values):
+            self._samples[sensor.channel] = value
+            if sensor.reference_value is None:
+                # calibration in progress
+                continue
+
             # self._logger.debug("Sensor({}): R:{} -> V:{}".format(sensor.channel, sensor.reference_value, value))
-            if not is_close(value, sensor.reference_value, TOLERANCE):
+            if not is_close(value, sensor.reference_value, sensor.tolerance or TOLERANCE):
                 if not sensor.alert:
                     self._logger.debug('Alert on channel: %s, (changed %s -> %s)',
                                        sensor.channel, sensor.reference_value, value)
                     sensor.alert = True
+                    journal.record(journal.EVENT_SENSOR, sensor.id, 1)
+                    send_sensor_state(sensor.id, sensor.zone_id, sensor.channel, True)
                     changes = True
             else:
                 if sensor.alert:
                     self._logger.debug('Cleared alert on channel: %s', sensor.channel)
                     sensor.alert = False
+                    journal.record(journal.EVENT_SENSOR, sensor.id, 0)
+                    send_sensor_state(sensor.id, sensor.zone_id, sensor.channel, False)
                     changes = True
 
             if sensor.alert:
                 found_alert = True
 
+        timestamp = self._clock.time()
+        self._recorder.write(timestamp, self._samples)
+        self._history.add(timestamp, self._samples)
+        if scope_stream.active:
+            scope_stream.publish(timestamp, self._samples)
+
+        if self._calibration:
+            self.calibrate_sensors()
+
         if changes:
-            self._db_session.commit()
+            metrics.commit(self._db_session, "monitor")
             send_sensors_state(found_alert)
 
+    def remove_alert(self, sensor_id, cancel=False):
+        '''
+        Forget the alert of the sensor, the cancelled alert doesn't start the syren after its delay
+        (the syren started already is not stopped)
+        '''
+        alert = self._alerts.pop(sensor_id, None)
+        if alert is None:
+            return
+
+        if cancel:
+            alert['alert'].cancel()
+        if alert['alert']._alert_type == ALERT_SABOTAGE:
+            # stop sabotage
+            storage.set('state', MONITORING_READY)
+            send_system_state_change(MONITORING_READY)
+
     def handle_alerts(self):
         '''
         Checking for alerting sensors if armed
@@ -294,17 +492,21 @@ class Monitor(Thread):
                     delay = sensor.zone.stay_delay
 
                 if alert_type:
-                    self._alerts[sensor.id] = {'alert': monitoring.alert.SensorAlert(sensor.id, delay, alert_type, self._stop_alert)}
+                    restored = self._restored_deadlines.get(sensor.id)
+                    if restored is not None and restored[0] == alert_type:
+                        # the restart doesn't extend the delay
+                        delay = max(0, restored[1] - self._clock.time())
+                    self._alerts[sensor.id] = {'alert': monitoring.alert.SensorAlert(
+                        sensor.id, delay, alert_type, self._stop_alert, self._clock)}
                     self._alerts[sensor.id]['alert'].start()
                     changes = True
                     self._stop_alert.clear()
             elif not sensor.alert and sensor.id in self._alerts:
-                if self._alerts[sensor.id]['alert']._alert_type == ALERT_SABOTAGE:
-                    # stop sabotage
-                    storage.set('state', MONITORING_READY)
-                    send_system_state_change(MONITORING_READY)
-                del self._alerts[sensor.id]
+                self.remove_alert(sensor.id)
+
+        if self._restored_deadlines:
+            self._restored_deadlines = {}
 
         if changes:
             self._logger.debug("Save sensor changes")
-            self._db_session.commit()
+            metrics.commit(self._db_session, "monitor")
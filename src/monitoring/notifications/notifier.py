@@ -1,15 +1,14 @@
-import json
 import logging
 import os
 import smtplib
 from queue import Empty
 from smtplib import SMTPException
 from threading import Thread
-from time import sleep
 
-from models import db, Option
+from monitoring import metrics, options, startup
 from monitoring.constants import (LOG_NOTIFIER, MONITOR_STOP,
-                                  MONITOR_UPDATE_CONFIG, THREAD_NOTIFIER)
+                                  MONITOR_UPDATE_CONFIG, MONITOR_UPDATE_OPTION,
+                                  THREAD_NOTIFIER)
 from monitoring.notifications.templates import (ALERT_STARTED_EMAIL,
                                                 ALERT_STARTED_SMS,
                                                 ALERT_STOPPED_EMAIL,
@@ -39,6 +38,9 @@ Messages
 ALERT_STARTED = "alert_started"
 ALERT_STOPPED = "alert_stopped"
 
+DELIVERIES = metrics.counter("argus_notifier_deliveries_total", "Outcome of sending the notifications", ("outcome",))
+PENDING_MESSAGES = metrics.gauge("argus_notifier_pending_messages", "Number of notifications waiting for sending")
+
 '''
 options = {
     "subscriptions": {
@@ -96,20 +98,16 @@ class Notifier(Thread):
         self._gsm = GSM()
         self._messages = []
         self._options = None
-        self._db_session = None
 
     def run(self):
+        startup.wait_for(startup.COMPONENT_NOTIFIER)
         self._logger.info("Notifier started...")
 
-        # --------------------------------------------------------------
-        # Workaround to avoid hanging of keypad process on create_engine
-        sleep(5)
-        # --------------------------------------------------------------
-        self._db_session = db.create_scoped_session()
         self._options = self.get_options()
         self._logger.info("Subscription configuration: %s", self._options['subscriptions'])
 
         self._gsm.setup()
+        startup.ready(startup.COMPONENT_NOTIFIER)
         while True:
             message = None
             try:
@@ -124,9 +122,15 @@ class Notifier(Thread):
                     break
                 elif message == MONITOR_UPDATE_CONFIG:
                     self._options = self.get_options()
-                    self._gsm.destroy()
-                    self._gsm = GSM()
-                    self._gsm.setup()
+                    self.reset_gsm()
+            elif type(message) is dict and message.get('action') == MONITOR_UPDATE_OPTION:
+                if message['name'] == 'notifications':
+                    self._options = self.get_options()
+                    if message['section'] == 'gsm':
+                        self.reset_gsm()
+            elif type(message) is dict and 'action' in message:
+                # the sensor and zone changes don't affect the notifications
+                pass
             elif message is not None:
                 message['retry'] = 0
                 self._messages.append(message)
@@ -136,24 +140,30 @@ class Notifier(Thread):
                 message = self._messages[0]
                 if self.send_message(message):
                     self._messages.pop(0)
+                    DELIVERIES.inc(outcome="sent")
                 else:
                     message['retry'] += 1
                     if message['retry'] >= Notifier.MAX_RETRY:
                         self._logger.debug("Deleted message after max retry (%s): %s",
                                            Notifier.MAX_RETRY, self._messages.pop(0))
+                        DELIVERIES.inc(outcome="dropped")
+                    else:
+                        DELIVERIES.inc(outcome="retry")
+            PENDING_MESSAGES.set(len(self._messages))
 
-        self._db_session.close()
         self._logger.info("Notifier stopped")
 
     def get_options(self):
-        options = {}
+        notifier_options = {}
         for section_name in ('email', 'gsm', 'subscriptions'):
-            section = self._db_session.query(Option).filter_by(
-                name='notifications', section=section_name).first()
-            options[section_name] = json.loads(
-                section.value) if section else ''
-        self._logger.info("Notifier loaded subscriptions: {}".format(options))
-        return options
+            notifier_options[section_name] = options.get('notifications', section_name, '')
+        self._logger.info("Notifier loaded subscriptions: %s", notifier_options)
+        return notifier_options
+
+    def reset_gsm(self):
+        self._gsm.destroy()
+        self._gsm = GSM()
+        self._gsm.setup()
 
     def send_message(self, message):
         self._logger.info("Sending message: %s", message)
@@ -0,0 +1,72 @@
+'''
+Cache of the options (Option rows) in the monitoring service.
+
+All the options are loaded at once on the first use and kept parsed in
+memory. When an option is saved the REST API sends its new version over IPC,
+the IPC server invalidates the cache and publishes the change for the
+components (e.g. the notifier). The repeated and the older changes are
+ignored. The cache is reloaded on the next read.
+'''
+import json
+from threading import Lock
+
+from models import Option
+from monitoring import database
+
+_lock = Lock()
+# (name, section) => (version, parsed value)
+_options = None
+# incremented on invalidation, a load started before it is not kept
+_generation = 0
+
+
+def parse(value):
+    return json.loads(value) if value else None
+
+
+def load():
+    '''Load all the options from the database'''
+    global _options
+    generation = _generation
+    db_session = database.create_session()
+    try:
+        options = {(option.name, option.section): (option.version or 0, parse(option.value))
+                   for option in db_session.query(Option).all()}
+    finally:
+        db_session.close()
+
+    with _lock:
+        if generation == _generation:
+            _options = options
+    return options
+
+
+def get(name, section, default=None):
+    '''The parsed value of the option, the dictionaries are copied (top level only)'''
+    options = _options if _options is not None else load()
+    _, value = options.get((name, section), (None, None))
+    if value is None:
+        return default
+    return dict(value) if isinstance(value, dict) else value
+
+
+def get_version(name, section):
+    options = _options if _options is not None else load()
+    return options.get((name, section), (None, None))[0]
+
+
+def invalidate(name=None, section=None, version=None):
+    '''
+    Drop the cache if the option changed (all options without name),
+    returns False if the version was already loaded.
+    '''
+    global _options, _generation
+    with _lock:
+        if _options is not None and name is not None and version is not None:
+            loaded_version = _options.get((name, section), (None, None))[0]
+            if loaded_version is not None and loaded_version >= version:
+                return False
+
+        _options = None
+        _generation += 1
+        return True
@@ -0,0 +1,189 @@
+'''
+Sampling profiler of the monitoring service.
+
+The stacks of all the threads of the process are sampled periodically and
+counted by the name of the thread (Monitor, Alert, Notifier, ...). It can be
+started and stopped over IPC without restarting the service, the result is
+available in collapsed stack (flamegraph.pl) or speedscope format.
+
+The keypad runs in a separate process, it's not covered.
+'''
+import logging
+import re
+import sys
+from datetime import datetime
+from os import path
+from threading import Event, Lock, Thread, enumerate as enumerate_threads, get_ident
+from time import monotonic
+
+from monitoring.constants import (LOG_PROFILER, PROFILE_COLLAPSED,
+                                  PROFILE_SPEEDSCOPE, THREAD_PROFILER)
+
+# sampling period (sec)
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.001
+# the profiler stops automatically (sec)
+DEFAULT_DURATION = 60
+MAX_DURATION = 600
+# frames of a stack from the bottom
+MAX_DEPTH = 64
+
+# the threads with the same role are grouped ("Thread-12 (process_request)" => "Thread (process_request)")
+THREAD_NUMBER = re.compile(r"-\d+")
+
+_profiler = None
+_lock = Lock()
+
+
+class SamplingProfiler(Thread):
+    '''
+    Count the stacks of the other threads in every interval.
+    '''
+
+    def __init__(self, interval=DEFAULT_INTERVAL, duration=DEFAULT_DURATION):
+        super(SamplingProfiler, self).__init__(name=THREAD_PROFILER, daemon=True)
+        self._logger = logging.getLogger(LOG_PROFILER)
+        self.interval = max(MIN_INTERVAL, interval)
+        self.duration = min(MAX_DURATION, duration)
+        self._stop_event = Event()
+        self._lock = Lock()
+        # (thread name, (frame, ...)) => count, a frame is (function, file, first line)
+        self._stacks = {}
+        self.samples = 0
+        self.start_time = None
+        self.end_time = None
+
+    def run(self):
+        self._logger.info("Profiler started (interval=%ss, duration=%ss)", self.interval, self.duration)
+        self.start_time = datetime.now()
+        own_thread = get_ident()
+        deadline = monotonic() + self.duration
+        while not self._stop_event.wait(self.interval) and monotonic() < deadline:
+            self.sample(own_thread)
+
+        self.end_time = datetime.now()
+        self._logger.info("Profiler stopped after %s samples", self.samples)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def sample(self, own_thread=None):
+        names = {thread.ident: THREAD_NUMBER.sub("", thread.name) for thread in enumerate_threads()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            stacks.append((names.get(thread_id, "Unknown"), tuple(stack)))
+
+        with self._lock:
+            for key in stacks:
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def get_stacks(self):
+        with self._lock:
+            return dict(self._stacks)
+
+    @property
+    def status(self):
+        return {
+            "running": self.is_alive(),
+            "interval": self.interval,
+            "duration": self.duration,
+            "samples": self.samples,
+            "start": self.start_time.isoformat() if self.start_time else None,
+            "end": self.end_time.isoformat() if self.end_time else None
+        }
+
+
+def frame_name(frame):
+    function, filename, line = frame
+    return "%s (%s:%s)" % (function, path.basename(filename), line)
+
+
+def to_collapsed(stacks):
+    '''One line per stack: "thread;bottom frame;...;top frame count"'''
+    lines = []
+    for (thread, stack), count in sorted(stacks.items()):
+        lines.append("%s %d" % (";".join([thread] + [frame_name(frame) for frame in stack]), count))
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(stacks, interval, name="argus monitoring"):
+    '''Sampled profiles by thread name (https://www.speedscope.app/file-format-schema.json)'''
+    frames = []
+    frame_indexes = {}
+    profiles = {}
+    for (thread, stack), count in sorted(stacks.items()):
+        sample = []
+        for frame in stack:
+            if frame not in frame_indexes:
+                frame_indexes[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            sample.append(frame_indexes[frame])
+
+        profile = profiles.setdefault(thread, {
+            "type": "sampled",
+            "name": thread,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": 0,
+            "samples": [],
+            "weights": []
+        })
+        profile["samples"].append(sample)
+        profile["weights"].append(count * interval)
+        profile["endValue"] += count * interval
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "argus",
+        "shared": {"frames": frames},
+        "profiles": [profiles[thread] for thread in sorted(profiles)]
+    }
+
+
+def start(interval=DEFAULT_INTERVAL, duration=DEFAULT_DURATION):
+    '''Start a new profiling, the result of the previous one is dropped'''
+    global _profiler
+    with _lock:
+        if _profiler is not None and _profiler.is_alive():
+            return False
+
+        _profiler = SamplingProfiler(interval, duration)
+        _profiler.start()
+        return True
+
+
+def stop():
+    with _lock:
+        if _profiler is None or not _profiler.is_alive():
+            return False
+
+        _profiler.stop()
+        _profiler.join()
+        return True
+
+
+def get_status():
+    profiler = _profiler
+    return profiler.status if profiler is not None else {"running": False, "samples": 0}
+
+
+def get_profile(format=PROFILE_COLLAPSED):
+    '''The result of the last (or the running) profiling'''
+    profiler = _profiler
+    if profiler is None:
+        return None
+
+    if format == PROFILE_SPEEDSCOPE:
+        return to_speedscope(profiler.get_stacks(), profiler.interval)
+    return to_collapsed(profiler.get_stacks())
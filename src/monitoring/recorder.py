@@ -0,0 +1,256 @@
+'''
+Recording the raw sensor samples into a memory mapped ring buffer.
+
+The monitor writes the samples of every tick into a file with fixed size
+(the oldest samples are overwritten) which survives the restart of the service.
+The REST server or a command line tool can map the same file read only.
+
+    PYTHONPATH=src python -m monitoring.recorder --around "2019-10-27 10:00:00"
+'''
+import argparse
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from math import isnan
+from operator import le
+
+SAMPLES_FILE = "samples.bin"
+
+HEADER = struct.Struct("<8sIIQ104s")
+HEADER_SIZE = 128
+HEAD_OFFSET = 16
+MAGIC = b"ARGUSRNG"
+VERSION = 1
+
+
+def get_samples_path():
+    return os.path.join(os.environ["DATA_PATH"], SAMPLES_FILE)
+
+
+class MappedRing(object):
+    '''
+    Fixed number of records in a memory mapped file.
+
+    The records are stored by columns (name, typecode, width) and the
+    columns are available as memoryview arrays. The head is the number of
+    records written since the file was created, the record of an index
+    is in the slot index % capacity.
+    '''
+
+    def __init__(self, path, columns=None, capacity=None, readonly=False):
+        self._path = path
+        self._readonly = readonly
+        self._file = None
+        self._map = None
+        self._head = None
+        self.columns = {}
+
+        if readonly:
+            self._open_readonly()
+        else:
+            self._open_writable(columns, capacity)
+
+    @staticmethod
+    def layout(columns):
+        return ";".join("%s:%s:%d" % column for column in columns)
+
+    @staticmethod
+    def parse_layout(layout):
+        columns = []
+        for column in layout.split(";"):
+            name, typecode, width = column.split(":")
+            columns.append((name, typecode, int(width)))
+        return columns
+
+    @staticmethod
+    def file_size(columns, capacity):
+        size = HEADER_SIZE
+        for _, typecode, width in columns:
+            size += MappedRing.column_size(typecode, width, capacity)
+        return size
+
+    @staticmethod
+    def column_size(typecode, width, capacity):
+        # keep the columns aligned to 8 bytes
+        size = struct.calcsize(typecode) * width * capacity
+        return size + (-size % 8)
+
+    def _open_writable(self, columns, capacity):
+        layout = MappedRing.layout(columns)
+        size = MappedRing.file_size(columns, capacity)
+        if os.path.dirname(self._path):
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+        self._file = open(self._path, "a+b")
+        self._file.seek(0)
+        header = self._file.read(HEADER_SIZE)
+        reuse = False
+        if len(header) == HEADER_SIZE and os.fstat(self._file.fileno()).st_size == size:
+            magic, version, stored_capacity, _, stored_layout = HEADER.unpack_from(header)
+            reuse = magic == MAGIC and version == VERSION and stored_capacity == capacity and \
+                stored_layout.rstrip(b"\0").decode() == layout
+
+        if not reuse:
+            self._file.truncate(0)
+            self._file.truncate(size)
+
+        self._map = mmap.mmap(self._file.fileno(), size)
+        if not reuse:
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, capacity, 0, layout.encode())
+
+        self._map_columns(columns, capacity)
+
+    def _open_readonly(self):
+        self._file = open(self._path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, capacity, _, layout = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Invalid ring buffer file: %s" % self._path)
+
+        self._map_columns(MappedRing.parse_layout(layout.rstrip(b"\0").decode()), capacity)
+
+    def _map_columns(self, columns, capacity):
+        self.capacity = capacity
+        self.widths = {}
+        self._head = memoryview(self._map)[HEAD_OFFSET:HEAD_OFFSET + 8].cast("Q")
+        offset = HEADER_SIZE
+        for name, typecode, width in columns:
+            size = MappedRing.column_size(typecode, width, capacity)
+            length = struct.calcsize(typecode) * width * capacity
+            self.columns[name] = memoryview(self._map)[offset:offset + length].cast(typecode)
+            self.widths[name] = width
+            offset += size
+
+    @property
+    def head(self):
+        return self._head[0]
+
+    def commit(self):
+        '''Publish the record in the slot of the head'''
+        self._head[0] += 1
+
+    def first(self, head=None):
+        '''The index of the oldest available record'''
+        head = self.head if head is None else head
+        return max(0, head - self.capacity)
+
+    def close(self):
+        if self._map is None:
+            return
+
+        self._head.release()
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        if not self._readonly:
+            self._map.flush()
+        self._map.close()
+        self._file.close()
+        self._map = None
+
+
+class SampleRecorder(object):
+    '''
+    Write the timestamped raw samples of all the channels (float32) into the ring.
+    '''
+
+    def __init__(self, path, channel_count, capacity):
+        self._channel_count = channel_count
+        self._ring = MappedRing(path, [("time", "d", 1), ("values", "f", channel_count)], capacity)
+        self._times = self._ring.columns["time"]
+        self._values = self._ring.columns["values"]
+        self._capacity = capacity
+
+    def write(self, timestamp, values):
+        '''
+        Store the values (array of float32 with the size of the channel count)
+        without allocating new buffers.
+        '''
+        slot = self._ring.head % self._capacity
+        self._times[slot] = timestamp
+        start = slot * self._channel_count
+        self._values[start:start + self._channel_count] = values
+        self._ring.commit()
+
+    def close(self):
+        self._times = self._values = None
+        self._ring.close()
+
+
+class SampleReader(object):
+    '''
+    Read the samples from the ring buffer mapped read only.
+    '''
+
+    def __init__(self, path=None):
+        self._ring = MappedRing(path or get_samples_path(), readonly=True)
+        self._times = self._ring.columns["time"]
+        self._values = self._ring.columns["values"]
+        self.channel_count = self._ring.widths["values"]
+
+    def _times_of(self, first, head):
+        '''The timestamps of the records [first, head) in the order of the writing'''
+        times = self._times.tolist()
+        slot = first % self._ring.capacity
+        return (times[slot:] + times[:slot])[:head - first]
+
+    def window(self, start, end):
+        '''
+        The samples between the two timestamps as list of (timestamp, [values]).
+        The values of the not monitored channels are None.
+        '''
+        head = self._ring.head
+        first = self._ring.first(head)
+        times = self._times_of(first, head)
+        if all(map(le, times, times[1:])):
+            positions = range(bisect_left(times, start), bisect_right(times, end))
+        else:
+            # the wall clock was set back (e.g. NTP after the boot), the times are not ordered
+            positions = [position for position, timestamp in enumerate(times) if start <= timestamp <= end]
+
+        samples = []
+        capacity = self._ring.capacity
+        for position in positions:
+            slot = (first + position) % capacity
+            offset = slot * self.channel_count
+            values = [None if isnan(value) else value
+                      for value in self._values[offset:offset + self.channel_count].tolist()]
+            samples.append((first + position, times[position], values))
+
+        # drop the samples overwritten by the writer while reading
+        oldest = self._ring.first()
+        return [(timestamp, values) for index, timestamp, values in samples if index >= oldest]
+
+    def around(self, timestamp, before=30, after=30):
+        return self.window(timestamp - before, timestamp + after)
+
+    def close(self):
+        self._times = self._values = None
+        self._ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the recorded raw sensor samples")
+    parser.add_argument("-a", "--around", help="Time of the event (YYYY-MM-DD HH:MM:SS), default: now")
+    parser.add_argument("-b", "--before", type=float, default=30, help="Seconds before the event")
+    parser.add_argument("-f", "--after", type=float, default=30, help="Seconds after the event")
+    parser.add_argument("-p", "--path", help="Sample file, default: $DATA_PATH/" + SAMPLES_FILE)
+    args = parser.parse_args()
+
+    timestamp = datetime.strptime(args.around, "%Y-%m-%d %H:%M:%S").timestamp() if args.around \
+        else datetime.now().timestamp()
+
+    reader = SampleReader(args.path)
+    print("time;" + ";".join("CH%02d" % (channel + 1) for channel in range(reader.channel_count)))
+    for sample_time, values in reader.around(timestamp, args.before, args.after):
+        print("%s;%s" % (
+            datetime.fromtimestamp(sample_time).isoformat(sep=" ", timespec="milliseconds"),
+            ";".join("" if value is None else "%.4f" % value for value in values)
+        ))
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
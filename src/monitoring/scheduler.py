@@ -0,0 +1,92 @@
+'''
+Fixed-rate tick scheduler.
+
+The ticks are scheduled on the monotonic clock at the multiples of the period
+from the start, so the processing time and the work between the ticks don't
+shift the following ticks. A tick started after the next deadline is an
+overrun: the missed ticks are skipped and counted instead of running them
+late in a burst.
+
+The phases of a tick can have time budgets, exceeding them is counted and
+logged.
+'''
+import logging
+from time import perf_counter
+
+from monitoring import metrics
+
+OVERRUNS = metrics.counter("argus_scheduler_overruns_total", "Missed ticks of the schedulers", ("scheduler",))
+LATENESS = metrics.gauge("argus_scheduler_lateness_seconds", "Delay of the last tick from its deadline",
+                         ("scheduler",))
+PHASE_DURATION = metrics.histogram("argus_scheduler_phase_seconds", "Duration of the phases of the ticks",
+                                   ("scheduler", "phase"))
+OVER_BUDGET = metrics.counter("argus_scheduler_over_budget_total", "Phases exceeding their time budget",
+                              ("scheduler", "phase"))
+
+
+class Phase(object):
+
+    def __init__(self, scheduler, name):
+        self._scheduler = scheduler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._scheduler.phase_finished(self._name, perf_counter() - self._start)
+
+
+class TickScheduler(object):
+    '''
+    Ticks with a fixed period on the monotonic clock of the given clock object.
+    '''
+
+    def __init__(self, name, period, clock, budgets=None):
+        self._logger = logging.getLogger(name)
+        self.name = name
+        self.period = period
+        self._clock = clock
+        # phase name => max duration (sec)
+        self._budgets = budgets or {}
+        self._deadline = None
+        self.ticks = 0
+        self.overruns = 0
+
+    def start(self):
+        '''The first tick is due now'''
+        self._deadline = self._clock.monotonic()
+
+    def time_left(self):
+        '''Time until the next tick (sec), 0 if it's due'''
+        return max(0.0, self._deadline - self._clock.monotonic())
+
+    def run_tick(self, tick):
+        '''Run the due tick and schedule the next one'''
+        now = self._clock.monotonic()
+        LATENESS.set(now - self._deadline, scheduler=self.name)
+        tick()
+        self.ticks += 1
+
+        self._deadline += self.period
+        now = self._clock.monotonic()
+        if now >= self._deadline:
+            # skip the missed ticks, the next one is on the original grid
+            missed = int((now - self._deadline) // self.period) + 1
+            self._deadline += missed * self.period
+            self.overruns += missed
+            OVERRUNS.inc(missed, scheduler=self.name)
+            self._logger.warning("Tick overrun, skipped %s tick(s)", missed)
+
+    def phase(self, name):
+        '''Context manager measuring a phase of the tick'''
+        return Phase(self, name)
+
+    def phase_finished(self, name, duration):
+        PHASE_DURATION.observe(duration, scheduler=self.name, phase=name)
+        budget = self._budgets.get(name)
+        if budget is not None and duration > budget:
+            OVER_BUDGET.inc(scheduler=self.name, phase=name)
+            self._logger.warning("Phase %s exceeded its budget: %.1fms > %.1fms", name, duration * 1000, budget * 1000)
@@ -0,0 +1,92 @@
+'''
+Live stream of the raw sensor values ("scope") for the installation and the troubleshooting.
+
+The clients subscribe with the rate they want to display (frames per second,
+up to the sample rate of the monitor). The subscribers of the same rate are
+in one group (Socket.IO room), a frame is built once per tick and sent to the
+groups which are due (decimation). The stream is active only while somebody
+is subscribed, the monitor doesn't publish the samples otherwise.
+
+Frame (little endian): timestamp (float64), number of channels (uint32) and
+the last values of the channels (float32, NaN if the channel isn't monitored).
+'''
+import struct
+from threading import Lock
+
+FRAME_HEADER = struct.Struct("<dI")
+MIN_RATE = 0.1
+
+
+class RateGroup(object):
+
+    def __init__(self, room, rate):
+        self.room = room
+        self.period = 1.0 / rate
+        self.next_time = 0.0
+        self.subscribers = set()
+
+
+class ScopeStream(object):
+    '''
+    Subscriptions and decimation of the scope stream, the frames are sent by the emit function (room, frame).
+    '''
+
+    def __init__(self, emit, max_rate):
+        self._emit = emit
+        self._max_rate = max_rate
+        # jitter of the ticks (half of the sample period)
+        self._tolerance = 0.5 / max_rate
+        self._lock = Lock()
+        # room => RateGroup
+        self._groups = {}
+        # subscriber => room
+        self._subscribers = {}
+        # checked by the monitor on every tick
+        self.active = False
+
+    def subscribe(self, subscriber, rate):
+        '''Subscribe with the rate (limited), returns the room of the rate'''
+        rate = min(max(float(rate), MIN_RATE), self._max_rate)
+        room = "scope:%g" % rate
+        with self._lock:
+            self._unsubscribe(subscriber)
+            group = self._groups.get(room)
+            if group is None:
+                group = self._groups[room] = RateGroup(room, rate)
+            group.subscribers.add(subscriber)
+            self._subscribers[subscriber] = room
+            self.active = True
+        return room
+
+    def unsubscribe(self, subscriber):
+        '''Returns the room of the subscriber (None if not subscribed)'''
+        with self._lock:
+            return self._unsubscribe(subscriber)
+
+    def _unsubscribe(self, subscriber):
+        room = self._subscribers.pop(subscriber, None)
+        if room is not None:
+            group = self._groups[room]
+            group.subscribers.discard(subscriber)
+            if not group.subscribers:
+                del self._groups[room]
+            # stop the stream after the last subscriber
+            self.active = bool(self._subscribers)
+        return room
+
+    def publish(self, timestamp, samples):
+        '''Send the samples (array of float32) to the groups which are due'''
+        rooms = []
+        with self._lock:
+            for group in self._groups.values():
+                if timestamp + self._tolerance >= group.next_time:
+                    group.next_time += group.period
+                    if group.next_time <= timestamp:
+                        # late or the first frame
+                        group.next_time = timestamp + group.period
+                    rooms.append(group.room)
+
+        if rooms:
+            frame = FRAME_HEADER.pack(timestamp, len(samples)) + samples.tobytes()
+            for room in rooms:
+                self._emit(room, frame)
@@ -0,0 +1,198 @@
+'''
+Persisted state of the monitoring for resuming after a crash or a restart.
+
+The monitor saves the arm state, the active (syren) alert, the deadlines of
+the pending sensor alerts and the alerting channels (bitmap) when they
+change. The file is replaced atomically: the new snapshot is written into a
+temporary file which is synced to the disk before renaming it over the old
+one, so the file is always complete (the old or the new state).
+
+The snapshot is a fixed header (magic, version, length, CRC32) and the state
+in compact JSON, a damaged or unknown file is ignored. The monitor hands the
+changed states to a writer thread, the loop doesn't wait for the disk.
+'''
+import json
+import logging
+import os
+import struct
+import zlib
+from threading import Condition, Thread
+from time import perf_counter
+
+from monitoring import metrics
+from monitoring.constants import ARM_DISARM, LOG_MONITOR, THREAD_SNAPSHOT
+
+SNAPSHOT_FILE = "state.snapshot"
+
+HEADER = struct.Struct("<8sHHII")
+MAGIC = b"ARGUSSNP"
+VERSION = 1
+
+WRITE_DURATION = metrics.histogram("argus_snapshot_write_seconds", "Duration of saving the state snapshot")
+
+
+def get_snapshot_path():
+    return os.path.join(os.environ["DATA_PATH"], SNAPSHOT_FILE)
+
+
+class State(object):
+    '''
+    State of the monitoring, the times are epoch seconds (wall clock).
+    '''
+
+    def __init__(self, arm=ARM_DISARM, state=None, alert=None, deadlines=None, sensor_alerts=0, time=None):
+        self.arm = arm
+        self.state = state
+        # active alert: {"id": alert id, "type": alert type}
+        self.alert = alert
+        # pending sensor alerts: sensor id => (alert type, deadline)
+        self.deadlines = deadlines or {}
+        # bit of the channel is set if the sensor is alerting
+        self.sensor_alerts = sensor_alerts
+        # saving the state
+        self.time = time
+
+    def is_alerting(self, channel):
+        return bool(self.sensor_alerts >> channel & 1)
+
+    def encode(self):
+        '''The content without the time of saving'''
+        return json.dumps({
+            "arm": self.arm,
+            "state": self.state,
+            "alert": self.alert,
+            "deadlines": [[sensor_id, alert_type, deadline]
+                          for sensor_id, (alert_type, deadline) in sorted(self.deadlines.items())],
+            "sensor_alerts": self.sensor_alerts
+        }, separators=(",", ":"), sort_keys=True).encode()
+
+    @staticmethod
+    def decode(content, time):
+        data = json.loads(content.decode())
+        return State(
+            arm=data["arm"],
+            state=data["state"],
+            alert=data["alert"],
+            deadlines={sensor_id: (alert_type, deadline) for sensor_id, alert_type, deadline in data["deadlines"]},
+            sensor_alerts=data["sensor_alerts"],
+            time=time
+        )
+
+
+class Snapshot(object):
+    '''
+    Saving the state into the file, the same state is not written again.
+    '''
+
+    def __init__(self, path):
+        self._logger = logging.getLogger(LOG_MONITOR)
+        self._path = path
+        self._content = None
+
+    def load(self):
+        '''The saved state or None if it's missing or invalid'''
+        try:
+            with open(self._path, "rb") as snapshot_file:
+                data = snapshot_file.read()
+            time = os.stat(self._path).st_mtime
+        except OSError:
+            return None
+
+        if len(data) < HEADER.size:
+            self._logger.warning("Snapshot is truncated: %s", self._path)
+            return None
+
+        magic, version, _, length, checksum = HEADER.unpack_from(data)
+        content = data[HEADER.size:HEADER.size + length]
+        if magic != MAGIC or version != VERSION or len(content) != length or zlib.crc32(content) != checksum:
+            self._logger.warning("Invalid snapshot: %s", self._path)
+            return None
+
+        try:
+            state = State.decode(content, time)
+        except (ValueError, KeyError, TypeError):
+            self._logger.warning("Invalid snapshot content: %s", self._path)
+            return None
+
+        self._content = content
+        return state
+
+    def save(self, state):
+        '''Save the state if changed, returns True if the file was written'''
+        content = state.encode()
+        if content == self._content:
+            return False
+
+        with WRITE_DURATION.time():
+            temporary_path = self._path + ".tmp"
+            with open(temporary_path, "wb") as snapshot_file:
+                snapshot_file.write(HEADER.pack(MAGIC, VERSION, 0, len(content), zlib.crc32(content)))
+                snapshot_file.write(content)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temporary_path, self._path)
+            self._sync_directory()
+
+        self._content = content
+        return True
+
+    def _sync_directory(self):
+        '''Persist the rename'''
+        directory = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class SnapshotWriter(Thread):
+    '''
+    Saving the states in the background, only the last one of the states waiting for the writing is saved.
+    '''
+
+    def __init__(self, snapshot):
+        super(SnapshotWriter, self).__init__(name=THREAD_SNAPSHOT, daemon=True)
+        self._logger = logging.getLogger(LOG_MONITOR)
+        self._snapshot = snapshot
+        self._condition = Condition()
+        self._state = None
+        self._stopped = False
+
+    def save(self, state):
+        '''Replace the state waiting for the writing'''
+        with self._condition:
+            self._state = state
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._state is None and not self._stopped:
+                    self._condition.wait()
+                state, self._state = self._state, None
+                stopped = self._stopped
+
+            if state is not None:
+                try:
+                    self._snapshot.save(state)
+                except OSError:
+                    self._logger.exception("Failed to save the state snapshot")
+            if stopped:
+                break
+
+    def stop(self):
+        '''Save the waiting state and stop'''
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.join()
+
+
+def load():
+    '''Load the state of the last run'''
+    start = perf_counter()
+    state = Snapshot(get_snapshot_path()).load()
+    if state is not None:
+        logging.getLogger(LOG_MONITOR).info("State snapshot loaded in %.1fms (arm: %s, alert: %s)",
+                                            (perf_counter() - start) * 1000, state.arm, state.alert)
+    return state
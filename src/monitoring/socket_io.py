@@ -7,13 +7,19 @@ Created on 2017. szept. 23.
 import logging
 import os
 import socketio
+from collections import deque
+from threading import Lock
+from time import time
 
 
-from flask import Flask
+from flask import Flask, Response
+from werkzeug.serving import make_server
 from urllib.parse import parse_qs
 from jose import jwt
 import jose.exceptions
 
+from monitoring import journal, metrics, startup
+from monitoring.scope import ScopeStream
 from monitoring.constants import LOG_SOCKETIO
 
 
@@ -24,16 +30,67 @@ sio = socketio.Server(
 logger = logging.getLogger(LOG_SOCKETIO)
 logging.getLogger("werkzeug").setLevel(logging.DEBUG)
 
+EMIT_DURATION = metrics.histogram("argus_socketio_emit_seconds", "Duration of emitting the messages", ("event",))
+RECONNECTS = metrics.counter("argus_socketio_reconnects_total", "State sent to the connecting clients", ("type",))
+
+# the events are emitted with a sequence number: (message, sequence)
+# the sequence numbers restart with the service, the epoch identifies the run
+EPOCH = int(time())
+# messages kept for replaying to the reconnecting clients
+RING_SIZE = 256
+STATE_EVENT = "state_snapshot"
+
+# the clients subscribe to the topics (rooms) when connecting: ?topics=arm,system
+TOPIC_ARM = "arm"
+TOPIC_SYSTEM = "system"
+TOPIC_ALERT = "alert"
+TOPIC_SYREN = "syren"
+TOPIC_SENSORS = "sensors"
+# the alerts of the sensors of a zone (e.g. "zone:1")
+TOPIC_ZONE = "zone:%d"
+TOPICS = {
+    "arm_state_change": TOPIC_ARM,
+    "system_state_change": TOPIC_SYSTEM,
+    "alert_state_change": TOPIC_ALERT,
+    "syren_state_change": TOPIC_SYREN,
+    "sensors_state_change": TOPIC_SENSORS
+}
+# without the topics parameter
+DEFAULT_TOPICS = frozenset(TOPICS.values())
+
+_lock = Lock()
+_sequence = 0
+# (sequence, topic, message type, message)
+_ring = deque(maxlen=RING_SIZE)
+# the last messages: message type or (message type, key) => (topic, message)
+_state = {}
+# sid => topics
+_subscriptions = {}
+# raw values of the channels for the subscribers (binary frames, not in the sequence)
+SCOPE_EVENT = "scope_frame"
+# content type of the Prometheus text format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
 
 def start_socketio():
+    startup.wait_for(startup.COMPONENT_SOCKETIO)
     app = Flask(__name__)
+    app.add_url_rule("/metrics", "metrics", get_metrics)
     # wrap Flask application with socketio's middleware
     app.wsgi_app = socketio.WSGIApp(sio, app.wsgi_app)
-    app.run(
-        threaded=True,
+    server = make_server(
         host=os.environ["MONITOR_HOST"],
         port=int(os.environ["MONITOR_PORT"]),
+        app=app,
+        threaded=True
     )
+    # the socket is listening, the clients can connect
+    startup.ready(startup.COMPONENT_SOCKETIO)
+    server.serve_forever()
+
+
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 @sio.on("connect")
@@ -60,10 +117,112 @@ def connect(sid, environ):
         )
         return False
 
+    topics = parse_topics(qs.get("topics"))
+    with _lock:
+        _subscriptions[sid] = topics
+
+    try:
+        epoch = int(qs["epoch"][0])
+        last_sequence = int(qs["last_sequence"][0])
+    except (KeyError, ValueError):
+        epoch = last_sequence = None
+    # send the state after the connection is established
+    sio.start_background_task(send_state, sid, epoch, last_sequence)
+
+
+def parse_topics(values):
+    '''The topics of the query parameter (comma separated), the unknown topics are ignored'''
+    if not values:
+        return DEFAULT_TOPICS
+
+    topics = set()
+    for topic in ",".join(values).split(","):
+        topic = topic.strip()
+        if topic in DEFAULT_TOPICS or topic.startswith("zone:") and topic[5:].isdigit():
+            topics.add(topic)
+    return frozenset(topics)
+
+
+def send_state(sid, epoch=None, last_sequence=None):
+    '''
+    Replay the missed messages of the topics if the client reconnects with the sequence number
+    of its last message which is still in the ring, otherwise send the whole state of the topics.
+    The client joins the rooms of the topics after it, the messages are emitted under the same lock,
+    so no message is missed or duplicated.
+    '''
+    with _lock:
+        topics = _subscriptions.get(sid)
+        if topics is None:
+            # disconnected
+            return
+
+        if can_replay(epoch, last_sequence):
+            missed = [item for item in _ring if item[0] > last_sequence and item[1] in topics]
+            logger.debug("Replay %s message(s) to %s", len(missed), sid)
+            RECONNECTS.inc(type="replay")
+            for sequence, _, message_type, message in missed:
+                sio.emit(message_type, (message, sequence), to=sid)
+        else:
+            logger.debug("Send state to %s", sid)
+            RECONNECTS.inc(type="state")
+            state = {}
+            sensors = []
+            for key, (topic, message) in _state.items():
+                if topic not in topics:
+                    continue
+                if isinstance(key, tuple):
+                    sensors.append(message)
+                else:
+                    state[key] = message
+            sio.emit(STATE_EVENT, {"epoch": EPOCH, "sequence": _sequence, "state": state, "sensors": sensors},
+                     to=sid)
+
+        for topic in topics:
+            sio.enter_room(sid, topic)
+
+
+def can_replay(epoch, last_sequence):
+    '''The messages after the last sequence number of the same run are in the ring'''
+    if epoch != EPOCH or last_sequence is None or last_sequence > _sequence:
+        return False
+    first = _ring[0][0] if _ring else _sequence + 1
+    return first <= last_sequence + 1
+
 
 @sio.on("disconnect")
 def disconnect(sid):
     logging.getLogger("SocketIO").info('Disconnected "%s"', sid)
+    with _lock:
+        _subscriptions.pop(sid, None)
+    scope_stream.unsubscribe(sid)
+
+
+@sio.on("scope_subscribe")
+def scope_subscribe(sid, data):
+    '''Start streaming the frames with the requested rate: {"rate": 5}'''
+    try:
+        rate = float((data or {}).get("rate", SCOPE_MAX_RATE))
+    except (AttributeError, TypeError, ValueError):
+        logger.warning("Invalid scope subscription from %s: %s", sid, data)
+        return
+    previous_room = scope_stream.unsubscribe(sid)
+    if previous_room:
+        sio.leave_room(sid, previous_room)
+    room = scope_stream.subscribe(sid, rate)
+    sio.enter_room(sid, room)
+    logger.info("Scope subscription of %s: %s", sid, room)
+
+
+@sio.on("scope_unsubscribe")
+def scope_unsubscribe(sid, data=None):
+    room = scope_stream.unsubscribe(sid)
+    if room:
+        sio.leave_room(sid, room)
+        logger.info("Scope unsubscription of %s", sid)
+
+
+def send_scope_frame(room, frame):
+    sio.emit(SCOPE_EVENT, frame, room=room)
 
 
 def send_alert_state(arm_state):
@@ -71,6 +230,7 @@ def send_alert_state(arm_state):
 
 
 def send_arm_state(arm_state):
+    journal.record_arm(arm_state)
     send_message("arm_state_change", arm_state)
 
 
@@ -78,16 +238,41 @@ def send_sensors_state(sensors_state):
     send_message("sensors_state_change", sensors_state)
 
 
+def send_sensor_state(sensor_id, zone_id, channel, alert):
+    '''Alert of a sensor for the subscribers of its zone'''
+    send_message("sensor_state_change", {"sensorId": sensor_id, "zoneId": zone_id, "channel": channel, "alert": alert},
+                 topic=TOPIC_ZONE % zone_id, key=sensor_id)
+
+
 def send_syren_state(syren_state):
+    journal.record(journal.EVENT_SYREN, value=-1 if syren_state is None else int(syren_state))
     send_message("syren_state_change", syren_state)
 
 
 def send_system_state_change(system_state):
+    journal.record_state(system_state)
     send_message("system_state_change", system_state)
 
 
-def send_message(message_type, message):
+def send_message(message_type, message, topic=None, key=None):
+    '''
+    Emit the message to the subscribers of the topic (by the message type by default),
+    the last message of the type (and the key) is kept for the state of the new clients
+    '''
+    global _sequence
     logging.getLogger("SocketIO").debug(
         "Sending message: %s -> %s", message_type, message
     )
-    sio.emit(message_type, message)
+    topic = topic or TOPICS[message_type]
+    # the messages are emitted in the order of their sequence numbers
+    with _lock, EMIT_DURATION.time(event=message_type):
+        _sequence += 1
+        _ring.append((_sequence, topic, message_type, message))
+        _state[message_type if key is None else (message_type, key)] = (topic, message)
+        # serialized once for the room
+        sio.emit(message_type, (message, _sequence), room=topic)
+
+
+# the monitor can't sample faster
+SCOPE_MAX_RATE = int(os.environ["SAMPLE_RATE"])
+scope_stream = ScopeStream(send_scope_frame, SCOPE_MAX_RATE)
@@ -0,0 +1,81 @@
+'''
+Startup graph of the components of the monitoring service.
+
+Every component declares its dependencies, waits for them at the beginning of
+its run and signals when it's ready. The events and the timings are shared
+with the keypad process (declare the components before starting it).
+'''
+import logging
+from multiprocessing import Event, Value
+from time import monotonic
+
+from monitoring.constants import LOG_SERVICE
+
+# components
+COMPONENT_KEYPAD = 'keypad'
+COMPONENT_DATABASE = 'database'
+COMPONENT_SOCKETIO = 'socketio'
+COMPONENT_IPC = 'ipc'
+COMPONENT_MONITOR = 'monitor'
+COMPONENT_NOTIFIER = 'notifier'
+
+# waiting for the dependencies of a component (sec)
+DEPENDENCY_TIMEOUT = 30
+
+_started = monotonic()
+_components = {}
+
+
+class Component(object):
+
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+        self.event = Event()
+        # time of the phases (sec) since the startup, negative if not reached
+        self.waiting = Value('d', -1.0, lock=False)
+        self.started = Value('d', -1.0, lock=False)
+        self.ready = Value('d', -1.0, lock=False)
+
+
+def declare(name, dependencies=()):
+    _components[name] = Component(name, tuple(dependencies))
+
+
+def wait_for(name):
+    '''Wait until the dependencies of the component are ready'''
+    component = _components[name]
+    component.waiting.value = monotonic() - _started
+    for dependency in component.dependencies:
+        if not _components[dependency].event.wait(DEPENDENCY_TIMEOUT):
+            logging.getLogger(LOG_SERVICE).warning("Startup: %s is not ready for %s after %ss",
+                                                   dependency, name, DEPENDENCY_TIMEOUT)
+    component.started.value = monotonic() - _started
+
+
+def ready(name):
+    component = _components[name]
+    component.ready.value = monotonic() - _started
+    component.event.set()
+    logging.getLogger(LOG_SERVICE).info("Startup: %s ready at %.3fs (waited %.3fs, started in %.3fs)",
+                                        name, component.ready.value,
+                                        max(0.0, component.started.value - component.waiting.value),
+                                        max(0.0, component.ready.value - component.started.value))
+
+
+def is_ready(name):
+    return _components[name].event.is_set()
+
+
+def get_timings():
+    '''The phases of the components (sec since the startup, None if not reached)'''
+    timings = {}
+    for name, component in _components.items():
+        timings[name] = {
+            'dependencies': list(component.dependencies),
+            'waiting': component.waiting.value if component.waiting.value >= 0 else None,
+            'started': component.started.value if component.started.value >= 0 else None,
+            'ready': component.ready.value if component.ready.value >= 0 else None
+        }
+
+    return timings
@@ -0,0 +1,51 @@
+'''
+Set-based writes of the REST server and the monitoring service.
+
+The functions update the rows with single UPDATE statements instead of
+loading the objects, the caller commits. The loaded objects of the session
+are not synchronized, reload them after the commit if needed.
+'''
+from datetime import datetime
+
+from models import Alert, Sensor
+
+
+def clear_sensor_alerts(session):
+    '''Clear the alert flag of all the sensors, returns the number of the changed sensors'''
+    return session.query(Sensor) \
+        .filter(Sensor.alert.is_(True)) \
+        .update({Sensor.alert: False}, synchronize_session=False)
+
+
+def close_open_alerts(session, end_time, keep_alert_id=None):
+    '''
+    Set the end time of the unfinished alerts (except the kept one),
+    returns the number of the closed alerts
+    '''
+    if not isinstance(end_time, datetime):
+        end_time = datetime.fromtimestamp(end_time)
+
+    query = session.query(Alert).filter(Alert.end_time.is_(None))
+    if keep_alert_id is not None:
+        query = query.filter(Alert.id != keep_alert_id)
+    return query.update({Alert.end_time: end_time}, synchronize_session=False)
+
+
+def reset_sensor_references(session):
+    '''Remove the references of all the sensors (calibrated again), returns the number of the sensors'''
+    return session.query(Sensor) \
+        .update({Sensor.reference_value: None, Sensor.tolerance: None}, synchronize_session=False)
+
+
+def save_sensor_references(session, references):
+    '''
+    Save the references of the sensors in one batch
+    (dictionary: sensor id => (reference value, tolerance))
+    '''
+    if not references:
+        return
+
+    session.bulk_update_mappings(Sensor, [
+        {"id": sensor_id, "reference_value": reference, "tolerance": tolerance}
+        for sensor_id, (reference, tolerance) in references.items()
+    ])
@@ -7,14 +7,24 @@ import re
 
 import jose.exceptions
 from dateutil.tz import UTC, tzlocal
-from flask import Flask, abort, jsonify, request, send_from_directory
+from flask import Flask, Response, abort, jsonify, request, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from jose import jwt
 
-from monitoring.constants import ROLE_ADMIN, ROLE_USER, USER_TOKEN_EXPIRY
+from monitoring import database
+from monitoring.constants import (CONFIG_CREATED, CONFIG_DELETED, CONFIG_UPDATED,
+                                  PROFILE_COLLAPSED, PROFILE_SPEEDSCOPE,
+                                  ROLE_ADMIN, ROLE_USER, USER_TOKEN_EXPIRY)
 from server.ipc import IPCClient
 from server.version import __version__
-from tools.clock import get_timezone, gettime_hw, gettime_ntp
+from tools.lazy import lazy_import
+
+# used only by rare requests, keep the boot of the workers fast
+clock = lazy_import("tools.clock")
+history = lazy_import("monitoring.history")
+recorder = lazy_import("monitoring.recorder")
+# imports the models which import the server
+repository = lazy_import("repository")
 
 argus_application_folder = os.path.join(
     os.getcwd(), os.environ.get("SERVER_STATIC_FOLDER", "")
@@ -24,16 +34,9 @@ argus_application_folder = os.path.join(
 app = Flask(__name__)
 # app.logger.debug("App folder: %s", argus_application_folder)
 
-POSTGRES = {
-    "user": os.environ.get("DB_USER", None),
-    "pw": os.environ.get("DB_PASSWORD", None),
-    "db": os.environ.get("DB_SCHEMA", None),
-    "host": os.environ.get("DB_HOST", None),
-    "port": os.environ.get("DB_PORT", None),
-}
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    "postgresql://%(user)s:%(pw)s@%(host)s:%(port)s/%(db)s" % POSTGRES
-)
+app.config["SQLALCHEMY_DATABASE_URI"] = database.get_uri()
+if database.is_sqlite():
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.get_engine_options()
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.use_reloader = False
 
@@ -216,6 +219,29 @@ def get_alert():
         return jsonify(None)
 
 
+@app.route("/api/alert/<int:alert_id>/samples", methods=["GET"])
+@authenticated()
+def get_alert_samples(alert_id):
+    alert = Alert.query.get(alert_id)
+    if not alert:
+        abort(404)
+
+    try:
+        before = float(request.args.get("before", 30))
+        after = float(request.args.get("after", 30))
+    except ValueError:
+        abort(400, "Invalid time range")
+
+    try:
+        reader = recorder.SampleReader()
+    except (FileNotFoundError, ValueError):
+        return jsonify([])
+
+    samples = reader.around(alert.start_time.timestamp(), before, after)
+    reader.close()
+    return jsonify([{"time": timestamp, "values": values} for timestamp, values in samples])
+
+
 @app.route("/api/users", methods=["GET", "POST"])
 @authenticated()
 def users():
@@ -322,7 +348,7 @@ def update_sensors():
     db.session.add(sensor)
     db.session.commit()
     ipc_client = IPCClient()
-    ipc_client.update_configuration()
+    ipc_client.update_sensor(sensor.id, CONFIG_CREATED)
     return jsonify(sensor.serialize)
 
 
@@ -330,9 +356,7 @@ def update_sensors():
 @authenticated()
 def sensors_reset_references():
     if request.method == "PUT":
-        for sensor in Sensor.query.all():
-            sensor.reference_value = None
-
+        repository.reset_sensor_references(db.session)
         db.session.commit()
         ipc_client = IPCClient()
         return jsonify(ipc_client.update_configuration())
@@ -351,7 +375,7 @@ def sensor(sensor_id):
         sensor.deleted = True
         db.session.commit()
         ipc_client = IPCClient()
-        ipc_client.update_configuration()
+        ipc_client.update_sensor(sensor_id, CONFIG_DELETED)
         return jsonify(True)
     elif request.method == "PUT":
         try:
@@ -359,7 +383,7 @@ def sensor(sensor_id):
             if sensor.update(request.json):
                 db.session.commit()
                 ipc_client = IPCClient()
-                ipc_client.update_configuration()
+                ipc_client.update_sensor(sensor_id, CONFIG_UPDATED)
             return jsonify(True)
         except AssertionError as error:
             abort(400, error)
@@ -367,6 +391,43 @@ def sensor(sensor_id):
     return jsonify({"error": "unknonw action"})
 
 
+@app.route("/api/sensor/<int:sensor_id>/history", methods=["GET"])
+@authenticated(role=ROLE_USER)
+def sensor_history(sensor_id):
+    sensor = Sensor.query.get(sensor_id)
+    if not sensor:
+        abort(404)
+
+    now = dt.now().timestamp()
+    try:
+        end = float(request.args.get("to", now))
+        start = float(request.args.get("from", end - 3600))
+        resolution = float(request.args["resolution"]) if request.args.get("resolution") else None
+    except ValueError:
+        abort(400, "Invalid time range or resolution")
+
+    try:
+        rollups = history.SensorHistory(readonly=True)
+        if not 0 <= sensor.channel < rollups.channel_count:
+            # the channel is not in the recorded layout
+            rollups.close()
+            raise ValueError("Channel not recorded: %s" % sensor.channel)
+    except (FileNotFoundError, ValueError):
+        return jsonify({"sensorId": sensor.id, "channel": sensor.channel, "resolution": None,
+                        "from": start, "to": end, "points": []})
+
+    resolution, points = rollups.query(sensor.channel, start, end, now, resolution)
+    rollups.close()
+    return jsonify({
+        "sensorId": sensor.id,
+        "channel": sensor.channel,
+        "resolution": resolution,
+        "from": start,
+        "to": end,
+        "points": points
+    })
+
+
 @app.route("/api/sensortypes")
 @authenticated(role=ROLE_USER)
 def sensortypes():
@@ -402,7 +463,7 @@ def update_zones():
     db.session.add(zone)
     db.session.commit()
     ipc_client = IPCClient()
-    ipc_client.update_configuration()
+    ipc_client.update_zone(zone.id, CONFIG_CREATED)
     return jsonify(zone.serialize)
 
 
@@ -416,15 +477,15 @@ def zone(zone_id):
         zone.deleted = True
         db.session.commit()
         ipc_client = IPCClient()
-        ipc_client.update_configuration()
+        ipc_client.update_zone(zone_id, CONFIG_DELETED)
         return jsonify(True)
     elif request.method == "PUT":
         try:
             zone = Zone.query.get(zone_id)
             if zone.update(request.json):
+                db.session.commit()
                 ipc_client = IPCClient()
-                ipc_client.update_configuration()
-            db.session.commit()
+                ipc_client.update_zone(zone_id, CONFIG_UPDATED)
             return jsonify(zone.serialize)
         except AssertionError as error:
             abort(400, error)
@@ -457,6 +518,68 @@ def get_state():
     return jsonify(ipc_client.get_state())
 
 
+@app.route("/api/monitoring/startup", methods=["GET"])
+@authenticated()
+def get_startup():
+    ipc_client = IPCClient()
+    return jsonify(ipc_client.get_startup())
+
+
+@app.route("/api/monitoring/metrics", methods=["GET"])
+@authenticated()
+def get_metrics():
+    ipc_client = IPCClient()
+    return jsonify(ipc_client.get_metrics())
+
+
+@app.route("/api/monitoring/events", methods=["GET"])
+@authenticated()
+def get_events():
+    ipc_client = IPCClient()
+    return jsonify(ipc_client.get_events(request.args.get("since", 0, type=int),
+                                         request.args.get("limit", None, type=int)))
+
+
+@app.route("/api/monitoring/profiler", methods=["GET", "POST", "DELETE"])
+@authenticated()
+def profiler():
+    if request.method == "POST":
+        settings = request.json or {}
+        try:
+            interval, duration = (float(settings[name]) if settings.get(name) is not None else None
+                                  for name in ("interval", "duration"))
+        except (AttributeError, TypeError, ValueError):
+            abort(400, "Invalid interval or duration")
+        if any(value is not None and not 0 < value < float("inf") for value in (interval, duration)):
+            abort(400, "Invalid interval or duration")
+        return jsonify(IPCClient().start_profiler(interval, duration))
+    elif request.method == "DELETE":
+        return jsonify(IPCClient().stop_profiler())
+
+    return jsonify(IPCClient().get_profiler())
+
+
+@app.route("/api/monitoring/profiler/profile", methods=["GET"])
+@authenticated()
+def get_profile():
+    profile_format = request.args.get("format", PROFILE_COLLAPSED)
+    if profile_format not in (PROFILE_COLLAPSED, PROFILE_SPEEDSCOPE):
+        abort(400, "Unknown profile format")
+
+    profile = IPCClient().get_profile(profile_format).get("profile")
+    if profile is None:
+        abort(404, "No profile")
+
+    if profile_format == PROFILE_SPEEDSCOPE:
+        response = jsonify(profile)
+        filename = "argus.speedscope.json"
+    else:
+        response = Response(profile, mimetype="text/plain")
+        filename = "argus.collapsed.txt"
+    response.headers["Content-Disposition"] = "attachment; filename=%s" % filename
+    return response
+
+
 @app.route("/api/config/<string:option>/<string:section>", methods=["GET", "PUT"])
 @authenticated()
 def option(option, section):
@@ -476,7 +599,7 @@ def option(option, section):
             if option == "notifications":
                 if changed:
                     ipc_client = IPCClient()
-                    ipc_client.update_configuration()
+                    ipc_client.update_option(db_option.name, db_option.section, db_option.version)
             elif db_option.name == "network" and db_option.section == "dyndns":
                 if os.environ.get("ARGUS_DEVELOPMENT", "0") == "0":
                     ipc_client = IPCClient()
@@ -497,11 +620,11 @@ def version():
 def get_clock():
     result = {
         "system": dt.now().isoformat(sep=" ")[:19],
-        "hw": gettime_hw(),
-        "timezone": get_timezone(),
+        "hw": clock.gettime_hw(),
+        "timezone": clock.get_timezone(),
     }
 
-    network = gettime_ntp()
+    network = clock.gettime_ntp()
     if network:
         result["network"] = network
     else:
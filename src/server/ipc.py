@@ -8,11 +8,14 @@ import json
 import socket
 from os import environ
 
-from monitoring.constants import (ARM_AWAY, ARM_STAY, MONITOR_ARM_AWAY,
+from monitoring.constants import (ARM_AWAY, ARM_STAY, CONFIG_SENSOR,
+                                  CONFIG_ZONE, MONITOR_ARM_AWAY,
                                   MONITOR_ARM_STAY, MONITOR_DISARM,
-                                  MONITOR_SET_CLOCK, MONITOR_SYNC_CLOCK,
+                                  MONITOR_SET_CLOCK, MONITOR_START_PROFILER,
+                                  MONITOR_STOP_PROFILER, MONITOR_SYNC_CLOCK,
                                   MONITOR_UPDATE_CONFIG, MONITOR_UPDATE_DYNDNS,
-                                  MONITOR_UPDATE_KEYPAD, MONITORING_ERROR)
+                                  MONITOR_UPDATE_KEYPAD, MONITOR_UPDATE_OPTION,
+                                  MONITORING_ERROR)
 
 
 class IPCClient(object):
@@ -56,11 +59,78 @@ class IPCClient(object):
             'action': 'get_state'
         })
 
-    def update_configuration(self):
+    def get_startup(self):
         return self._send_message({
+            'action': 'get_startup'
+        })
+
+    def get_metrics(self):
+        return self._send_message({
+            'action': 'get_metrics'
+        })
+
+    def get_events(self, since=0, limit=None):
+        message = {
+            'action': 'get_events',
+            'since': since
+        }
+        if limit:
+            message['limit'] = limit
+        return self._send_message(message)
+
+    def start_profiler(self, interval=None, duration=None):
+        message = {
+            'action': MONITOR_START_PROFILER
+        }
+        if interval:
+            message['interval'] = interval
+        if duration:
+            message['duration'] = duration
+        return self._send_message(message)
+
+    def stop_profiler(self):
+        return self._send_message({
+            'action': MONITOR_STOP_PROFILER
+        })
+
+    def get_profiler(self):
+        return self._send_message({
+            'action': 'get_profiler'
+        })
+
+    def get_profile(self, format):
+        return self._send_message({
+            'action': 'get_profile',
+            'format': format
+        })
+
+    def update_configuration(self, changes=None):
+        '''
+        Reload the whole configuration or apply only the changes
+        (list of {"entity": CONFIG_SENSOR/CONFIG_ZONE, "id": id, "change": CONFIG_CREATED/UPDATED/DELETED})
+        '''
+        message = {
             'action': MONITOR_UPDATE_CONFIG
+        }
+        if changes:
+            message['changes'] = changes
+        return self._send_message(message)
+
+    def update_option(self, name, section, version):
+        '''Reload the changed option (name/section) in the monitoring service'''
+        return self._send_message({
+            'action': MONITOR_UPDATE_OPTION,
+            'name': name,
+            'section': section,
+            'version': version
         })
 
+    def update_sensor(self, sensor_id, change):
+        return self.update_configuration([{'entity': CONFIG_SENSOR, 'id': sensor_id, 'change': change}])
+
+    def update_zone(self, zone_id, change):
+        return self.update_configuration([{'entity': CONFIG_ZONE, 'id': zone_id, 'change': change}])
+
     def update_keypad(self):
         return self._send_message({
             'action': MONITOR_UPDATE_KEYPAD
@@ -85,8 +155,18 @@ class IPCClient(object):
 
     def _send_message(self, message):
         if self._socket:
-            self._socket.send(json.dumps(message).encode())
-            data = self._socket.recv(1024)
+            self._socket.sendall(json.dumps(message).encode())
+            # the response can be longer than a read (e.g. the metrics)
+            data = b""
+            while True:
+                chunk = self._socket.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+                try:
+                    return json.loads(data.decode())
+                except ValueError:
+                    pass
             return json.loads(data.decode())
         else:
             return {"state": MONITORING_ERROR}
@@ -0,0 +1,39 @@
+'''
+Lazy loading of the heavy or optional modules needed only by rare actions.
+
+    dyndns = lazy_import("dyndns")
+    ...
+    dyndns.update_ip(True)  # the module is imported here
+'''
+import sys
+from importlib import import_module
+
+
+class LazyModule(object):
+    '''
+    Proxy of a module which is imported on the first attribute access.
+    '''
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            # import_module is protected by the import lock
+            module = import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__['_module'] is not None else "not loaded"
+        return "<lazy module '%s' (%s)>" % (self.__dict__['_name'], state)
+
+
+def lazy_import(name):
+    '''The module if it's already imported or a proxy importing it when it's used first'''
+    return sys.modules.get(name) or LazyModule(name)